@@ -1,5 +1,8 @@
+import uuid
 from django.contrib import admin
+from django.db.models import Prefetch
 from . import models
+from . paginators import EstimatedCountPaginator
 
 
 class BookInstanceInline(admin.TabularInline):
@@ -7,36 +10,91 @@ class BookInstanceInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('unique_id',)
     can_delete = False
+    autocomplete_fields = ('reader', )
 
 
 class BookdAdmin(admin.ModelAdmin):
     list_display = ('title', 'author', 'display_genre')
+    list_select_related = ('author', )
+    search_fields = ('title', '=isbn')
+    autocomplete_fields = ('author', )
     inlines = (BookInstanceInline, )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related('genre')
+
+
+class OverdueFilter(admin.SimpleListFilter):
+    title = 'overdue'
+    parameter_name = 'overdue'
+
+    def lookups(self, request, model_admin):
+        return (('yes', 'Yes'), ('no', 'No'))
+
+    def queryset(self, request, queryset):
+        if self.value() in ('yes', 'no'):
+            return queryset.filter(overdue=self.value() == 'yes')
 
 
 class BookInstanceAdmin(admin.ModelAdmin):
-    list_display = ('unique_id', 'book', 'status', 'due_back', 'reader')
-    list_filter = ('status', 'due_back')
+    list_display = ('unique_id', 'book', 'status', 'due_back', 'reader', 'overdue')
+    list_filter = ('status', OverdueFilter, 'due_back')
     readonly_fields = ('unique_id', 'is_overdue') #tuple atskiriam per kableli
-    search_fields = ('unique_id', 'book__title', 'book__author__last_name__exact', 'reader__last_name')
-    list_editable = ('status', 'due_back', 'reader')
+    # a UUID is looked up exactly, see get_search_results
+    search_fields = ('book__title', 'book__author__last_name__exact', 'reader__last_name')
+    # book and reader are not list_editable, every row would render a widget querying them
+    list_editable = ('status', 'due_back')
+    list_select_related = ('book__author', 'reader')
+    autocomplete_fields = ('book', 'reader')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     fieldsets = (
         ('General', {'fields':('unique_id', 'book')}),
         ('Availability', {'fields':('status', 'is_overdue', 'due_back', 'reader')})
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_overdue()
+
+    def get_search_results(self, request, queryset, search_term):
+        try:
+            unique_id = uuid.UUID(search_term.strip())
+        except ValueError:
+            return super().get_search_results(request, queryset, search_term)
+        return queryset.filter(unique_id=unique_id), False
+
+    @admin.display(boolean=True, ordering='overdue')
+    def overdue(self, obj):
+        return obj.overdue
+
 class AuthorAdmin(admin.ModelAdmin):
     list_display = ('first_name', 'last_name', 'display_books')
     list_display_links = ('last_name', ) 
+    search_fields = ('last_name', 'first_name')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(Prefetch('books', queryset=models.Book.objects.only('title', 'author')))
 
 
 class BookReviewAdmin(admin.ModelAdmin):
     list_display=('book', 'reader', 'created_at')
+    list_select_related = ('book__author', 'reader')
+    autocomplete_fields = ('book', 'reader')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class VisitStatAdmin(admin.ModelAdmin):
+    list_display = ('day', 'visits')
+    date_hierarchy = 'day'
 
 
-admin.site.register(models.Author)
+admin.site.register(models.Author, AuthorAdmin)
 admin.site.register(models.Genre)
 admin.site.register(models.Book, BookdAdmin)
 admin.site.register(models.BookInstance, BookInstanceAdmin)
-admin.site.register(models.BookReview, BookReviewAdmin)
\ No newline at end of file
+admin.site.register(models.BookReview, BookReviewAdmin)
+admin.site.register(models.VisitStat, VisitStatAdmin)
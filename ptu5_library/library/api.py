@@ -0,0 +1,159 @@
+import json
+from datetime import datetime, timezone
+from itertools import islice
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.views.decorators.http import condition, require_GET
+from . import autocomplete as type_ahead, images, versions
+from . models import Author, Book, BookInstance, Genre
+from . views import filter_books
+
+# Read-only JSON API. Rows are read with values() and never become model
+# instances. Every response is conditional on the version stamps of the tables
+# it reads, so a client that already has the current data gets a 304 before
+# any query runs.
+
+CHUNK_SIZE = 2000
+AUTOCOMPLETE_LIMIT = 10
+BookGenre = Book.genre.through
+
+
+def conditional(*models):
+    names = [versions.table(model) for model in models]
+
+    def etag(request, *args, **kwargs):
+        return f'v1-{versions.version_key(*names)}'
+
+    def last_modified(request, *args, **kwargs):
+        return datetime.fromtimestamp(max(versions.get_versions(*names).values()) / 1e9, timezone.utc)
+
+    def decorator(view):
+        return require_GET(condition(etag_func=etag, last_modified_func=last_modified)(view))
+    return decorator
+
+
+def stream(request, name, rows):
+    """{"<name>": [...]} encoded a chunk of rows at a time, streamed under WSGI."""
+    def content():
+        yield f'{{"{name}":['
+        separator = ''
+        rows_iter = iter(rows)
+        while chunk := list(islice(rows_iter, CHUNK_SIZE)):
+            yield separator + ','.join(json.dumps(row, cls=DjangoJSONEncoder) for row in chunk)
+            separator = ','
+        yield ']}'
+    if isinstance(request, ASGIRequest):
+        # the ASGI handler of Django 4.1 iterates streamed content in its event
+        # loop, where queries are refused, so the rows are read in the view's thread
+        return HttpResponse(''.join(content()), content_type='application/json')
+    return StreamingHttpResponse(content(), content_type='application/json')
+
+
+def book_genre_ids(book_ids) -> dict:
+    genre_ids = {}
+    for book_id, genre_id in BookGenre.objects.filter(book_id__in=book_ids).values_list('book_id', 'genre_id'):
+        genre_ids.setdefault(book_id, []).append(genre_id)
+    return genre_ids
+
+
+def author_of(row):
+    if row['author_id'] is None:
+        return None
+    return {'id': row['author_id'], 'first_name': row['author__first_name'], 'last_name': row['author__last_name']}
+
+
+def cover_urls(cover_hash):
+    if not cover_hash:
+        return None
+    return {rendition: images.rendition_url(cover_hash, rendition, 'jpg') for rendition in images.RENDITIONS}
+
+
+BOOK_FIELDS = ('id', 'title', 'isbn', 'cover_hash', 'author_id', 'author__first_name', 'author__last_name')
+
+
+def book_rows(queryset):
+    rows = queryset.values(*BOOK_FIELDS).iterator(chunk_size=CHUNK_SIZE)
+    while chunk := list(islice(rows, CHUNK_SIZE)):
+        genre_ids = book_genre_ids([row['id'] for row in chunk])
+        for row in chunk:
+            yield {
+                'id': row['id'],
+                'title': row['title'],
+                'isbn': row['isbn'],
+                'author': author_of(row),
+                'genres': genre_ids.get(row['id'], []),
+                'covers': cover_urls(row['cover_hash']),
+            }
+
+
+def availability(book_id) -> dict:
+    counts = dict(BookInstance.objects.filter(book_id=book_id).values_list('status').annotate(count=Count('id')))
+    return {status: counts.get(status, 0) for status, _ in BookInstance.LOAN_STATUS}
+
+
+# ?available= and the availability sort read the copy counts, which change with the copies
+@conditional(Book, Author, BookInstance)
+def books(request):
+    queryset = filter_books(Book.objects.all(), request.GET)
+    if not request.GET.get('search'):
+        queryset = queryset.order_by('title', 'id')
+    return stream(request, 'books', book_rows(queryset))
+
+
+@conditional(Book, Author, Genre, BookInstance)
+def book(request, pk):
+    row = Book.objects.filter(pk=pk).values(*BOOK_FIELDS, 'summary', 'review_count').first()
+    if row is None:
+        raise Http404('No such book')
+    return JsonResponse({
+        'id': row['id'],
+        'title': row['title'],
+        'isbn': row['isbn'],
+        'summary': row['summary'],
+        'review_count': row['review_count'],
+        'author': author_of(row),
+        'genres': list(Genre.objects.filter(book=pk).values('id', 'name')),
+        'covers': cover_urls(row['cover_hash']),
+        'availability': availability(pk),
+    })
+
+
+@conditional(BookInstance)
+def book_availability(request, pk):
+    if not Book.objects.filter(pk=pk).exists():
+        raise Http404('No such book')
+    return JsonResponse({'id': pk, 'availability': availability(pk)})
+
+
+@conditional(Author)
+def authors(request):
+    queryset = Author.objects.order_by('last_name', 'first_name', 'id').values('id', 'first_name', 'last_name')
+    return stream(request, 'authors', queryset.iterator(chunk_size=CHUNK_SIZE))
+
+
+@conditional(Author, Book)
+def author(request, pk):
+    row = Author.objects.filter(pk=pk).values('id', 'first_name', 'last_name').first()
+    if row is None:
+        raise Http404('No such author')
+    row['books'] = list(Book.objects.filter(author_id=pk).order_by('title', 'id').values('id', 'title'))
+    return JsonResponse(row)
+
+
+@conditional(Genre)
+def genres(request):
+    return JsonResponse({'genres': list(Genre.objects.order_by('name').values('id', 'name'))})
+
+
+@require_GET
+def autocomplete(request):
+    """Titles and authors starting with ?q=, served from the prefix index without queries."""
+    limit = request.GET.get('limit', '')
+    limit = min(int(limit), 50) if limit.isdigit() else AUTOCOMPLETE_LIMIT
+    results = type_ahead.search(request.GET.get('q', ''), limit)
+    for result in results:
+        result['url'] = reverse(result['type'], args=[result['id']])
+    return JsonResponse({'results': results})
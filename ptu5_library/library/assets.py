@@ -0,0 +1,207 @@
+import gzip
+import mimetypes
+import os
+import re
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Static files and uploads. collectstatic writes content-hashed copies of the
+# static files with .gz (and, with the brotli package, .br) variants next to
+# them, so a front server can send them as they are and browsers can keep
+# them forever. When the worker serves them itself it does the same: picks
+# the precompressed variant, answers revalidations with 304 and byte ranges
+# with 206, and streams the file with the server's sendfile.
+
+# content-hashed names never change content
+IMMUTABLE = 'public, max-age=31536000, immutable'
+# unhashed static names, revalidated with the ETag
+REVALIDATE = 'public, no-cache'
+# uploads keep their name when replaced by a file of the same name
+MEDIA = 'public, max-age=86400'
+COMPRESSIBLE = ('.css', '.js', '.svg', '.txt', '.html', '.json', '.map', '.xml', '.ico')
+# the suffix ManifestStaticFilesStorage adds: name.<12 hex digits>.ext
+HASHED = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Hashed static files with precompressed variants."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if not dry_run:
+            for name in set(self.hashed_files.values()):
+                if name.endswith(COMPRESSIBLE):
+                    compress(self.path(name))
+
+    def stored_name(self, name):
+        # before the first collectstatic there is no manifest, use the source files
+        if not self.hashed_files and not self.exists(self.manifest_name):
+            return name
+        return super().stored_name(name)
+
+
+def compress(path) -> list:
+    """Write the variants of path that come out smaller than it, returns their paths."""
+    with open(path, 'rb') as file:
+        data = file.read()
+    variants = {'.gz': gzip.compress(data, 9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data)
+    written = []
+    for suffix, compressed in variants.items():
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as out:
+                out.write(compressed)
+            written.append(path + suffix)
+    return written
+
+
+def byte_range(header, size):
+    """(start, end) of a single byte range, None to send the whole file.
+
+    Raises ValueError when the range lies outside the file.
+    """
+    match = RANGE.match(header or '')
+    if match is None:
+        # absent, malformed or several ranges: the whole file is a valid answer
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last or int(last) == 0:
+            raise ValueError(header)
+        return max(size - int(last), 0), size - 1
+    start, end = int(first), min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+class FileRange:
+    """Reads length bytes of file from where it stands."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def encoding_weights(header) -> dict:
+    """Content codings of an Accept-Encoding header mapped to their q value."""
+    weights = {}
+    for item in (header or '').split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0
+        if coding:
+            weights[coding.lower()] = q
+    return weights
+
+
+def weight(weights, coding) -> float:
+    # * stands for the codings the header does not name
+    return weights.get(coding, weights.get('*', 0))
+
+
+def file_response(request, path, cache_control, encodings=()):
+    """Stream path with validators, a precompressed variant from encodings or a byte range."""
+    served, encoding = path, None
+    weights = encoding_weights(request.headers.get('Accept-Encoding'))
+    # the client's preference first, ours on ties, q=0 refuses a coding
+    for name, suffix in sorted(encodings, key=lambda encoding: -weight(weights, encoding[0])):
+        if weight(weights, name) > 0 and os.path.isfile(path + suffix):
+            served, encoding = path + suffix, name
+            break
+    try:
+        stat = os.stat(served)
+    except FileNotFoundError:
+        raise Http404('No such file')
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}{"-" + encoding if encoding else ""}"'
+    response = get_conditional_response(request, etag=etag, last_modified=int(stat.st_mtime))
+    if response is None:
+        content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        try:
+            # a range of the compressed variant is no use to anyone, those get the whole file
+            requested = None if encoding else request.headers.get('Range')
+            if requested and request.headers.get('If-Range', etag) != etag:
+                requested = None
+            span = byte_range(requested, stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{stat.st_size}'
+            return response
+        file = open(served, 'rb')
+        if span is None:
+            response = FileResponse(file, content_type=content_type)
+        else:
+            start, end = span
+            file.seek(start)
+            response = FileResponse(FileRange(file, end - start + 1), status=206, content_type=content_type)
+            response['Content-Length'] = end - start + 1
+            response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+        if encoding:
+            response['Content-Encoding'] = encoding
+        else:
+            response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(stat.st_mtime)
+    response['Cache-Control'] = cache_control
+    if encodings:
+        patch_vary_headers(response, ('Accept-Encoding', ))
+    return response
+
+
+def find(root, path):
+    try:
+        full_path = safe_join(root, path)
+    except SuspiciousFileOperation:
+        raise Http404('No such file')
+    return full_path if os.path.isfile(full_path) else None
+
+
+@require_safe
+def serve_static(request, path):
+    """Collected static files, the app directories too while DEBUG is on."""
+    full_path = find(settings.STATIC_ROOT, path)
+    if full_path is None and settings.DEBUG:
+        full_path = finders.find(path)
+    if full_path is None:
+        raise Http404('No such file')
+    cache_control = IMMUTABLE if HASHED.search(path) else REVALIDATE
+    encodings = [('br', '.br'), ('gzip', '.gz')] if path.endswith(COMPRESSIBLE) else ()
+    return file_response(request, full_path, cache_control, encodings)
+
+
+@require_safe
+def serve_media(request, path):
+    full_path = find(settings.MEDIA_ROOT, path)
+    if full_path is None:
+        raise Http404('No such file')
+    # renditions are stored under the hash of their source image
+    return file_response(request, full_path, IMMUTABLE if path.startswith('renditions/') else MEDIA)
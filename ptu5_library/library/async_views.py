@@ -0,0 +1,118 @@
+import asyncio
+from asgiref.sync import sync_to_async
+from django.db.models import Prefetch
+from django.http import Http404
+from django.shortcuts import render
+from django.utils.functional import SimpleLazyObject
+from django.views import View
+from . models import Author, Book
+from . import counters, recommendations, versions, views, visits
+from . forms import BookReviewForm
+from . paginators import CursorPaginator, InvalidCursor, cursor_query
+
+# Async versions of the catalog views, routed instead of library.views when
+# ASYNC_CATALOG is on and the site runs under ASGI. Data is loaded with the
+# async ORM. Rendering stays in a thread: templates still touch the session,
+# request.user and lazy querysets inside cached fragments.
+
+arender = sync_to_async(render)
+
+
+async def index(request):
+    context, visits_count = await asyncio.gather(counters.aget_counters(), sync_to_async(visits.visit)(request))
+    context['visits_count'] = visits_count
+    return await arender(request, 'library/index.html', context)
+
+
+async def authors(request):
+    paginator = CursorPaginator(Author.objects.all(), 5, ('last_name', 'first_name', 'id'))
+    try:
+        paged_authors = await paginator.apage(request.GET.get('cursor'))
+    except InvalidCursor:
+        paged_authors = await paginator.apage()
+    context = {'authors': paged_authors}
+    if paged_authors.has_next():
+        context['next_page_query'] = cursor_query(request, paged_authors.next_cursor)
+    if paged_authors.has_previous():
+        context['previous_page_query'] = cursor_query(request, paged_authors.previous_cursor)
+    return await arender(request, 'library/authors.html', context)
+
+
+async def author(request, author_id):
+    queryset = Author.objects.prefetch_related(Prefetch('books', queryset=Book.objects.for_catalog()))
+    try:
+        found = await queryset.aget(id=author_id)
+    except Author.DoesNotExist:
+        raise Http404('No Author matches the given query.')
+    return await arender(request, 'library/author.html', {'author': found})
+
+
+class BookListView(View):
+    paginate_by = views.BookListView.paginate_by
+
+    async def get(self, request):
+        paginator = CursorPaginator(
+            views.filter_books(Book.objects.for_catalog(), request.GET),
+            self.paginate_by,
+            views.book_ordering(request.GET),
+            estimate_count=True,
+        )
+        try:
+            page = await paginator.apage(request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        filtered = views.is_filtered(request.GET)
+        books_count, genre_facets = await asyncio.gather(
+            sync_to_async(lambda: paginator.count)() if filtered else self.unfiltered_count(),
+            sync_to_async(views.book_facets)(request),
+        )
+        context = {
+            'view': self,
+            'paginator': paginator,
+            'page_obj': page,
+            'is_paginated': page.has_other_pages(),
+            'object_list': page.object_list,
+            'book_list': page.object_list,
+            'books_count': books_count,
+            'genre_facets': genre_facets,
+            'selected_genres': [facet for facet in genre_facets if facet['selected']],
+        }
+        if page.has_next():
+            context['next_page_query'] = cursor_query(request, page.next_cursor)
+        if page.has_previous():
+            context['previous_page_query'] = cursor_query(request, page.previous_cursor)
+        return await arender(request, views.BookListView.template_name, context)
+
+    async def unfiltered_count(self) -> int:
+        return (await counters.aget_counters())['book_count']
+
+
+class BookDetailView(View):
+    async def get(self, request, pk):
+        try:
+            book = await views.BookDetailView.queryset.aget(pk=pk)
+        except Book.DoesNotExist:
+            raise Http404('No Book matches the given query.')
+        book_version, reviews_version, recommendations_version = await asyncio.gather(
+            sync_to_async(versions.version_key)(f'book:{pk}', 'authors', 'genres'),
+            sync_to_async(versions.version_key)(f'reviews:{pk}'),
+            sync_to_async(versions.version_key)('recommendations', versions.table(Book)),
+        )
+        paginator = CursorPaginator(views.reviews_queryset(pk), views.REVIEWS_PAGE_SIZE, views.REVIEWS_ORDERING)
+        context = {
+            'view': self,
+            'object': book,
+            'book': book,
+            'form': BookReviewForm(initial={'book': book, 'reader': request.user}),
+            'book_version': book_version,
+            'reviews_version': reviews_version,
+            'recommendations_version': recommendations_version,
+            'recommendations': SimpleLazyObject(lambda: list(recommendations.for_book(pk))),
+            # only evaluated, in the render thread, when the reviews fragment is not cached
+            'reviews': SimpleLazyObject(paginator.page),
+        }
+        return await arender(request, views.BookDetailView.template_name, context)
+
+    async def post(self, request, pk):
+        # posting a review is rare, the rate limited sync view handles it
+        return await sync_to_async(views.BookDetailView.as_view())(request, pk=pk)
@@ -0,0 +1,264 @@
+import bisect
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from django.conf import settings
+from django.db import connections
+from . models import Author, Book
+from . import versions
+
+# Type-ahead for book titles and author names. Every title is indexed from
+# each of its first words on, authors as "first last" and "last first". The
+# sorted keys live in a snapshot file that every worker maps into memory and
+# binary searches without loading it, so starting a worker costs one mmap.
+#
+# Snapshot layout: header (magic, version stamp, entry count), one uint32
+# offset per entry, then the entries as "key\tkind\tid\tposition\tlabel\n"
+# sorted by key. UTF-8 bytes sort like the strings they encode.
+#
+# Saves update an in-memory delta of the process that saved, right away, and
+# bump the 'autocomplete' version stamp. A worker that sees the stamp newer
+# than its snapshot rewrites the snapshot in a background thread, at most
+# every REFRESH_SECONDS; the others map the new file the next time they
+# search. build_autocomplete writes it from cron or after deploys.
+
+MAGIC = b'LAC1'
+HEADER = struct.Struct('<4sqI')
+OFFSET = struct.Struct('<I')
+VERSION = 'autocomplete'
+REFRESH_SECONDS = 5
+LOCK_SECONDS = 60
+MAX_WORDS = 6
+# entries looked at per search, enough for the best few of a short prefix
+SCAN_LIMIT = 200
+KINDS = {'b': 'book', 'a': 'author'}
+
+
+def normalize(text) -> str:
+    """Lower case words without accents or punctuation."""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char)).lower()
+    return ' '.join(re.findall(r'\w+', text))
+
+
+def clean(label) -> str:
+    return ' '.join((label or '').split())
+
+
+def book_entries(book_id, title) -> list:
+    words = normalize(title).split()
+    return [(' '.join(words[position:]), 'b', book_id, position, clean(title))
+        for position in range(min(len(words), MAX_WORDS))]
+
+
+def author_entries(author_id, first_name, last_name) -> list:
+    label = clean(f'{first_name} {last_name}')
+    keys = {normalize(f'{first_name} {last_name}'), normalize(f'{last_name} {first_name}')} - {''}
+    return [(key, 'a', author_id, 0, label) for key in sorted(keys)]
+
+
+def all_entries() -> list:
+    entries = []
+    for book_id, title in Book.objects.values_list('id', 'title').iterator(chunk_size=5000):
+        entries += book_entries(book_id, title)
+    for author in Author.objects.values_list('id', 'first_name', 'last_name').iterator(chunk_size=5000):
+        entries += author_entries(*author)
+    entries.sort()
+    return entries
+
+
+def snapshot_path() -> Path:
+    return Path(settings.AUTOCOMPLETE_SNAPSHOT)
+
+
+def write_snapshot(path=None) -> int:
+    """Write a snapshot of the database and swap it in atomically, returns the entry count."""
+    path = Path(path or snapshot_path())
+    # taken before reading, changes saved meanwhile count as newer than the snapshot
+    version = versions.get_version(VERSION)
+    entries = all_entries()
+    records, offsets, position = [], [], 0
+    for key, kind, object_id, word, label in entries:
+        record = f'{key}\t{kind}\t{object_id}\t{word}\t{label}\n'.encode()
+        offsets.append(position)
+        records.append(record)
+        position += len(record)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    handle, temp_path = tempfile.mkstemp(dir=path.parent, suffix='.part')
+    with os.fdopen(handle, 'wb') as out:
+        out.write(HEADER.pack(MAGIC, version, len(entries)))
+        out.write(b''.join(OFFSET.pack(offset) for offset in offsets))
+        out.write(b''.join(records))
+    os.replace(temp_path, path)
+    return len(entries)
+
+
+def rewrite(path) -> bool:
+    """Write the snapshot unless another worker is writing it already."""
+    lock = path.with_name(path.name + '.lock')
+    try:
+        handle = os.open(lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        # left behind by a worker that died while writing
+        if time.time() - os.stat(lock).st_mtime > LOCK_SECONDS:
+            os.unlink(lock)
+        return False
+    try:
+        write_snapshot(path)
+    finally:
+        os.close(handle)
+        os.unlink(lock)
+    return True
+
+
+class Snapshot:
+    """A snapshot file mapped into memory, searched in place."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as file:
+            self.stat = os.fstat(file.fileno())
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not an autocomplete snapshot')
+        self.records = HEADER.size + OFFSET.size * self.count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index) -> bytes:
+        """Key of the index-th entry, so bisect can search the file."""
+        start = self.records + OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * index)[0]
+        return self.map[start:self.map.find(b'\t', start)]
+
+    def entry(self, index) -> tuple:
+        start = self.records + OFFSET.unpack_from(self.map, HEADER.size + OFFSET.size * index)[0]
+        key, kind, object_id, position, label = self.map[start:self.map.find(b'\n', start)].decode().split('\t', 4)
+        return key, kind, int(object_id), int(position), label
+
+    def matches(self, prefix):
+        encoded = prefix.encode()
+        index = bisect.bisect_left(self, encoded)
+        while index < self.count and self[index].startswith(encoded):
+            yield self.entry(index)
+            index += 1
+
+    def is_current(self, path) -> bool:
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_ino, stat.st_mtime_ns) == (self.stat.st_ino, self.stat.st_mtime_ns)
+
+
+class Index:
+    def __init__(self, path):
+        self.path = path
+        self.snapshot = None
+        # entries saved in this process after the snapshot was written
+        self.delta = []
+        # (kind, id): stamp of the change, their snapshot entries are outdated
+        self.changed = {}
+        self.rewrite_started = float('-inf')
+        self.lock = threading.Lock()
+
+    def load(self):
+        snapshot = Snapshot(self.path)
+        with self.lock:
+            self.snapshot = snapshot
+            kept = {item for item, stamp in self.changed.items() if stamp > snapshot.version}
+            self.changed = {item: self.changed[item] for item in kept}
+            self.delta = [entry for entry in self.delta if entry[1:3] in kept]
+
+    def refresh(self):
+        """Map a newer snapshot, start writing one when saves made ours stale for long enough.
+
+        Writing reads every book and author, it never happens in the request:
+        until the new snapshot is there the old one and the delta are served.
+        """
+        if (self.snapshot is None or not self.snapshot.is_current(self.path)) and self.path.exists():
+            self.load()
+        if self.snapshot is None:
+            self.start_rewrite()
+        elif versions.get_version(VERSION) > self.snapshot.version \
+                and time.time() - self.snapshot.stat.st_mtime >= REFRESH_SECONDS:
+            self.start_rewrite()
+
+    def start_rewrite(self):
+        with self.lock:
+            if time.monotonic() - self.rewrite_started < REFRESH_SECONDS:
+                return
+            self.rewrite_started = time.monotonic()
+        threading.Thread(target=self.rewrite, name='autocomplete-snapshot', daemon=True).start()
+
+    def rewrite(self):
+        try:
+            rewrite(self.path)
+        finally:
+            # the connection this thread opened
+            connections.close_all()
+
+    def replace(self, kind, object_id, entries):
+        with self.lock:
+            self.changed[(kind, object_id)] = time.time_ns()
+            self.delta = [entry for entry in self.delta if entry[1:3] != (kind, object_id)]
+            for entry in entries:
+                bisect.insort(self.delta, entry)
+
+    def search(self, text, limit=10) -> list:
+        prefix = normalize(text)
+        if not prefix:
+            return []
+        self.refresh()
+        with self.lock:
+            snapshot, delta, changed = self.snapshot, self.delta, self.changed
+        best = {}
+        for count, entry in enumerate(snapshot.matches(prefix) if snapshot else ()):
+            if count >= SCAN_LIMIT:
+                break
+            if entry[1:3] not in changed:
+                self.rank(best, entry)
+        index = bisect.bisect_left(delta, (prefix, ))
+        while index < len(delta) and delta[index][0].startswith(prefix):
+            self.rank(best, delta[index])
+            index += 1
+        ranked = sorted(best.values())[:limit]
+        return [{'type': KINDS[kind], 'id': object_id, 'label': label} for *_, kind, object_id, label in ranked]
+
+    @staticmethod
+    def rank(best, entry):
+        # titles matched from their first word first, then shorter labels
+        key, kind, object_id, position, label = entry
+        ranked = (position, len(label), label.lower(), kind, object_id, label)
+        if ranked < best.get((kind, object_id), ranked + (None, )):
+            best[(kind, object_id)] = ranked
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_index() -> Index:
+    path = snapshot_path()
+    with _indexes_lock:
+        if path not in _indexes:
+            _indexes[path] = Index(path)
+        return _indexes[path]
+
+
+def search(text, limit=10) -> list:
+    return get_index().search(text, limit)
+
+
+def changed(kind, object_id, entries):
+    """Called by signals with the new entries of a saved object, none when deleted."""
+    index = _indexes.get(snapshot_path())
+    if index is not None:
+        index.replace(kind, object_id, entries)
+    versions.bump(VERSION)
@@ -0,0 +1,30 @@
+from contextlib import contextmanager
+from statistics import mean, quantiles
+from time import perf_counter
+from django.db import transaction
+
+
+def measure(func, repeat=20) -> dict:
+    """Call func repeat times and return its timings in milliseconds."""
+    timings = []
+    for _ in range(repeat):
+        start = perf_counter()
+        func()
+        timings.append((perf_counter() - start) * 1000)
+    timings.sort()
+    percentiles = quantiles(timings, n=100) if len(timings) > 1 else timings * 99
+    return {
+        'min': round(timings[0], 3),
+        'mean': round(mean(timings), 3),
+        'p50': round(percentiles[49], 3),
+        'p95': round(percentiles[94], 3),
+        'max': round(timings[-1], 3),
+    }
+
+
+@contextmanager
+def rolled_back(using=None):
+    """Seed benchmark data inside a transaction that is never committed."""
+    with transaction.atomic(using=using):
+        yield
+        transaction.set_rollback(True, using=using)
@@ -0,0 +1,65 @@
+import asyncio
+from django.core.cache import cache
+from django.db import transaction
+from . models import Author, Book, BookInstance, Genre
+
+KEY_PREFIX = 'library:counters:'
+# signals invalidate the counters, the timeout only limits how long bulk
+# changes that bypass signals (queryset.update, bulk_create) can stay unseen
+TIMEOUT = 60 * 60
+
+# name: the queryset that is counted
+COUNTERS = {
+    'book_count': lambda: Book.objects.all(),
+    'book_instance_count': lambda: BookInstance.objects.all(),
+    'book_instance_available_count': lambda: BookInstance.objects.filter(status='a'),
+    'author_count': lambda: Author.objects.all(),
+    'genre_count': lambda: Genre.objects.all(),
+}
+
+MODEL_COUNTERS = {
+    Book: ('book_count', ),
+    BookInstance: ('book_instance_count', 'book_instance_available_count'),
+    Author: ('author_count', ),
+    Genre: ('genre_count', ),
+}
+
+
+def get_counters() -> dict:
+    """Dashboard counters, computed only for the ones missing from the cache."""
+    cached = cache.get_many([KEY_PREFIX + name for name in COUNTERS])
+    counters = {name: cached.get(KEY_PREFIX + name) for name in COUNTERS}
+    missing = {name: COUNTERS[name]().count() for name, value in counters.items() if value is None}
+    if missing:
+        cache.set_many({KEY_PREFIX + name: value for name, value in missing.items()}, TIMEOUT)
+        counters.update(missing)
+    return counters
+
+
+async def aget_counters() -> dict:
+    """get_counters() for async views, the missing counts are queried concurrently."""
+    cached = await cache.aget_many([KEY_PREFIX + name for name in COUNTERS])
+    counters = {name: cached.get(KEY_PREFIX + name) for name in COUNTERS}
+    names = [name for name, value in counters.items() if value is None]
+    if names:
+        missing = dict(zip(names, await asyncio.gather(*(COUNTERS[name]().acount() for name in names))))
+        await cache.aset_many({KEY_PREFIX + name: value for name, value in missing.items()}, TIMEOUT)
+        counters.update(missing)
+    return counters
+
+
+def invalidate(*names):
+    cache.delete_many([KEY_PREFIX + name for name in names or COUNTERS])
+
+
+def invalidate_for(model):
+    names = MODEL_COUNTERS[model]
+    invalidate(*names)
+    # a request between the save and its commit still counts the old rows, drop them again
+    transaction.on_commit(lambda: invalidate(*names))
+
+
+def rebuild() -> dict:
+    counters = {name: queryset().count() for name, queryset in COUNTERS.items()}
+    cache.set_many({KEY_PREFIX + name: value for name, value in counters.items()}, TIMEOUT)
+    return counters
@@ -0,0 +1,75 @@
+from django.core.cache import cache
+from django.db.models import Count
+from . models import Book, Genre
+
+# Genre facets of the book list: every genre with the number of books of the
+# current result in it. Counts of the unfiltered catalog are cached, signals
+# drop them when the genres of a book change.
+
+KEY = 'library:facets:genres'
+TIMEOUT = 60 * 60
+BookGenre = Book.genre.through
+
+
+def genre_ids(params) -> list:
+    """Selected genres, ?genre_id= may be repeated."""
+    return sorted({int(value) for value in params.getlist('genre_id') if value.isdigit()})
+
+
+def genre_op(params) -> str:
+    """How selected genres combine: 'and' (books in all of them) or 'or' (in any)."""
+    return 'or' if params.get('genre_op') == 'or' else 'and'
+
+
+def filter_genres(queryset, ids, op='and'):
+    if not ids:
+        return queryset
+    book_ids = BookGenre.objects.filter(genre_id__in=ids)
+    if op == 'and' and len(ids) > 1:
+        book_ids = book_ids.values('book_id').annotate(matched=Count('genre_id')).filter(matched=len(ids))
+    return queryset.filter(id__in=book_ids.values('book_id'))
+
+
+def count_genres(queryset) -> dict:
+    """genre id: books of the queryset in that genre, in one grouped query."""
+    rows = BookGenre.objects.filter(book_id__in=queryset.order_by().values('id')) \
+        .values_list('genre_id').annotate(count=Count('book_id')).order_by()
+    return dict(rows)
+
+
+def catalog_facets() -> list:
+    """(id, name, books) of every genre for the whole catalog, cached."""
+    facets = cache.get(KEY)
+    if facets is None:
+        facets = list(Genre.objects.annotate(count=Count('book')).order_by('name', 'id').values_list('id', 'name', 'count'))
+        cache.set(KEY, facets, TIMEOUT)
+    return facets
+
+
+def invalidate():
+    cache.delete(KEY)
+
+
+def genre_facets(request, queryset=None) -> list:
+    """Facets for the book list, with the query string that toggles each genre.
+
+    queryset is the current result without the genre filter for 'or' and with
+    it for 'and'; None means the unfiltered catalog and needs no query when
+    the catalog counts are cached.
+    """
+    selected = genre_ids(request.GET)
+    counts = count_genres(queryset) if queryset is not None else None
+    facets = []
+    for genre_id, name, count in catalog_facets():
+        query = request.GET.copy()
+        query.pop('cursor', None)
+        toggled = [other for other in selected if other != genre_id] if genre_id in selected else selected + [genre_id]
+        query.setlist('genre_id', [str(other) for other in toggled])
+        facets.append({
+            'id': genre_id,
+            'name': name,
+            'count': counts.get(genre_id, 0) if counts is not None else count,
+            'selected': genre_id in selected,
+            'query': query.urlencode(),
+        })
+    return facets
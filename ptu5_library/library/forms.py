@@ -1,23 +1,9 @@
 from django import forms
-from . models import BookReview
-from django.utils.timezone import datetime, timedelta
-from . models import BookReview, BookInstance
+from . models import Book, BookReview, BookInstance
 
 
 class BookReviewForm(forms.ModelForm):
-
-    def is_valid(self):
-        valid = super().is_valid()
-        if valid:
-            reader = self.cleaned_data.get("reader")
-            recent_posts = BookReview.objects.filter(
-                reader=reader,
-                created_at__gte=(datetime.now() - timedelta(hours=1)),
-                ) 
-            if recent_posts:
-                return False
-        return valid
-
+    # posting is rate limited by the view, see library.ratelimit
     class Meta:
         model = BookReview
         fields = ('content', 'book', 'reader', )
@@ -32,6 +18,11 @@ class DateInput(forms.DateInput):
 
    
 class BookInstanceForm(forms.ModelForm):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # book choices are labelled with the author
+        self.fields['book'].queryset = Book.objects.select_related('author')
+
     class Meta:
         model = BookInstance
         fields = ('book', 'due_back', )
@@ -39,6 +30,13 @@ class BookInstanceForm(forms.ModelForm):
 
 
 class BookInstanceUpdateForm(forms.ModelForm):
+    # version the reader saw, a concurrent change makes the update fail
+    version = forms.IntegerField(widget=forms.HiddenInput())
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['version'].initial = self.instance.version
+
     class Meta:
         model = BookInstance
         fields = ('book', 'due_back', )
@@ -0,0 +1,93 @@
+import hashlib
+from io import BytesIO
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+from . models import ImageJob
+
+# name: bounding box, images are only ever scaled down
+RENDITIONS = {
+    'thumbnail': (64, 64),
+    'list': (200, 300),
+    'detail': (500, 500),
+}
+FORMATS = {
+    'webp': 'WEBP',
+    'jpg': 'JPEG',
+}
+
+
+def rendition_name(content_hash, rendition, extension) -> str:
+    return f'renditions/{content_hash[:2]}/{content_hash}/{rendition}.{extension}'
+
+
+def rendition_url(content_hash, rendition, extension) -> str:
+    return default_storage.url(rendition_name(content_hash, rendition, extension))
+
+
+def hash_field(field_name) -> str:
+    return f'{field_name}_hash'
+
+
+def image_url(instance, field_name, rendition, extension='jpg'):
+    """URL of a rendition once processed, of the original image before that."""
+    field_file = getattr(instance, field_name, None)
+    if not field_file:
+        return None
+    content_hash = getattr(instance, hash_field(field_name))
+    if not content_hash:
+        return field_file.url
+    return rendition_url(content_hash, rendition, extension)
+
+
+def enqueue(instance, field_name):
+    """Queue rendition processing once the current transaction commits."""
+    def create_job():
+        ImageJob.objects.get_or_create(
+            content_type=ContentType.objects.get_for_model(instance),
+            object_id=instance.pk,
+            field_name=field_name,
+            processed_at=None,
+        )
+    transaction.on_commit(create_job)
+
+
+def has_new_file(instance, field_name) -> bool:
+    # uncommitted files are fresh uploads that the save is about to write
+    field_file = getattr(instance, field_name)
+    return bool(field_file) and not field_file._committed
+
+
+def renditions_exist(content_hash, storage=default_storage) -> bool:
+    return all(
+        storage.exists(rendition_name(content_hash, rendition, extension))
+        for rendition in RENDITIONS for extension in FORMATS
+    )
+
+
+def render(source_name, storage=default_storage) -> str:
+    """Write every rendition of the source image and return its content hash.
+
+    Renditions are stored by content hash, so nothing is written when the same
+    image has been processed before.
+    """
+    with storage.open(source_name, 'rb') as source:
+        data = source.read()
+    content_hash = hashlib.sha256(data).hexdigest()
+    if renditions_exist(content_hash, storage):
+        return content_hash
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    image = image.convert('RGB')
+    for rendition, size in RENDITIONS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        for extension, image_format in FORMATS.items():
+            output = BytesIO()
+            resized.save(output, image_format, quality=82)
+            name = rendition_name(content_hash, rendition, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(output.getvalue()))
+    return content_hash
@@ -0,0 +1,269 @@
+import asyncio
+import bisect
+import threading
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections
+from django.http import FileResponse
+from django.template.backends import django as django_backend
+
+# Per request metrics, aggregated per resolved URL name into in-process
+# histograms. Every worker process keeps its own numbers, they reset on restart.
+
+MS_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+QUERY_BOUNDS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+BYTES_BOUNDS = (1024, 4096, 16384, 65536, 262144, 1048576)
+
+current = ContextVar('request_metrics', default=None)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value):
+        self.buckets[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th value, max for the overflow bucket."""
+        rank, seen = q * self.count, 0
+        for position, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= rank:
+                return self.bounds[position] if position < len(self.bounds) else self.max
+        return 0
+
+    def snapshot(self) -> dict:
+        return {
+            'count': self.count,
+            'mean': round(self.total / self.count, 3) if self.count else 0,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'max': round(self.max, 3),
+            'buckets': dict(zip([*map(str, self.bounds), 'inf'], self.buckets)),
+        }
+
+
+class ViewStats:
+    def __init__(self):
+        self.queries = Histogram(QUERY_BOUNDS)
+        self.sql_ms = Histogram(MS_BOUNDS)
+        self.render_ms = Histogram(MS_BOUNDS)
+        self.total_ms = Histogram(MS_BOUNDS)
+        self.bytes = Histogram(BYTES_BOUNDS)
+        self.duplicate_requests = 0
+        self.last_duplicate = None
+
+    def observe(self, metrics):
+        self.queries.observe(metrics.queries)
+        self.sql_ms.observe(metrics.sql_ms)
+        self.render_ms.observe(metrics.render_ms)
+        self.total_ms.observe(metrics.total_ms)
+        if metrics.size is not None:
+            self.bytes.observe(metrics.size)
+        if metrics.duplicates:
+            self.duplicate_requests += 1
+            self.last_duplicate = metrics.most_repeated()
+
+    def snapshot(self) -> dict:
+        return {
+            'queries': self.queries.snapshot(),
+            'sql_ms': self.sql_ms.snapshot(),
+            'render_ms': self.render_ms.snapshot(),
+            'total_ms': self.total_ms.snapshot(),
+            'bytes': self.bytes.snapshot(),
+            'requests_with_duplicates': self.duplicate_requests,
+            'last_duplicate': self.last_duplicate,
+        }
+
+
+_stats = {}
+_lock = threading.Lock()
+
+
+def record(name, metrics):
+    with _lock:
+        _stats.setdefault(name, ViewStats()).observe(metrics)
+
+
+def snapshot() -> dict:
+    with _lock:
+        return {name: stats.snapshot() for name, stats in sorted(_stats.items())}
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+
+
+class RequestMetrics:
+    def __init__(self):
+        self.statements = Counter()
+        self.sql_ms = 0
+        self.render_ms = 0
+        self.total_ms = 0
+        self.size = None
+
+    def __call__(self, execute, sql, params, many, context):
+        """execute_wrapper hook, times every query of the request."""
+        start = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_ms += (perf_counter() - start) * 1000
+            self.statements[(sql, repr(params))] += 1
+
+    @property
+    def queries(self) -> int:
+        return sum(self.statements.values())
+
+    @property
+    def duplicates(self) -> int:
+        """Queries repeated with the same SQL and parameters."""
+        return self.queries - len(self.statements)
+
+    def most_repeated(self):
+        (sql, params), count = self.statements.most_common(1)[0]
+        return {'sql': sql, 'params': params, 'count': count}
+
+    def server_timing(self) -> str:
+        return ', '.join([
+            f'db;dur={self.sql_ms:.1f};desc="{self.queries} queries, {self.duplicates} duplicates"',
+            f'render;dur={self.render_ms:.1f}',
+            f'total;dur={self.total_ms:.1f}',
+        ])
+
+
+class InstrumentationMiddleware:
+    """Records queries, SQL time, duplicates, render time and size of every response.
+
+    QUERY_BUDGETS maps URL names to the most queries their view may run. With
+    QUERY_BUDGETS_STRICT on, as in the tests, going over the budget raises
+    QueryBudgetExceeded instead of only being recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # async views run without a thread held for the whole request
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if getattr(self, '_is_coroutine', None):
+            return self.__acall__(request)
+        metrics = RequestMetrics()
+        start = perf_counter()
+        with self.measure(metrics):
+            response = self.get_response(request)
+        return self.process_response(request, response, metrics, start)
+
+    async def __acall__(self, request):
+        metrics = RequestMetrics()
+        start = perf_counter()
+        # queries of async views run in the thread sync_to_async picks for the
+        # request, the wrappers go on the connections of that thread
+        stack = await sync_to_async(self.wrap_connections)(metrics)
+        token = current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current.reset(token)
+            await sync_to_async(stack.close)()
+        return self.process_response(request, response, metrics, start)
+
+    def process_response(self, request, response, metrics, start):
+        metrics.total_ms = (perf_counter() - start) * 1000
+        name = request.resolver_match.view_name if request.resolver_match else None
+        if getattr(settings, 'SERVER_TIMING', False):
+            response['Server-Timing'] = metrics.server_timing()
+        if isinstance(response, FileResponse):
+            # wrapping the file would keep the server from sending it with its file wrapper
+            metrics.size = int(response['Content-Length']) if response.has_header('Content-Length') else None
+            self.finish(metrics, start, name)
+        elif response.streaming:
+            # streamed rows are queried while the response is sent, record when it ends
+            response.streaming_content = self.stream(response.streaming_content, metrics, start, name)
+        else:
+            metrics.size = len(response.content)
+            self.finish(metrics, start, name)
+        return response
+
+    @staticmethod
+    def wrap_connections(metrics) -> ExitStack:
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(metrics))
+        return stack
+
+    @contextmanager
+    def measure(self, metrics):
+        token = current.set(metrics)
+        try:
+            with self.wrap_connections(metrics):
+                yield
+        finally:
+            current.reset(token)
+
+    def stream(self, content, metrics, start, name):
+        metrics.size = 0
+        with self.measure(metrics):
+            for chunk in content:
+                metrics.size += len(chunk)
+                yield chunk
+        self.finish(metrics, start, name)
+
+    def finish(self, metrics, start, name):
+        metrics.total_ms = (perf_counter() - start) * 1000
+        if name:
+            record(name, metrics)
+            self.check_budget(name, metrics)
+
+    def check_budget(self, name, metrics):
+        budget = getattr(settings, 'QUERY_BUDGETS', {}).get(name)
+        if budget is not None and metrics.queries > budget and getattr(settings, 'QUERY_BUDGETS_STRICT', False):
+            raise QueryBudgetExceeded(f'{name} ran {metrics.queries} queries, its budget is {budget}')
+
+
+class Template:
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def render(self, context=None, request=None):
+        start = perf_counter()
+        try:
+            return self.wrapped.render(context, request)
+        finally:
+            metrics = current.get()
+            if metrics is not None:
+                metrics.render_ms += (perf_counter() - start) * 1000
+
+
+class DjangoTemplates(django_backend.DjangoTemplates):
+    """The Django template backend, with render times added to the request metrics."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
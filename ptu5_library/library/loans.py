@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+import tempfile
+from datetime import date, datetime
+from pathlib import Path
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from . models import Loan
+
+# Loan events older than a few months are moved out of the database into one
+# gzipped JSON lines file per month, so the table only holds recent history.
+
+FIELDS = ('id', 'event', 'copy_id', 'book_id', 'reader_id', 'due_back', 'created_at')
+
+
+def archive_dir() -> Path:
+    return Path(settings.LOAN_ARCHIVE_DIR)
+
+
+def month_start(day) -> date:
+    return day.replace(day=1)
+
+
+def add_months(month, months) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def aware(month) -> datetime:
+    return timezone.make_aware(datetime(month.year, month.month, 1))
+
+
+def months_to_archive(cutoff) -> list:
+    """First days of the months with loans before cutoff, also the first day of a month."""
+    oldest = Loan.objects.filter(created_at__lt=aware(cutoff)).order_by('created_at').values_list('created_at', flat=True).first()
+    if oldest is None:
+        return []
+    months, month = [], month_start(timezone.localtime(oldest).date())
+    while month < cutoff:
+        months.append(month)
+        month = add_months(month, 1)
+    return months
+
+
+def month_loans(month):
+    return Loan.objects.filter(created_at__gte=aware(month), created_at__lt=aware(add_months(month, 1)))
+
+
+def archive_path(directory, month) -> Path:
+    """loans-YYYY-MM.jsonl.gz, numbered if the month was archived before."""
+    path = directory / f'loans-{month:%Y-%m}.jsonl.gz'
+    number = 0
+    while path.exists():
+        number += 1
+        path = directory / f'loans-{month:%Y-%m}.{number}.jsonl.gz'
+    return path
+
+
+def archive_month(month, directory=None, batch_size=5000) -> tuple:
+    """Write the loans of a month to a new archive file, then delete them.
+
+    The file is complete before any row is deleted. An interrupted run leaves
+    rows behind that the next run archives again into a numbered file, ids
+    tell the duplicates apart.
+    """
+    directory = directory or archive_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    loans = month_loans(month)
+    archived, last_id = 0, None
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+    try:
+        with os.fdopen(handle, 'wb') as raw, gzip.open(raw, 'wt', encoding='utf-8') as out:
+            for row in loans.order_by('id').values(*FIELDS).iterator(chunk_size=batch_size):
+                out.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                archived += 1
+                last_id = row['id']
+        if not archived:
+            os.remove(temp_path)
+            return None, 0
+        path = archive_path(directory, month)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    # rows are only ever appended with a current time, none can have joined the month meanwhile
+    archived_loans = loans.filter(id__lte=last_id)
+    while ids := list(archived_loans.order_by('id').values_list('id', flat=True)[:batch_size]):
+        Loan.objects.filter(id__in=ids).delete()
+    return path, archived
+
+
+def read_archive(path):
+    """Rows of an archive file as dicts, like values(*FIELDS) returned them."""
+    with gzip.open(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            yield json.loads(line)
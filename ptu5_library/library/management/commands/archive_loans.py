@@ -0,0 +1,32 @@
+from pathlib import Path
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from library import loans
+
+
+class Command(BaseCommand):
+    help = '''Move loan events of old months out of the database, one gzipped JSON
+    lines file per month.
+
+    Months older than --keep-months before the current month are archived.
+    Every file is complete before the rows in it are deleted.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-months', type=int, default=12, help='recent months that stay in the database')
+        parser.add_argument('--dir', help='archive directory, LOAN_ARCHIVE_DIR by default')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--dry-run', action='store_true', help='only count the loans of every month')
+
+    def handle(self, *args, **options):
+        if options['keep_months'] < 1:
+            raise CommandError('Keep at least the current month')
+        cutoff = loans.add_months(loans.month_start(timezone.localdate()), 1 - options['keep_months'])
+        directory = Path(options['dir']) if options['dir'] else loans.archive_dir()
+        for month in loans.months_to_archive(cutoff):
+            if options['dry_run']:
+                self.stdout.write(f'{month:%Y-%m}: {loans.month_loans(month).count()} loans')
+                continue
+            path, archived = loans.archive_month(month, directory, options['batch_size'])
+            if archived:
+                self.stdout.write(f'{month:%Y-%m}: {archived} loans archived to {path}')
+        self.stdout.write(self.style.SUCCESS(f'Loans before {cutoff:%Y-%m} are archived'))
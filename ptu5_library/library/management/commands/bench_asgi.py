@@ -0,0 +1,86 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+from types import ModuleType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import URLResolver, include, path
+from library import async_views, urls, views
+from library.models import Author, Book
+from ptu5_library import urls as site_urls
+
+
+def site_urlconf(catalog):
+    """The site URLconf with the catalog pages served by the given views module."""
+    library = path('', include(urls.catalog_urlpatterns(catalog) + urls.library_urlpatterns))
+    urlconf = ModuleType(f'{catalog.__name__}_urls')
+    urlconf.urlpatterns = [
+        library if isinstance(pattern, URLResolver) and pattern.urlconf_name == 'library.urls' else pattern
+        for pattern in site_urls.urlpatterns
+    ]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = '''Compare requests/sec of the catalog pages served by sync views through
+    the WSGI handler with the async views through the ASGI handler, in process.
+
+    Runs against the current database, load a catalog first.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--requests', type=int, default=200, help='requests per page and handler')
+
+    def wsgi(self, path, concurrency, total) -> float:
+        def worker(count):
+            client = Client()
+            try:
+                for _ in range(count):
+                    if client.get(path).status_code != 200:
+                        raise CommandError(f'{path} failed under WSGI')
+            finally:
+                connection.close()
+
+        start = perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(worker, self.split(total, concurrency)))
+        return perf_counter() - start
+
+    def asgi(self, path, concurrency, total) -> float:
+        async def worker(count):
+            client = AsyncClient()
+            for _ in range(count):
+                if (await client.get(path)).status_code != 200:
+                    raise CommandError(f'{path} failed under ASGI')
+
+        async def run():
+            await asyncio.gather(*(worker(count) for count in self.split(total, concurrency)))
+
+        start = perf_counter()
+        asyncio.run(run())
+        return perf_counter() - start
+
+    def split(self, total, parts) -> list:
+        return [total // parts + (part < total % parts) for part in range(parts)]
+
+    def handle(self, *args, **options):
+        book = Book.objects.order_by('id').first()
+        author = Author.objects.order_by('id').first()
+        if not book or not author:
+            raise CommandError('The catalog is empty, load one with import_catalog first')
+        paths = ['/', '/authors/', f'/author/{author.id}/', '/books/', f'/book/{book.id}/']
+        concurrency, total = options['concurrency'], options['requests']
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']):
+            for handler, catalog, run in (('wsgi', views, self.wsgi), ('asgi', async_views, self.asgi)):
+                with override_settings(ROOT_URLCONF=site_urlconf(catalog)):
+                    for page in paths:
+                        # warm the caches and the URL resolver
+                        run(page, 1, 1)
+                        elapsed = run(page, concurrency, total)
+                        results.setdefault(page, {})[handler] = round(total / elapsed, 1)
+        for page in results.values():
+            page['asgi_vs_wsgi'] = round(page['asgi'] / page['wsgi'], 2)
+        self.stdout.write(json.dumps({'concurrency': concurrency, 'requests_per_second': results}, indent=2))
@@ -0,0 +1,48 @@
+import json
+import random
+import tempfile
+from pathlib import Path
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from library import autocomplete
+from library.bench import measure, rolled_back
+from library.models import Author, Book
+from library.seeding import seed
+
+
+class Command(BaseCommand):
+    help = '''Time autocomplete searches on a seeded catalog.
+
+    The catalog is seeded inside a transaction that is rolled back and the
+    snapshot is written to a temporary directory, nothing is kept.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=100_000)
+        parser.add_argument('--repeat', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with rolled_back(), tempfile.TemporaryDirectory() as directory:
+            seed(books=options['books'], copies_per_book=0, reviews=0, users=0, seed=options['seed'])
+            words = [title.split()[0] for title in Book.objects.values_list('title', flat=True)[:1000]]
+            words += list(Author.objects.values_list('last_name', flat=True)[:1000])
+            path = Path(directory, 'autocomplete.idx')
+            start = perf_counter()
+            entries = autocomplete.write_snapshot(path)
+            build_seconds = perf_counter() - start
+            start = perf_counter()
+            index = autocomplete.Index(path)
+            index.load()
+            load_ms = (perf_counter() - start) * 1000
+            results = {}
+            for length in (1, 2, 3, 5):
+                prefixes = [word[:length] for word in words]
+                results[f'prefix_{length}'] = measure(lambda: index.search(rng.choice(prefixes)), options['repeat'])
+        self.stdout.write(json.dumps({
+            'books': options['books'],
+            'entries': entries,
+            'build_seconds': round(build_seconds, 2),
+            'load_ms': round(load_ms, 3),
+            'search_ms': results,
+        }, indent=2))
@@ -0,0 +1,100 @@
+import json
+import random
+from datetime import date, timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.urls import reverse
+from library.bench import measure, rolled_back
+from library.models import Book, BookInstance, BookReview
+from library.views import UserBookListView
+
+User = get_user_model()
+INDEXED_MODELS = (BookInstance, BookReview)
+
+
+def explain(queryset, label) -> str:
+    sql, params = queryset.query.sql_with_params()
+    prefix = 'EXPLAIN' if connection.vendor == 'postgresql' else 'EXPLAIN QUERY PLAN'
+    with connection.cursor() as cursor:
+        # the label keeps sqlite3 from reusing a statement prepared before the indexes were dropped
+        cursor.execute(f'{prefix} /* {label} */ {sql}', params)
+        return ' | '.join(str(row[-1]) for row in cursor.fetchall())
+
+
+def drop_indexes():
+    with connection.cursor() as cursor:
+        for model in INDEXED_MODELS:
+            for index in model._meta.indexes:
+                cursor.execute(f'DROP INDEX {connection.ops.quote_name(index.name)}')
+
+
+class Command(BaseCommand):
+    help = 'Show query plans and latency of the loan workflow queries with and without the composite indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000, help='synthetic book copies (rolled back afterwards)')
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--books', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def seed(self, options):
+        rng = random.Random(42)
+        today = date.today()
+        users = User.objects.bulk_create(
+            [User(username=f'bench_reader_{number}', password='!') for number in range(options['users'])],
+            batch_size=1000,
+        )
+        books = Book.objects.bulk_create(
+            [Book(title=f'Bench book {number}', summary='') for number in range(options['books'])],
+            batch_size=1000,
+        )
+        statuses = [status for status, _ in BookInstance.LOAN_STATUS]
+        for start in range(0, options['rows'], 10000):
+            copies = []
+            for _ in range(start, min(start + 10000, options['rows'])):
+                status = rng.choice(statuses)
+                copies.append(BookInstance(
+                    book=rng.choice(books),
+                    status=status,
+                    reader=rng.choice(users) if status in ('t', 'r') else None,
+                    due_back=today + timedelta(days=rng.randint(-60, 60)) if status in ('t', 'r') else None,
+                ))
+            BookInstance.objects.bulk_create(copies)
+        BookReview.objects.bulk_create(
+            [BookReview(book=rng.choice(books), reader=rng.choice(users), content='Bench review')
+                for _ in range(options['rows'] // 10)],
+            batch_size=5000,
+        )
+        return users
+
+    def run(self, queries, label, repeat) -> dict:
+        return {
+            name: {'plan': explain(queryset, label), **measure(lambda: evaluate(queryset.all()), repeat)}
+            for name, (queryset, evaluate) in queries.items()
+        }
+
+    def handle(self, *args, **options):
+        with rolled_back():
+            users = self.seed(options)
+            reader = users[len(users) // 2]
+            today = date.today()
+            request = RequestFactory().get(reverse('user_books'))
+            request.user = reader
+            user_books = UserBookListView()
+            user_books.setup(request)
+            queries = {
+                'index: available copies': (BookInstance.objects.filter(status='a'), lambda queryset: queryset.count()),
+                'user_books: copies of reader by due date': (
+                    user_books.get_queryset().order_by('due_order', 'id')[:10], list),
+                'admin: taken copies due before today': (
+                    BookInstance.objects.filter(status='t', due_back__lt=today).order_by('due_back')[:100], list),
+                'profile: recent reviews of reader': (
+                    BookReview.objects.filter(reader=reader, created_at__gte=today), lambda queryset: queryset.exists()),
+            }
+            indexed = self.run(queries, 'indexed', options['repeat'])
+            drop_indexes()
+            without_indexes = self.run(queries, 'without indexes', options['repeat'])
+        results = {name: {'indexed': indexed[name], 'without_indexes': without_indexes[name]} for name in queries}
+        self.stdout.write(json.dumps(results, indent=2))
@@ -0,0 +1,49 @@
+import json
+import random
+import resource
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from library import recommendations
+
+
+class Command(BaseCommand):
+    help = '''Time and measure the memory of a full recommendation build on synthetic loans.
+
+    Loans are generated in memory with a long tail of book popularity and
+    reader activity, the database is not touched. This is the part of
+    build_recommendations that grows with the number of loans.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loans', type=int, default=1_000_000)
+        parser.add_argument('--readers', type=int, default=50_000)
+        parser.add_argument('--books', type=int, default=20_000)
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def loans(self, rng, count, readers, books):
+        for _ in range(count):
+            # a few books and readers account for most loans
+            yield int(readers * rng.random() ** 2), int(books * rng.random() ** 3)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        loans = list(self.loans(rng, options['loans'], options['readers'], options['books']))
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = perf_counter()
+        reader_baskets = recommendations.baskets(loans)
+        readers = recommendations.popularity(reader_baskets)
+        baskets_seconds = perf_counter() - start
+        start = perf_counter()
+        top = recommendations.neighbours(recommendations.cooccurrence(reader_baskets), readers, options['top_k'])
+        neighbours_seconds = perf_counter() - start
+        # ru_maxrss is in kilobytes on Linux
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        self.stdout.write(json.dumps({
+            'loans': len(loans),
+            'readers': len(reader_baskets),
+            'books': len(readers),
+            'books_with_neighbours': len(top),
+            'seconds': {'baskets': round(baskets_seconds, 2), 'neighbours': round(neighbours_seconds, 2)},
+            'total_seconds': round(baskets_seconds + neighbours_seconds, 2),
+            'peak_memory_growth_mb': round(peak / 1024, 1),
+        }, indent=2))
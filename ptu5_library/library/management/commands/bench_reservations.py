@@ -0,0 +1,90 @@
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from threading import Barrier
+from time import perf_counter
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, connections
+from library import counters, reservations
+from library.models import Book, BookInstance, Loan
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = '''Reserve copies from concurrent threads and check that no copy is given out twice.
+
+    The seed data is committed, because every thread uses its own connection,
+    and removed again at the end.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--attempts', type=int, default=50, help='reservations tried by every thread')
+        parser.add_argument('--books', type=int, default=5)
+        parser.add_argument('--copies', type=int, default=40, help='copies of every book')
+
+    def worker(self, reader, books, attempts, barrier) -> tuple:
+        results, copy_ids = Counter(), []
+        due_back = date.today() + timedelta(days=14)
+        barrier.wait()
+        try:
+            for attempt in range(attempts):
+                try:
+                    copy_ids.append(reservations.reserve(books[attempt % len(books)], reader, due_back).pk)
+                    results['reserved'] += 1
+                except reservations.ReservationError:
+                    results['refused'] += 1
+                except DatabaseError:
+                    # e.g. "database is locked" when SQLite writers queue up for too long
+                    results['errors'] += 1
+        finally:
+            connection.close()
+        return results, copy_ids
+
+    def handle(self, *args, **options):
+        if options['threads'] < 2:
+            raise CommandError('At least two threads are needed to race')
+        books = Book.objects.bulk_create([
+            Book(title=f'Reservation bench book {number}', summary='',
+                total_copies=options['copies'], available_copies=options['copies'])
+            for number in range(options['books'])
+        ])
+        readers = User.objects.bulk_create(
+            [User(username=f'reservation_bench_{number}', password='!') for number in range(options['threads'])])
+        BookInstance.objects.bulk_create(
+            [BookInstance(book=book, status='a') for book in books for _ in range(options['copies'])])
+        try:
+            barrier = Barrier(options['threads'])
+            start = perf_counter()
+            with ThreadPoolExecutor(options['threads']) as executor:
+                futures = [
+                    executor.submit(self.worker, reader, books, options['attempts'], barrier) for reader in readers]
+                results = [future.result() for future in futures]
+            elapsed = perf_counter() - start
+            totals = sum((counts for counts, _ in results), Counter())
+            handed_out = Counter(pk for _, copy_ids in results for pk in copy_ids)
+            double_booked = sum(1 for times in handed_out.values() if times > 1)
+            reserved = BookInstance.objects.filter(book__in=books, status='r').count()
+            report = {
+                'vendor': connection.vendor,
+                'threads': options['threads'],
+                'attempts': options['threads'] * options['attempts'],
+                'copies': len(books) * options['copies'],
+                **{key: totals[key] for key in ('reserved', 'refused', 'errors')},
+                'reserved_in_database': reserved,
+                'double_booked': double_booked,
+                'seconds': round(elapsed, 3),
+                'reservations_per_second': round(totals['reserved'] / elapsed, 1),
+            }
+            self.stdout.write(json.dumps(report, indent=2))
+            if double_booked or reserved != totals['reserved']:
+                raise CommandError('Copies were given out twice')
+        finally:
+            Loan.objects.filter(book__in=books).delete()
+            BookInstance.objects.filter(book__in=books).delete()
+            Book.objects.filter(pk__in=[book.pk for book in books]).delete()
+            User.objects.filter(pk__in=[reader.pk for reader in readers]).delete()
+            counters.invalidate()
+            connections.close_all()
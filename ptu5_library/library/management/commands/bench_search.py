@@ -0,0 +1,40 @@
+import json
+import random
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from library.bench import measure, rolled_back
+from library.models import Book
+from library.search import search_books
+from library import search
+from library.seeding import random_summary, random_text, vocabulary
+
+
+class Command(BaseCommand):
+    help = 'Compare full text search against the old icontains search on a synthetic catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=20000, help='synthetic books to add (rolled back afterwards)')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=3)
+        parser.add_argument('queries', nargs='*', help='search texts, by default a common, a rare and a two word query')
+
+    def handle(self, *args, **options):
+        rng = random.Random(42)
+        words = vocabulary(rng)
+        queries = options['queries'] or [words[0], words[500], f'{words[3]} {words[40]}']
+        with rolled_back():
+            books = Book.objects.bulk_create(
+                [Book(title=random_text(rng, words, 3).title(), summary=random_summary(rng, words))
+                    for _ in range(options['books'])],
+                batch_size=1000,
+            )
+            search.index_books(Book.objects.filter(pk__in=[book.pk for book in books]).iterator())
+            results = {}
+            for query in queries:
+                icontains = Book.objects.filter(Q(title__icontains=query) | Q(summary__icontains=query))
+                full_text = search_books(Book.objects.all(), query)
+                results[query] = {
+                    name: measure(lambda: (queryset.count(), list(queryset[:options['page_size']])), options['repeat'])
+                    for name, queryset in (('icontains', icontains), ('full_text', full_text))
+                }
+        self.stdout.write(json.dumps(results, indent=2))
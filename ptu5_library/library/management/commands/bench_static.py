@@ -0,0 +1,107 @@
+import json
+import os
+import re
+import tempfile
+from types import ModuleType
+from wsgiref.util import FileWrapper
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.urls import re_path
+from django.views.static import serve
+from library.bench import measure
+
+
+def before_urlconf():
+    """Static files and uploads served like the static() URL helper did."""
+    urlconf = ModuleType('bench_static_urls')
+    urlconf.urlpatterns = [
+        re_path(r'^%s(?P<path>.*)$' % re.escape(prefix.lstrip('/')), serve, kwargs={'document_root': root})
+        for prefix, root in ((settings.STATIC_URL, settings.STATIC_ROOT), (settings.MEDIA_URL, settings.MEDIA_ROOT))
+    ]
+    return urlconf
+
+
+class Command(BaseCommand):
+    help = '''Compare the worker time of serving static files and uploads before and after library/assets.py.
+
+    Requests go through the whole WSGI handler with its middleware, and the
+    server's file wrapper is used when the response allows it. "before" is
+    django.views.static.serve as the static() URL helper used it, "after"
+    the views of library/assets.py. Static files are collected into a
+    temporary directory and a random upload of --media-kb is written next to
+    them, nothing is kept.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=200)
+        parser.add_argument('--media-kb', type=int, default=1024)
+        parser.add_argument('--range-kb', type=int, default=64)
+        parser.add_argument('--static', default='library/css/base.css', help='static file to fetch')
+
+    def fetch(self, handler, environ) -> dict:
+        """Run one request like a WSGI server would, returns what was sent."""
+        sent = {}
+
+        def start_response(status, headers):
+            sent['status'] = int(status.split()[0])
+            sent['headers'] = dict(headers)
+
+        result = handler(dict(environ), start_response)
+        try:
+            sent['bytes'] = sum(len(chunk) for chunk in result)
+        finally:
+            result.close()
+        sent['file_wrapper'] = isinstance(result, FileWrapper)
+        return sent
+
+    def case(self, handler, path, repeat, **headers) -> dict:
+        environ = {**RequestFactory().get(path, **headers).environ, 'wsgi.file_wrapper': FileWrapper}
+        sent = self.fetch(handler, environ)
+        return {
+            'status': sent['status'],
+            'bytes': sent['bytes'],
+            'file_wrapper': sent['file_wrapper'],
+            'cache_control': sent['headers'].get('Cache-Control'),
+            **measure(lambda: self.fetch(handler, environ), repeat),
+        }
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        handler = WSGIHandler()
+        with tempfile.TemporaryDirectory() as static_root, tempfile.TemporaryDirectory() as media_root, \
+                override_settings(STATIC_ROOT=static_root, MEDIA_ROOT=media_root, DEBUG=False,
+                    ALLOWED_HOSTS=['testserver']):
+            call_command('collectstatic', interactive=False, verbosity=0)
+            source = settings.STATIC_URL + options['static']
+            hashed = staticfiles_storage.url(options['static'])
+            upload = settings.MEDIA_URL + 'upload.bin'
+            with open(os.path.join(media_root, 'upload.bin'), 'wb') as file:
+                file.write(os.urandom(options['media_kb'] * 1024))
+            etags = {path: handler(RequestFactory().get(path).environ, lambda *args: None).headers['ETag']
+                for path in (hashed, upload)}
+            with override_settings(ROOT_URLCONF=before_urlconf()):
+                before = {
+                    'static': self.case(handler, source, repeat),
+                    'media': self.case(handler, upload, repeat),
+                }
+            results = {
+                'static': {
+                    'before': before['static'],
+                    'after': self.case(handler, hashed, repeat, HTTP_ACCEPT_ENCODING='gzip, br'),
+                    'after_revalidated': self.case(handler, hashed, repeat, HTTP_IF_NONE_MATCH=etags[hashed]),
+                },
+                'media': {
+                    'before': before['media'],
+                    'after': self.case(handler, upload, repeat),
+                    'after_range': self.case(handler, upload, repeat, HTTP_RANGE=f"bytes=0-{options['range_kb'] * 1024 - 1}"),
+                    'after_revalidated': self.case(handler, upload, repeat, HTTP_IF_NONE_MATCH=etags[upload]),
+                },
+            }
+        for files in results.values():
+            for name, result in files.items():
+                if name != 'before':
+                    result['saved_ms'] = round(files['before']['mean'] - result['mean'], 3)
+        self.stdout.write(json.dumps({'repeat': repeat, 'static_file': hashed, 'results': results}, indent=2))
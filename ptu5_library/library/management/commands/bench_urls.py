@@ -0,0 +1,103 @@
+import json
+from datetime import date, timedelta
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLPattern, reverse
+from library import counters, facets, urls as library_urls, versions
+from library.bench import measure, rolled_back
+from library.models import Author, Book, BookInstance
+from library.seeding import seed
+from user_profile import urls as user_profile_urls
+
+User = get_user_model()
+
+
+def pages() -> list:
+    """(name, route arguments) of every page in library/urls.py and user_profile/urls.py."""
+    return [(pattern.name, list(pattern.pattern.converters)) for module in (library_urls, user_profile_urls)
+        for pattern in module.urlpatterns if isinstance(pattern, URLPattern)]
+
+
+def url_kwargs(name, arguments, book, author, loan) -> dict:
+    """Fill the route arguments of a page with objects of the seeded catalog."""
+    kwargs = {}
+    for argument in arguments:
+        if argument == 'author_id' or name == 'api_author':
+            kwargs[argument] = author.pk
+        elif name.startswith('user_bookinstance_'):
+            kwargs[argument] = loan.pk
+        elif argument == 'pk':
+            kwargs[argument] = book.pk
+        else:
+            raise CommandError(f'Do not know how to fill {argument} of {name}')
+    return kwargs
+
+
+class Command(BaseCommand):
+    help = '''GET every page of library/urls.py and user_profile/urls.py with the test
+    client at growing catalog sizes, logged in as staff, and report latency
+    percentiles and query counts per page as JSON.
+
+    The catalog is seeded inside a transaction that is rolled back at the end,
+    on top of what the database already holds.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000], help='books in the catalog')
+        parser.add_argument('--copies-per-book', type=int, default=3)
+        parser.add_argument('--reviews-per-book', type=int, default=2)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--repeat', type=int, default=20, help='requests per page and size')
+
+    def fetch(self, client, path):
+        response = client.get(path)
+        if response.status_code != 200:
+            raise CommandError(f'GET {path} answered {response.status_code}')
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def bench(self, client, book, author, loan, repeat) -> dict:
+        results = {}
+        for name, arguments in pages():
+            path = reverse(name, kwargs=url_kwargs(name, arguments, book, author, loan))
+            # warm the caches, then count the queries of a warm request
+            self.fetch(client, path)
+            with CaptureQueriesContext(connection) as queries:
+                self.fetch(client, path)
+            results[name] = {'path': path, 'queries': len(queries), **measure(lambda: self.fetch(client, path), repeat)}
+        return results
+
+    def handle(self, *args, **options):
+        sizes = sorted(set(options['sizes']))
+        if sizes[0] < 1:
+            raise CommandError('Sizes are numbers of books, at least 1')
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']), rolled_back():
+            staff = User.objects.create_user('bench_urls', password='!', is_staff=True)
+            client = Client()
+            client.force_login(staff)
+            seeded = 0
+            for size in sizes:
+                seed(
+                    books=size - seeded,
+                    copies_per_book=options['copies_per_book'],
+                    reviews=(size - seeded) * options['reviews_per_book'],
+                    users=options['users'],
+                    seed=size,
+                )
+                seeded = size
+                book = Book.objects.order_by('-id').first()
+                author = Author.objects.order_by('-id').first()
+                loan = BookInstance.objects.filter(book=book).first() or BookInstance.objects.create(book=book)
+                BookInstance.objects.filter(pk=loan.pk).update(
+                    status='r', reader=staff, due_back=date.today() + timedelta(days=14))
+                results[size] = self.bench(client, book, author, loan, options['repeat'])
+                self.stderr.write(f'{size} books done')
+        # the rolled back rows are still in the caches
+        counters.invalidate()
+        facets.invalidate()
+        versions.bump('authors', 'genres', *(versions.table(model) for model in (Author, Book, BookInstance)))
+        self.stdout.write(json.dumps({'repeat': options['repeat'], 'sizes': results}, indent=2))
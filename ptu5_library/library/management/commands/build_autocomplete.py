@@ -0,0 +1,16 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from library import autocomplete
+
+
+class Command(BaseCommand):
+    help = '''Write the autocomplete snapshot of book titles and author names.
+
+    Workers write it themselves when it is missing or stale, run this after
+    deploys or bulk imports so the first searches do not have to.'''
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        entries = autocomplete.write_snapshot()
+        self.stdout.write(self.style.SUCCESS(
+            f'{entries} entries written to {autocomplete.snapshot_path()} in {perf_counter() - start:.1f}s'))
@@ -0,0 +1,21 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from library import recommendations
+
+
+class Command(BaseCommand):
+    help = '''Store the top neighbours of every book for "readers who borrowed this also borrowed".
+
+    Only books touched by loans and reviews since the last run are recomputed,
+    unless --full is given or nothing was built yet. Run it from cron.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='recompute every book')
+        parser.add_argument('--top-k', type=int, default=recommendations.TOP_K, help='neighbours kept per book')
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        build = (recommendations.build if options['full'] else recommendations.update)(options['top_k'])
+        kind = 'Full' if build.full else 'Incremental'
+        self.stdout.write(self.style.SUCCESS(
+            f'{kind} build of {build.books} books in {perf_counter() - start:.1f}s'))
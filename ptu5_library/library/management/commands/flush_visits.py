@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from library import visits
+
+
+class Command(BaseCommand):
+    help = '''Write the home page visits buffered in the cache to VisitStat.
+
+    The web workers flush their visits themselves, this is for a VISITS_CACHE
+    shared by the workers, e.g. from cron before a deploy. Buffered days older
+    than --days are not looked at any more.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=visits.FLUSH_DAYS, help='recent days to flush')
+
+    def handle(self, *args, **options):
+        flushed = visits.flush(options['days'])
+        self.stdout.write(self.style.SUCCESS(f'Flushed {flushed} visits'))
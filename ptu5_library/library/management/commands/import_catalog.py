@@ -0,0 +1,201 @@
+import csv
+import json
+from itertools import islice
+from pathlib import Path
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from library.models import Author, Book, BookInstance, Genre
+from library import autocomplete, counters, facets, search, versions
+
+BookGenre = Book.genre.through
+
+
+def read_csv(file):
+    for row in csv.DictReader(file):
+        row['genres'] = [name.strip() for name in (row.get('genres') or '').split('|') if name.strip()]
+        yield row
+
+
+def read_jsonl(file):
+    for line in file:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                # reported by clean_row like any other bad row
+                yield None
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+# longest text the columns take, summary has no limit
+TEXT_COLUMNS = {'isbn': 13, 'title': 255, 'summary': None, 'author_first_name': 50, 'author_last_name': 50}
+GENRE_LENGTH = 200
+# more is a typo in the feed rather than a library
+MAX_COPIES = 1000
+# invalid rows listed in the summary, the rest are only counted
+REPORTED_ERRORS = 20
+
+
+def clean_row(row, default_copies) -> dict:
+    """The row with its types checked and copies as a number, raises ValueError saying what is wrong."""
+    if not isinstance(row, dict):
+        raise ValueError('not a JSON object')
+    cleaned = {}
+    for name, max_length in TEXT_COLUMNS.items():
+        value = row.get(name)
+        if value is None:
+            value = ''
+        if not isinstance(value, str):
+            raise ValueError(f'{name} is not text')
+        if max_length and len(value) > max_length:
+            raise ValueError(f'{name} is longer than {max_length} characters')
+        cleaned[name] = value
+    cleaned['isbn'] = cleaned['isbn'].strip()
+    if not cleaned['isbn'] or not cleaned['title']:
+        raise ValueError('isbn and title are required')
+    genres = row.get('genres') or []
+    if not isinstance(genres, list) or not all(isinstance(name, str) for name in genres):
+        raise ValueError('genres is not a list of names')
+    if any(len(name) > GENRE_LENGTH for name in genres):
+        raise ValueError(f'a genre is longer than {GENRE_LENGTH} characters')
+    cleaned['genres'] = genres
+    copies = row.get('copies')
+    if copies is None or copies == '':
+        copies = default_copies
+    try:
+        if isinstance(copies, (bool, float)):
+            raise ValueError
+        copies = int(copies)
+    except (TypeError, ValueError):
+        raise ValueError('copies is not a whole number')
+    if not 0 <= copies <= MAX_COPIES:
+        raise ValueError(f'copies is not between 0 and {MAX_COPIES}')
+    cleaned['copies'] = copies
+    return cleaned
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while chunk := list(islice(rows, size)):
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = '''Import books from a CSV or JSON lines publisher feed.
+
+    Columns: isbn, title, summary, author_first_name, author_last_name,
+    genres (a list in JSON, names separated by | in CSV) and copies.
+    Books are matched by ISBN, existing ones are updated, new ones get
+    the given number of available copies. Rows that do not fit the columns
+    are skipped and listed at the end.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=READERS, help='defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--copies', type=int, default=0, help='copies for new books without a copies column')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in READERS:
+            raise CommandError(f'Unknown feed format "{file_format}", use --format')
+        self.default_copies = options['copies']
+        self.authors = {(first, last): pk for pk, first, last in Author.objects.values_list('id', 'first_name', 'last_name')}
+        self.genres = dict(Genre.objects.values_list('name', 'id'))
+        self.errors = []
+        totals = {'rows': 0, 'created': 0, 'updated': 0, 'skipped': 0, 'copies': 0}
+        start = perf_counter()
+        with path.open(newline='', encoding='utf-8') as file:
+            for chunk in chunked(self.valid_rows(READERS[file_format](file)), options['chunk_size']):
+                with transaction.atomic():
+                    result = self.import_chunk(chunk)
+                for key, value in result.items():
+                    totals[key] += value
+                totals['rows'] += len(chunk)
+                if options['verbosity'] > 1:
+                    self.stdout.write(f"{totals['rows']} rows, {totals['rows'] / (perf_counter() - start):.0f} rows/sec")
+        counters.invalidate()
+        facets.invalidate()
+        versions.bump(autocomplete.VERSION, *(versions.table(model) for model in (Author, Book, BookInstance, Genre)))
+        elapsed = perf_counter() - start
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {totals['rows']} rows in {elapsed:.1f}s ({totals['rows'] / elapsed:.0f} rows/sec): "
+            f"{totals['created']} books created, {totals['updated']} updated, {totals['skipped']} skipped, "
+            f"{totals['copies']} copies added"
+        ))
+        if self.errors:
+            self.stderr.write(f'{len(self.errors)} invalid rows were not imported:')
+            for error in self.errors[:REPORTED_ERRORS]:
+                self.stderr.write(f'  {error}')
+            if len(self.errors) > REPORTED_ERRORS:
+                self.stderr.write(f'  and {len(self.errors) - REPORTED_ERRORS} more')
+
+    def valid_rows(self, rows):
+        for number, row in enumerate(rows, 1):
+            try:
+                yield clean_row(row, self.default_copies)
+            except ValueError as e:
+                self.errors.append(f'row {number}: {e}')
+
+    def add_missing_authors(self, rows):
+        missing = {
+            (row.get('author_first_name') or '', row.get('author_last_name') or '') for row in rows
+            if row.get('author_first_name') or row.get('author_last_name')
+        } - self.authors.keys()
+        for author in Author.objects.bulk_create([Author(first_name=first, last_name=last) for first, last in missing]):
+            self.authors[(author.first_name, author.last_name)] = author.id
+        if missing:
+            versions.bump('authors')
+
+    def add_missing_genres(self, rows):
+        missing = {name for row in rows for name in row.get('genres') or []} - self.genres.keys()
+        for genre in Genre.objects.bulk_create([Genre(name=name) for name in missing]):
+            self.genres[genre.name] = genre.id
+        if missing:
+            versions.bump('genres')
+
+    def import_chunk(self, chunk) -> dict:
+        # the last row wins when a feed repeats an ISBN inside one chunk
+        rows = list({row['isbn']: row for row in chunk}.values())
+        self.add_missing_authors(rows)
+        self.add_missing_genres(rows)
+        isbns = [row['isbn'] for row in rows]
+        existing = set(Book.objects.filter(isbn__in=isbns).values_list('isbn', flat=True))
+        copy_counts = {row['isbn']: row['copies'] for row in rows if row['isbn'] not in existing}
+        Book.objects.bulk_create(
+            [Book(
+                isbn=row['isbn'],
+                title=row['title'],
+                summary=row.get('summary') or '',
+                author_id=self.authors.get((row.get('author_first_name') or '', row.get('author_last_name') or '')),
+                # only new books get copies, the counts are not part of update_fields
+                total_copies=copy_counts.get(row['isbn'], 0),
+                available_copies=copy_counts.get(row['isbn'], 0),
+            ) for row in rows],
+            update_conflicts=True,
+            unique_fields=['isbn'],
+            update_fields=['title', 'summary', 'author_id'],
+        )
+        book_ids = dict(Book.objects.filter(isbn__in=isbns).values_list('isbn', 'id'))
+        updated_ids = [book_ids[isbn] for isbn in existing]
+        BookGenre.objects.filter(book_id__in=updated_ids).delete()
+        BookGenre.objects.bulk_create(
+            [BookGenre(book_id=book_ids[row['isbn']], genre_id=self.genres[name])
+                for row in rows for name in set(row.get('genres') or [])],
+            ignore_conflicts=True,
+        )
+        copies = [
+            BookInstance(book_id=book_ids[isbn], status='a') for isbn, count in copy_counts.items() for _ in range(count)
+        ]
+        BookInstance.objects.bulk_create(copies, batch_size=5000)
+        search.index_rows((book_ids[row['isbn']], row['title'], row.get('summary')) for row in rows)
+        # the detail page fragments of updated books, bulk_create sends no post_save
+        versions.bump(*(f'book:{book_id}' for book_id in updated_ids))
+        return {
+            'created': len(rows) - len(existing),
+            'updated': len(existing),
+            'skipped': len(chunk) - len(rows),
+            'copies': len(copies),
+        }
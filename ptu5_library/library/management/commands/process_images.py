@@ -0,0 +1,77 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from library import images, versions
+from library.models import Book, ImageJob
+from user_profile.models import Profile
+
+# models and image fields that have renditions
+IMAGE_FIELDS = ((Book, 'cover'), (Profile, 'photo'))
+
+
+def render_job(job, source_name):
+    try:
+        return images.render(source_name), ''
+    except Exception as e:
+        return '', f'{type(e).__name__}: {e}'
+
+
+class Command(BaseCommand):
+    help = 'Produce the thumbnail, list and detail renditions of uploaded book covers and profile photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4, help='images resized in parallel')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--scan', action='store_true', help='queue every image that has no renditions yet')
+        parser.add_argument('--watch', type=float, metavar='SECONDS', help='keep polling for new jobs')
+
+    def handle(self, *args, **options):
+        if options['scan']:
+            self.scan()
+        with ThreadPoolExecutor(options['workers']) as pool:
+            while True:
+                processed = self.process_batch(pool, options['batch_size'])
+                if processed:
+                    self.stdout.write(f'{processed} images processed')
+                elif options['watch']:
+                    time.sleep(options['watch'])
+                else:
+                    break
+
+    def scan(self):
+        for model, field_name in IMAGE_FIELDS:
+            queryset = model.objects.exclude(**{field_name: ''}).exclude(**{f'{field_name}__isnull': True}) \
+                .filter(**{images.hash_field(field_name): ''})
+            for instance in queryset.only('pk').iterator():
+                images.enqueue(instance, field_name)
+
+    def process_batch(self, pool, batch_size) -> int:
+        jobs = list(ImageJob.objects.filter(processed_at__isnull=True).select_related('content_type')[:batch_size])
+        tasks = []
+        for job in jobs:
+            instance = job.content_type.model_class().objects.filter(pk=job.object_id).first()
+            source = getattr(instance, job.field_name, None)
+            if source:
+                tasks.append((job, source.name))
+            else:
+                # the object or its image is gone, nothing to render
+                job.processed_at = timezone.now()
+                job.save(update_fields=['processed_at'])
+        for (job, source_name), (content_hash, error) in zip(tasks, pool.map(lambda task: render_job(*task), tasks)):
+            if content_hash:
+                model = job.content_type.model_class()
+                updated = model.objects.filter(pk=job.object_id, **{job.field_name: source_name}) \
+                    .update(**{images.hash_field(job.field_name): content_hash})
+                if not updated:
+                    # a newer upload replaced the image meanwhile, keep the job for it
+                    continue
+                if model is Profile:
+                    # review avatars are cached with the book detail page
+                    versions.bump_reader(Profile.objects.filter(pk=job.object_id).values_list('user_id', flat=True).get())
+                elif model is Book:
+                    versions.bump(f'book:{job.object_id}', versions.table(Book))
+            job.processed_at = timezone.now()
+            job.error = error
+            job.save(update_fields=['processed_at', 'error'])
+        return len(tasks)
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from library import counters
+
+
+class Command(BaseCommand):
+    help = 'Recount the home page dashboard counters and store them in the cache'
+
+    def handle(self, *args, **options):
+        for name, value in counters.rebuild().items():
+            self.stdout.write(f'{name}: {value}')
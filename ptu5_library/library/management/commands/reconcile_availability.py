@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from library.models import Book
+from library import versions
+
+
+class Command(BaseCommand):
+    help = '''Recompute total_copies and available_copies of every book from its copies.
+
+    Signals and reservations keep the counts current, this repairs them after
+    bulk changes that bypassed both, e.g. queryset.update() or raw SQL.'''
+
+    def handle(self, *args, **options):
+        fixed = Book.objects.recount_copies()
+        if fixed:
+            versions.bump(versions.table(Book))
+        self.stdout.write(self.style.SUCCESS(f'{fixed} books had wrong copy counts'))
@@ -0,0 +1,30 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand
+from library.seeding import PASSWORD, seed
+
+
+class Command(BaseCommand):
+    help = f'''Add a synthetic catalog with readers, copies and reviews, written with bulk inserts.
+
+    Seeded readers are called reader_<n> and log in with the password "{PASSWORD}".'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--books', type=int, default=1000)
+        parser.add_argument('--copies-per-book', type=int, default=3)
+        parser.add_argument('--reviews', type=int, default=2000)
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--seed', type=int, default=42, help='seed of the random generator')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = perf_counter()
+        created = seed(
+            books=options['books'],
+            copies_per_book=options['copies_per_book'],
+            reviews=options['reviews'],
+            users=options['users'],
+            seed=options['seed'],
+            batch_size=options['batch_size'],
+        )
+        summary = ', '.join(f'{count} {name}' for name, count in created.items())
+        self.stdout.write(self.style.SUCCESS(f'Seeded {summary} in {perf_counter() - start:.1f}s'))
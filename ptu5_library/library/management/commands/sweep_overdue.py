@@ -0,0 +1,49 @@
+from django.conf import settings
+from django.core.mail import send_mass_mail
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from library.models import BookInstance
+
+
+def reminder(copy) -> tuple:
+    return (
+        f'Overdue book: {copy.book.title}',
+        f'Hello {copy.reader.get_username()},\n\n'
+        f'"{copy.book.title}" was due back on {copy.due_back}. Please return or extend it.\n',
+        settings.DEFAULT_FROM_EMAIL,
+        [copy.reader.email],
+    )
+
+
+class Command(BaseCommand):
+    help = '''Send one reminder for every overdue loan.
+
+    Loans are handled in batches ordered by id. A batch is marked as reminded
+    right after its mails are sent, so an interrupted run resumes where it
+    stopped and at most one batch is mailed twice.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='only count overdue loans')
+
+    def handle(self, *args, **options):
+        pending = BookInstance.objects.overdue().filter(reminder_sent_at__isnull=True)
+        if options['dry_run']:
+            self.stdout.write(f'{pending.count()} overdue loans to remind')
+            return
+        last_id, loans, mails = 0, 0, 0
+        while True:
+            batch = list(
+                pending.filter(id__gt=last_id).select_related('book', 'reader').order_by('id')[:options['batch_size']])
+            if not batch:
+                break
+            messages = [reminder(copy) for copy in batch if copy.reader and copy.reader.email]
+            mails += send_mass_mail(messages, fail_silently=False)
+            # loans changed meanwhile keep their new state
+            BookInstance.objects.filter(pk__in=[copy.pk for copy in batch], reminder_sent_at__isnull=True) \
+                .overdue().update(reminder_sent_at=timezone.now())
+            loans += len(batch)
+            last_id = batch[-1].id
+            if options['verbosity'] > 1:
+                self.stdout.write(f'{loans} overdue loans, {mails} reminders sent')
+        self.stdout.write(self.style.SUCCESS(f'{loans} overdue loans, {mails} reminders sent'))
@@ -0,0 +1,68 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:34
+
+import html
+from itertools import islice
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.html import strip_tags
+
+# The SQL is spelled out here rather than taken from library.search, so this
+# migration keeps doing what it did when it was written.
+FTS_TABLE = 'library_book_fts'
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(document, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+        )
+        insert = f"INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s || ' ' || %s)"
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {FTS_TABLE} ("
+            "rowid bigint PRIMARY KEY REFERENCES library_book (id) ON DELETE CASCADE, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(f"CREATE INDEX {FTS_TABLE}_document ON {FTS_TABLE} USING GIN (document)")
+        insert = (
+            f"INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, "
+            "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B'))"
+        )
+    else:
+        return
+    Book = apps.get_model('library', 'Book')
+    rows = Book.objects.using(schema_editor.connection.alias).values_list('id', 'title', 'summary').iterator(chunk_size=2000)
+    with schema_editor.connection.cursor() as cursor:
+        while chunk := list(islice(rows, 2000)):
+            cursor.executemany(insert, [
+                (book_id, title, html.unescape(strip_tags(summary or ''))) for book_id, title, summary in chunk
+            ])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_alter_bookreview_book'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookSearchDocument',
+            fields=[
+                ('book', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_document', serialize=False, to='library.book')),
+                ('document', models.TextField()),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'library_book_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_duplicate_isbns(apps, schema_editor):
+    """Stop before the unique index fails on books sharing an ISBN, blank ones included."""
+    Book = apps.get_model('library', 'Book')
+    books = Book.objects.using(schema_editor.connection.alias)
+    duplicates = list(
+        books.exclude(isbn=None).values('isbn').annotate(books=Count('id')).filter(books__gt=1)
+        .order_by('isbn').values_list('isbn', flat=True)[:20]
+    )
+    if duplicates:
+        rows = []
+        for isbn in duplicates:
+            ids = books.filter(isbn=isbn).order_by('id').values_list('id', flat=True)
+            rows.append(f"{isbn or '(blank)'}: books {', '.join(map(str, ids))}")
+        raise RuntimeError(
+            'ISBNs must be unique before this migration, change the ISBN of all but one book of each, '
+            'or clear blank ones to NULL: ' + '; '.join(rows)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_loan_workflow_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_isbns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='book',
+            name='isbn',
+            field=models.CharField(blank=True, help_text='<a href="https://www.isbn-international.org/content/what-isbn" target="_blank">ISBN code</a> consisting of 13 symbols', max_length=13, null=True, unique=True, verbose_name='ISBN'),
+        ),
+    ]
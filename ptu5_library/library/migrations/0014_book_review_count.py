@@ -0,0 +1,32 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:44
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_reviews(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookReview = apps.get_model('library', 'BookReview')
+    counts = BookReview.objects.filter(book=OuterRef('pk')).order_by().values('book').annotate(count=Count('id')).values('count')
+    Book.objects.using(schema_editor.connection.alias).update(review_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_image_renditions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='review_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='review count'),
+        ),
+        migrations.AddIndex(
+            model_name='bookreview',
+            index=models.Index(fields=['book', '-created_at', '-id'], name='bookreview_book_created_idx'),
+        ),
+        migrations.RunPython(count_reviews, migrations.RunPython.noop),
+    ]
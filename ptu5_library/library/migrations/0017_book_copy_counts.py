@@ -0,0 +1,40 @@
+# Generated by Django 4.1.3 on 2026-10-18 07:52
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_copies(apps, schema_editor):
+    Book = apps.get_model('library', 'Book')
+    BookInstance = apps.get_model('library', 'BookInstance')
+    copies = BookInstance.objects.filter(book=OuterRef('pk')).order_by().values('book')
+    Book.objects.using(schema_editor.connection.alias).update(
+        total_copies=Coalesce(Subquery(copies.annotate(count=Count('id')).values('count')), 0),
+        available_copies=Coalesce(Subquery(copies.annotate(count=Count('id', filter=Q(status='a'))).values('count')), 0),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0016_bookinstance_reminder_sent_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='available_copies',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='available copies'),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='total_copies',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='total copies'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['-available_copies', 'title', 'id'], name='book_availability_idx'),
+        ),
+        migrations.RunPython(count_copies, migrations.RunPython.noop),
+    ]
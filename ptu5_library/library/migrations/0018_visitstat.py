@@ -0,0 +1,24 @@
+# Generated by Django 4.1.3 on 2026-10-18 08:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0017_book_copy_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VisitStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(unique=True, verbose_name='day')),
+                ('visits', models.PositiveBigIntegerField(default=0, verbose_name='visits')),
+            ],
+            options={
+                'ordering': ('-day',),
+            },
+        ),
+    ]
@@ -1,8 +1,9 @@
 from django.contrib.auth import get_user_model
-from django.db import models
+from django.contrib.contenttypes.models import ContentType
+from django.db import models, router, transaction
 from django.utils.html import format_html
 from django.urls import reverse
-from django.utils.timezone import datetime
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from tinymce.models import HTMLField
 import uuid
@@ -16,7 +17,7 @@ class Genre(models.Model):
         return self.name
 
     def link_filtered_books(self):
-        link = reverse('books')+ '?genre_id='+str(self.id)
+        link = reverse('books') + '?genre_id=' + str(self.id)
         return format_html('<a class="genre" href="{link}">{name}</a>', link=link, name=self)
 
 # Importavome modelių paketą
@@ -45,10 +46,38 @@ class Author(models.Model):
         verbose_name_plural = _('authors')
 
 
+class BookQuerySet(models.QuerySet):
+    def for_catalog(self):
+        return self.select_related('author').prefetch_related('genre')
+
+    def recount_copies(self) -> int:
+        """Recompute the copy counts with one grouped query, returns how many books were off."""
+        counts = {
+            book_id: (total, available) for book_id, total, available in BookInstance.objects
+                .filter(book__in=self.values('pk')).order_by().values('book_id')
+                .annotate(total=models.Count('id'), available=models.Count('id', filter=models.Q(status='a')))
+                .values_list('book_id', 'total', 'available')
+        }
+        stale = []
+        for book in self.only('id', 'total_copies', 'available_copies').order_by().iterator(chunk_size=2000):
+            total, available = counts.get(book.id, (0, 0))
+            if (book.total_copies, book.available_copies) != (total, available):
+                book.total_copies, book.available_copies = total, available
+                stale.append(book)
+        self.model.objects.bulk_update(stale, ['total_copies', 'available_copies'], batch_size=1000)
+        return len(stale)
+
+    def adjust_copies(self, total=0, available=0):
+        return self.update(
+            total_copies=models.F('total_copies') + total,
+            available_copies=models.F('available_copies') + available,
+        )
+
+
 class Book(models.Model):
     title = models.CharField(_('title'), max_length=255) #reikia nurodyti ilgi
     summary = HTMLField(_('summary')) 
-    isbn = models.CharField('ISBN', max_length=13, null=True, blank=True, 
+    isbn = models.CharField('ISBN', max_length=13, null=True, blank=True, unique=True,
         help_text=_('<a href="https://www.isbn-international.org/content/what-isbn" target="_blank">ISBN code</a> consisting of 13 symbols'))
     author = models.ForeignKey(Author, on_delete=models.SET_NULL, null=True, blank=True, related_name='books')
     
@@ -58,14 +87,54 @@ class Book(models.Model):
     #do nothing - ismes klaida bandant trinti (nerekomenduojama)
     genre = models.ManyToManyField(Genre, help_text=_('Choose genre(s) for this book'), verbose_name=_('genre(s)'))
     cover = models.ImageField("cover", upload_to='covers', blank=True, null=True)
+    # sha256 of the processed cover, renditions are stored under it (see library.images)
+    cover_hash = models.CharField(max_length=64, blank=True, editable=False)
+    # kept up to date by BookReview signals
+    review_count = models.PositiveIntegerField(_('review count'), default=0, editable=False)
+    # kept up to date by BookInstance signals and library.reservations,
+    # reconcile_availability repairs them after bulk changes
+    total_copies = models.PositiveIntegerField(_('total copies'), default=0, editable=False)
+    available_copies = models.PositiveIntegerField(_('available copies'), default=0, editable=False)
+
+    objects = BookQuerySet.as_manager()
 
     def __str__(self) -> str:
         return f"{self.author} - {self.title}"
 
     def display_genre(self) -> str:
-        return ', '.join(genre.name for genre in self.genre.all()[:3])
+        # slicing the list keeps prefetched genres in use
+        return ', '.join(genre.name for genre in list(self.genre.all())[:3])
     display_genre.short_description = 'genre(s)'
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-available_copies', 'title', 'id'], name='book_availability_idx'),
+        ]
+
+
+class BookSearchDocument(models.Model):
+    # full text index row, the table is created by the 0010 migration (see library.search)
+    book = models.OneToOneField(Book, primary_key=True, db_column='rowid', on_delete=models.DO_NOTHING, related_name='search_document')
+    document = models.TextField()
+    rank = models.FloatField()  # fts5 hidden column, only exists on SQLite
+
+    class Meta:
+        managed = False
+        db_table = 'library_book_fts'
+
+
+class BookInstanceQuerySet(models.QuerySet):
+    def overdue(self):
+        # served by bookinstance_status_due_idx
+        return self.filter(status='t', due_back__lt=timezone.localdate())
+
+    def with_overdue(self):
+        """Annotate overdue so it can be filtered and sorted on in the database."""
+        return self.annotate(overdue=models.ExpressionWrapper(
+            models.Q(status='t', due_back__lt=timezone.localdate()),
+            output_field=models.BooleanField(),
+        ))
+
 
 class BookInstance(models.Model):
     unique_id = models.UUIDField(_('unique ID'), default=uuid.uuid4, editable=False)
@@ -81,19 +150,106 @@ class BookInstance(models.Model):
 
     status = models.CharField('status', max_length=1, choices=LOAN_STATUS, default='m')
     reader = models.ForeignKey(get_user_model(), verbose_name="reader", on_delete=models.SET_NULL, null=True, blank=True, related_name='taken_noobs')
+    # bumped by every reservation state change, see library.reservations
+    version = models.PositiveIntegerField(default=0, editable=False)
+    # set by sweep_overdue, cleared whenever the loan changes
+    reminder_sent_at = models.DateTimeField('reminder sent at', null=True, blank=True, editable=False)
+
+    objects = BookInstanceQuerySet.as_manager()
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # what the book counts saw, so signals can tell how a save moves them
+        instance._counted = (instance.__dict__.get('book_id'), int(instance.__dict__.get('status') == 'a'))
+        return instance
+
+    def save(self, *args, **kwargs):
+        # the counts of the book are updated by signals inside the same transaction
+        with transaction.atomic(using=kwargs.get('using') or router.db_for_write(BookInstance, instance=self)):
+            super().save(*args, **kwargs)
 
     @property
     def is_overdue(self):
-        if self.due_back and self.due_back < datetime.date(datetime.now()):
-            return True
-        return False
-    
+        if hasattr(self, 'overdue'):
+            return self.overdue
+        return bool(self.status == 't' and self.due_back and self.due_back < timezone.localdate())
 
     def __str__(self) -> str:
         return f"{self.unique_id}: {self.book.title}"
 
     class Meta: #griezta aprasomoji klase
         ordering = ['due_back']
+        indexes = [
+            models.Index(fields=['reader', 'due_back'], name='bookinstance_reader_due_idx'),
+            models.Index(fields=['status', 'due_back'], name='bookinstance_status_due_idx'),
+        ]
+
+
+class Loan(models.Model):
+    """Append-only history of loan events, written by library.reservations.
+
+    Ids are kept without foreign key constraints, so history outlives the
+    copies, books and readers it refers to. Old months are moved out with
+    manage.py archive_loans.
+    """
+    EVENTS = (
+        ('reserve', _("reserved")),
+        ('cancel', _("reservation cancelled")),
+        ('take', _("taken")),
+        ('extend', _("extended")),
+        ('return', _("returned")),
+    )
+
+    event = models.CharField(_('event'), max_length=10, choices=EVENTS)
+    copy = models.ForeignKey(BookInstance, verbose_name="copy", on_delete=models.DO_NOTHING, db_constraint=False, related_name='loans')
+    book = models.ForeignKey(Book, verbose_name="book", on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    reader = models.ForeignKey(get_user_model(), verbose_name="reader", on_delete=models.DO_NOTHING, db_constraint=False, null=True, related_name='loans')
+    due_back = models.DateField('due back', null=True, blank=True)
+    created_at = models.DateTimeField(_('created at'), default=timezone.now)
+
+    def __str__(self) -> str:
+        return f"{self.event} of copy {self.copy_id} by {self.reader_id} at {self.created_at}"
+
+    class Meta:
+        ordering = ('-created_at', '-id')
+        indexes = [
+            models.Index(fields=['reader', '-created_at'], name='loan_reader_created_idx'),
+            models.Index(fields=['created_at', 'id'], name='loan_created_idx'),
+        ]
+
+
+class BookRecommendation(models.Model):
+    """Top neighbours of a book by co-reading, written by manage.py build_recommendations."""
+    book = models.ForeignKey(Book, verbose_name="book", on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Book, verbose_name="recommended book", on_delete=models.CASCADE, related_name='+')
+    rank = models.PositiveSmallIntegerField(_('rank'))
+    score = models.FloatField(_('score'))
+
+    def __str__(self) -> str:
+        return f"{self.book_id} -> {self.recommended_id} ({self.rank})"
+
+    class Meta:
+        ordering = ('book', 'rank')
+        constraints = [
+            # also the index the book page reads its recommendations with
+            models.UniqueConstraint(fields=['book', 'rank'], name='bookrecommendation_book_rank_uniq'),
+        ]
+
+
+class RecommendationBuild(models.Model):
+    """A run of build_recommendations, the next incremental run starts after its ids."""
+    built_at = models.DateTimeField(auto_now_add=True)
+    full = models.BooleanField(default=False)
+    last_loan_id = models.PositiveBigIntegerField(default=0)
+    last_review_id = models.PositiveBigIntegerField(default=0)
+    books = models.PositiveIntegerField(default=0)
+
+    def __str__(self) -> str:
+        return f"{'full' if self.full else 'incremental'} build of {self.books} books at {self.built_at}"
+
+    class Meta:
+        ordering = ('-id', )
 
 
 class BookReview(models.Model):
@@ -117,3 +273,36 @@ class BookReview(models.Model):
 
     class Meta:
         ordering = ('-created_at', )
+        indexes = [
+            models.Index(fields=['reader', 'created_at'], name='bookreview_reader_created_idx'),
+            models.Index(fields=['book', '-created_at', '-id'], name='bookreview_book_created_idx'),
+        ]
+
+
+class ImageJob(models.Model):
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveBigIntegerField()
+    field_name = models.CharField(max_length=50)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.content_type.model} {self.object_id} {self.field_name}"
+
+    class Meta:
+        ordering = ('id', )
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='imagejob_pending_idx'),
+        ]
+
+
+class VisitStat(models.Model):
+    day = models.DateField(_("day"), unique=True)
+    visits = models.PositiveBigIntegerField(_("visits"), default=0)
+
+    def __str__(self):
+        return f"{self.visits} visits on {self.day}"
+
+    class Meta:
+        ordering = ('-day', )
@@ -0,0 +1,229 @@
+import base64
+import binascii
+import json
+import math
+from django.core.exceptions import FieldDoesNotExist, FieldError, ValidationError
+from django.core.paginator import InvalidPage, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.http import Http404
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(InvalidPage):
+    pass
+
+
+def parse_ordering(ordering) -> list:
+    return [(field.lstrip('-'), field.startswith('-')) for field in ordering]
+
+
+def encode_cursor(values, direction) -> str:
+    payload = json.dumps({'v': values, 'd': direction}, cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size) -> tuple:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        values, direction = payload['v'], payload['d']
+    except (binascii.Error, ValueError, TypeError, KeyError):
+        raise InvalidCursor('Invalid cursor')
+    if not isinstance(values, list) or len(values) != size or direction not in ('n', 'p'):
+        raise InvalidCursor('Invalid cursor')
+    return values, direction
+
+
+def estimated_count(queryset) -> int:
+    """Planner row estimate for a whole table on PostgreSQL, an exact count otherwise."""
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT reltuples FROM pg_class WHERE relname = %s', [queryset.model._meta.db_table])
+            row = cursor.fetchone()
+        # reltuples is -1 until the table has been analyzed
+        if row and row[0] >= 0:
+            return int(row[0])
+    return queryset.count()
+
+
+class EstimatedCountPaginator(Paginator):
+    """Page number paginator counting unfiltered tables from the planner estimate, for the admin."""
+
+    @cached_property
+    def count(self) -> int:
+        return estimated_count(self.object_list)
+
+
+class CursorPage:
+    def __init__(self, object_list, paginator, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __repr__(self):
+        return f'<Cursor page of {len(self.object_list)} objects>'
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self) -> bool:
+        return self.next_cursor is not None
+
+    def has_previous(self) -> bool:
+        return self.previous_cursor is not None
+
+    def has_other_pages(self) -> bool:
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """Keyset pagination: pages continue after the last row seen instead of using OFFSET.
+
+    ordering has to identify rows uniquely, so it should end with the primary key.
+    """
+
+    def __init__(self, object_list, per_page, ordering, estimate_count=False):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+        self.ordering = parse_ordering(ordering)
+        self.estimate_count = estimate_count
+
+    @cached_property
+    def count(self) -> int:
+        if self.estimate_count:
+            return estimated_count(self.object_list)
+        return self.object_list.count()
+
+    def order_by(self, reverse=False) -> list:
+        return [f"{'-' if descending != reverse else ''}{field}" for field, descending in self.ordering]
+
+    def keyset_filter(self, values, reverse=False) -> Q:
+        condition = Q()
+        for position, (field, descending) in enumerate(self.ordering):
+            lookup = 'lt' if descending != reverse else 'gt'
+            step = Q(**{f'{field}__{lookup}': values[position]})
+            for previous, (previous_field, _) in enumerate(self.ordering[:position]):
+                step &= Q(**{previous_field: values[previous]})
+            condition |= step
+        return condition
+
+    def ordering_field(self, name):
+        """Model field or annotation output field an ordering entry sorts on, None when unknown."""
+        query = self.object_list.query
+        if name in query.annotations:
+            try:
+                return query.annotations[name].output_field
+            except FieldError:
+                return None
+        model, *path, last = [self.object_list.model, *name.split('__')]
+        try:
+            for part in path:
+                model = model._meta.get_field(part).related_model
+            return model._meta.pk if last == 'pk' else model._meta.get_field(last)
+        except (FieldDoesNotExist, AttributeError):
+            return None
+
+    def clean_values(self, values) -> list:
+        """Cursor values as the types of their ordering fields, cursors can be forged."""
+        cleaned = []
+        for value, (name, _) in zip(values, self.ordering):
+            # the keyset comparisons have no answer for NULL, orderings coalesce nullable columns
+            if not isinstance(value, (str, int, float)) or isinstance(value, float) and not math.isfinite(value):
+                raise InvalidCursor('Invalid cursor')
+            field = self.ordering_field(name)
+            if field is not None:
+                try:
+                    value = field.to_python(value)
+                    field.run_validators(value)
+                except (ValidationError, ValueError, TypeError, OverflowError):
+                    raise InvalidCursor('Invalid cursor')
+            # SQLite reports no integer range to validate against, 64 bits is the most any backend takes
+            if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                raise InvalidCursor('Invalid cursor')
+            cleaned.append(value)
+        return cleaned
+
+    def cursor_values(self, obj) -> list:
+        return [getattr(obj, field) for field, _ in self.ordering]
+
+    def page_queryset(self, cursor) -> tuple:
+        queryset = self.object_list
+        direction = 'n'
+        if cursor:
+            values, direction = decode_cursor(cursor, len(self.ordering))
+            values = self.clean_values(values)
+            queryset = queryset.filter(self.keyset_filter(values, reverse=direction == 'p'))
+        return queryset.order_by(*self.order_by(reverse=direction == 'p'))[:self.per_page + 1], direction
+
+    def page(self, cursor=None) -> CursorPage:
+        queryset, direction = self.page_queryset(cursor)
+        return self.build_page(list(queryset), cursor, direction)
+
+    async def apage(self, cursor=None) -> CursorPage:
+        queryset, direction = self.page_queryset(cursor)
+        return self.build_page([obj async for obj in queryset], cursor, direction)
+
+    def build_page(self, rows, cursor, direction) -> CursorPage:
+        more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if direction == 'p':
+            rows.reverse()
+            has_next, has_previous = True, more
+        else:
+            has_next, has_previous = more, bool(cursor)
+        page = CursorPage(rows, self)
+        if rows and has_next:
+            page.next_cursor = encode_cursor(self.cursor_values(rows[-1]), 'n')
+        if rows and has_previous:
+            page.previous_cursor = encode_cursor(self.cursor_values(rows[0]), 'p')
+        return page
+
+    def get_page(self, cursor=None) -> CursorPage:
+        """Like page() but falls back to the first page for broken cursors."""
+        try:
+            return self.page(cursor)
+        except InvalidCursor:
+            return self.page()
+
+
+def cursor_query(request, cursor) -> str:
+    """Current query string with the cursor replaced, for page links."""
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return query.urlencode()
+
+
+class CursorPaginationMixin:
+    """ListView pagination through CursorPaginator, pages are selected with ?cursor="""
+    cursor_ordering = ('pk', )
+    estimate_count = False
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        paginator = CursorPaginator(queryset, page_size, self.get_cursor_ordering(), self.estimate_count)
+        try:
+            page = paginator.page(self.request.GET.get('cursor'))
+        except InvalidCursor as e:
+            raise Http404(str(e))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        page = context.get('page_obj')
+        if page is not None:
+            if page.has_next():
+                context['next_page_query'] = cursor_query(self.request, page.next_cursor)
+            if page.has_previous():
+                context['previous_page_query'] = cursor_query(self.request, page.previous_cursor)
+        return context
@@ -0,0 +1,111 @@
+import re
+import time
+from functools import wraps
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+
+KEY_PREFIX = 'library:ratelimit:'
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate) -> tuple:
+    """'5/h' or '10/15m' -> (5, 3600) or (10, 900)"""
+    match = re.fullmatch(r'(\d+)/(\d*)([smhd])', rate)
+    if not match:
+        raise ValueError(f'Invalid rate "{rate}"')
+    limit, multiplier, unit = match.groups()
+    return int(limit), int(multiplier or 1) * PERIODS[unit]
+
+
+def user_or_ip(request) -> str:
+    if request.user.is_authenticated:
+        return f'user:{request.user.pk}'
+    return ip(request)
+
+
+def ip(request) -> str:
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
+
+
+def get_cache():
+    return caches[getattr(settings, 'RATELIMIT_CACHE', 'default')]
+
+
+def window_key(scope, ident, window) -> str:
+    return f'{KEY_PREFIX}{scope}:{ident}:{int(window)}'
+
+
+def hit(scope, ident, rate, now=None) -> bool:
+    """Count one hit and tell whether it fits the rate.
+
+    Sliding window counter: the hits of the previous fixed window are weighted
+    by how much of it still overlaps the sliding window. Two cache keys per
+    client, no matter how many hits.
+    """
+    limit, period = parse_rate(rate)
+    cache = get_cache()
+    now = time.time() if now is None else now
+    window, elapsed = divmod(now, period)
+    key = window_key(scope, ident, window)
+    # expires after the next window, which still reads it as the previous one
+    cache.add(key, 0, period * 2)
+    try:
+        current = cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(key, 1, period * 2)
+        current = 1
+    previous = cache.get(window_key(scope, ident, window - 1), 0)
+    if previous * (1 - elapsed / period) + current <= limit:
+        return True
+    # refused hits do not count, otherwise a client retrying would never get through
+    cache.decr(key)
+    return False
+
+
+def unhit(scope, ident, rate, now):
+    """Take back a hit counted at now."""
+    _, period = parse_rate(rate)
+    try:
+        get_cache().decr(window_key(scope, ident, now // period))
+    except ValueError:
+        # the window expired meanwhile
+        pass
+
+
+def refund(request):
+    """Take back the hits of a request whose action did not happen, like an invalid form.
+
+    Hits are counted before the view runs so that concurrent requests cannot
+    all slip under the limit, only what succeeds stays counted.
+    """
+    for args in getattr(request, 'ratelimit_hits', ()):
+        unhit(*args)
+    request.ratelimit_hits = []
+
+
+def ratelimit(scope, rate, key=user_or_ip, methods=('POST', ), block=True):
+    """View decorator, limits requests of every client to rate.
+
+    With block=False the view runs anyway and checks request.limited itself.
+    Views call refund(request) when the limited action fails.
+    """
+    parse_rate(rate)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            request.limited = getattr(request, 'limited', False)
+            request.ratelimit_hits = getattr(request, 'ratelimit_hits', [])
+            if request.method in methods:
+                ident, now = key(request), time.time()
+                if hit(scope, ident, rate, now):
+                    request.ratelimit_hits.append((scope, ident, rate, now))
+                elif block:
+                    return HttpResponse('Too many requests, please try again later.', status=429)
+                else:
+                    request.limited = True
+            return view(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,161 @@
+import heapq
+import math
+from collections import Counter, defaultdict
+from django.db import transaction
+from django.db.models import Max
+from . models import Book, BookInstance, BookRecommendation, BookReview, Loan, RecommendationBuild
+from . import versions
+
+# "Readers who borrowed this also borrowed": books are neighbours when the
+# same readers borrowed or reviewed both. The co-occurrence matrix is sparse
+# and only lives in memory while build_recommendations runs; the top
+# neighbours of every book are stored in BookRecommendation.
+#
+# score = co-readers / sqrt(readers of the book * readers of the neighbour),
+# the cosine similarity of the two books' reader sets.
+
+TOP_K = 10
+# readers with more books than this (staff, test accounts) add no pairs,
+# they would cost len(basket)**2 and say little about any one book
+MAX_BASKET = 500
+BORROW_EVENTS = ('reserve', 'take')
+CHUNK_SIZE = 500
+
+
+def chunks(ids):
+    ids = sorted(ids)
+    for start in range(0, len(ids), CHUNK_SIZE):
+        yield ids[start:start + CHUNK_SIZE]
+
+
+def source_querysets() -> list:
+    return [
+        # loans keep ids of deleted books, which cannot be recommended
+        Loan.objects.filter(event__in=BORROW_EVENTS, reader__isnull=False, book_id__in=Book.objects.values('id')),
+        # current loans from before the loan history existed
+        BookInstance.objects.filter(reader__isnull=False),
+        BookReview.objects.filter(reader__isnull=False),
+    ]
+
+
+def pairs(readers=None, books=None):
+    """(reader id, book id) of every borrowed or reviewed book, filtered by readers or books."""
+    for queryset in source_querysets():
+        if readers is not None:
+            querysets = (queryset.filter(reader_id__in=chunk) for chunk in chunks(readers))
+        elif books is not None:
+            querysets = (queryset.filter(book_id__in=chunk) for chunk in chunks(books))
+        else:
+            querysets = (queryset, )
+        for filtered in querysets:
+            yield from filtered.values_list('reader_id', 'book_id').iterator(chunk_size=5000)
+
+
+def baskets(reader_book_pairs) -> dict:
+    """reader id: set of book ids"""
+    books = defaultdict(set)
+    for reader_id, book_id in reader_book_pairs:
+        books[reader_id].add(book_id)
+    return books
+
+
+def popularity(reader_baskets) -> Counter:
+    """book id: readers"""
+    return Counter(book_id for basket in reader_baskets.values() for book_id in basket)
+
+
+def cooccurrence(reader_baskets, rows=None):
+    """(book id, Counter of the books read together with it) for the rows asked for or all books.
+
+    Rows are counted one at a time and can be dropped once used, so the whole
+    matrix is never in memory.
+    """
+    book_baskets = defaultdict(list)
+    for basket in reader_baskets.values():
+        if len(basket) < 2 or len(basket) > MAX_BASKET:
+            continue
+        for book_id in (basket if rows is None else basket & rows):
+            book_baskets[book_id].append(basket)
+    for book_id, baskets_of_book in book_baskets.items():
+        row = Counter()
+        for basket in baskets_of_book:
+            row.update(basket)
+        del row[book_id]
+        yield book_id, row
+
+
+def neighbours(rows, readers, k=TOP_K) -> dict:
+    """book id: [(neighbour id, score)] best first."""
+    inverse_sqrt = {book_id: 1 / math.sqrt(count) for book_id, count in readers.items()}
+    top = {}
+    for book_id, row in rows:
+        # the book's own reader count scales the whole row, rank without it, ties by lower id
+        best = heapq.nlargest(k, row.items(), key=lambda item: (item[1] * inverse_sqrt[item[0]], -item[0]))
+        top[book_id] = [(other, count * inverse_sqrt[other] * inverse_sqrt[book_id]) for other, count in best]
+    return top
+
+
+def save(top, books=None):
+    """Replace the stored neighbours of the given books, of all books when None."""
+    with transaction.atomic():
+        if books is None:
+            BookRecommendation.objects.all().delete()
+        for chunk in chunks(books or ()):
+            BookRecommendation.objects.filter(book_id__in=chunk).delete()
+        BookRecommendation.objects.bulk_create([
+            BookRecommendation(book_id=book_id, recommended_id=other, rank=rank, score=score)
+            for book_id, row in top.items() for rank, (other, score) in enumerate(row)
+        ], batch_size=2000)
+    versions.bump('recommendations')
+
+
+def watermark() -> dict:
+    return {
+        'last_loan_id': Loan.objects.aggregate(last=Max('id'))['last'] or 0,
+        'last_review_id': BookReview.objects.aggregate(last=Max('id'))['last'] or 0,
+    }
+
+
+def build(k=TOP_K) -> RecommendationBuild:
+    """Compute the neighbours of every book from scratch."""
+    marks = watermark()
+    reader_baskets = baskets(pairs())
+    top = neighbours(cooccurrence(reader_baskets), popularity(reader_baskets), k)
+    save(top)
+    return RecommendationBuild.objects.create(full=True, books=len(top), **marks)
+
+
+def update(k=TOP_K) -> RecommendationBuild:
+    """Recompute only the books whose neighbours can have changed since the last build.
+
+    A new loan of book b by reader r adds co-readers to b and to every book of
+    r, and changes the reader count of b, which moves b in the rows of the
+    books read together with it.
+    """
+    last = RecommendationBuild.objects.first()
+    if last is None:
+        return build(k)
+    marks = watermark()
+    new_pairs = set(Loan.objects.filter(
+        event__in=BORROW_EVENTS, reader__isnull=False, id__gt=last.last_loan_id, id__lte=marks['last_loan_id'],
+    ).values_list('reader_id', 'book_id'))
+    new_pairs |= set(BookReview.objects.filter(
+        reader__isnull=False, id__gt=last.last_review_id, id__lte=marks['last_review_id'],
+    ).values_list('reader_id', 'book_id'))
+    if not new_pairs:
+        return RecommendationBuild.objects.create(**marks)
+    new_books = {book_id for _, book_id in new_pairs}
+    co_readers = {reader_id for reader_id, _ in pairs(books=new_books)}
+    rows = {book_id for _, book_id in pairs(readers=co_readers)}
+    # every reader of a recomputed row, so its counts are complete
+    reader_baskets = baskets(pairs(readers={reader_id for reader_id, _ in pairs(books=rows)}))
+    counts = dict(cooccurrence(reader_baskets, rows))
+    read_with = set(counts).union(*counts.values())
+    top = neighbours(counts.items(), popularity(baskets(pairs(books=read_with))), k)
+    save(top, rows)
+    return RecommendationBuild.objects.create(books=len(rows), **marks)
+
+
+def for_book(book_id):
+    """Stored neighbours of a book, one query on the (book, rank) index."""
+    return BookRecommendation.objects.filter(book_id=book_id).order_by('rank').select_related('recommended__author')
@@ -0,0 +1,93 @@
+from django.db import connection, transaction
+from django.db.models import F
+from . models import Book, BookInstance, Loan
+from . import counters, versions
+
+# copies tried per round on backends without SKIP LOCKED
+CANDIDATES = 10
+ROUNDS = 5
+
+
+class ReservationError(Exception):
+    pass
+
+
+def claim(queryset, **changes) -> bool:
+    """Apply changes only if the row still matches queryset, in one UPDATE."""
+    return queryset.update(version=F('version') + 1, **changes) == 1
+
+
+def claim_copy(queryset, book, loan=None, **changes) -> bool:
+    """Claim an available copy, take it off the available count of the book and log the loan together."""
+    with transaction.atomic():
+        if not claim(queryset, **changes):
+            return False
+        Book.objects.filter(pk=book.pk).adjust_copies(available=-1)
+        if loan is not None:
+            loan.save()
+        return True
+
+
+def reserve(book, reader, due_back) -> BookInstance:
+    """Reserve an available copy of the book, no copy is ever given to two readers."""
+    changes = {'status': 'r', 'reader': reader, 'due_back': due_back}
+
+    def loan(copy_id):
+        return Loan(event='reserve', copy_id=copy_id, book_id=book.pk, reader=reader, due_back=due_back)
+
+    available = BookInstance.objects.filter(book=book, status='a').order_by('id')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            copy_id = available.select_for_update(skip_locked=True).values_list('id', flat=True).first()
+            if copy_id is None or not claim_copy(BookInstance.objects.filter(pk=copy_id), book, loan(copy_id), **changes):
+                raise ReservationError('No copies of this book are available.')
+    else:
+        # without row locks every candidate is claimed with a conditional UPDATE,
+        # a lost race just moves on to the next candidate
+        copy_id = None
+        for _ in range(ROUNDS):
+            candidates = list(available.values_list('id', flat=True)[:CANDIDATES])
+            if not candidates:
+                raise ReservationError('No copies of this book are available.')
+            copy_id = next((pk for pk in candidates if claim_copy(available.filter(pk=pk), book, loan(pk), **changes)), None)
+            if copy_id:
+                break
+        else:
+            raise ReservationError('The library is busy, please try again.')
+    counters.invalidate_for(BookInstance)
+    versions.bump(versions.table(BookInstance))
+    return BookInstance.objects.select_related('book').get(pk=copy_id)
+
+
+def transition(copy, reader, from_statuses, changes, event, version=None):
+    """Move a copy of the reader to a new state unless someone changed it meanwhile, logging the event."""
+    version = copy.version if version is None else version
+    current = BookInstance.objects.filter(pk=copy.pk, reader=reader, status__in=from_statuses, version=version)
+    with transaction.atomic():
+        if not claim(current, **changes):
+            raise ReservationError('This book was changed meanwhile, please try again.')
+        if changes.get('status') == 'a':
+            Book.objects.filter(pk=copy.book_id).adjust_copies(available=1)
+        Loan.objects.create(event=event, copy_id=copy.pk, book_id=copy.book_id, reader=reader,
+            due_back=changes.get('due_back', copy.due_back))
+    for field, value in changes.items():
+        setattr(copy, field, value)
+    copy.version = version + 1
+    copy._counted = (copy.book_id, int(copy.status == 'a'))
+    counters.invalidate_for(BookInstance)
+    versions.bump(versions.table(BookInstance))
+    return copy
+
+
+def take(copy, reader, due_back, version=None):
+    return transition(copy, reader, ('r', ), {'status': 't', 'due_back': due_back, 'reminder_sent_at': None}, 'take', version)
+
+
+def extend(copy, reader, due_back, version=None):
+    return transition(copy, reader, ('t', ), {'due_back': due_back, 'reminder_sent_at': None}, 'extend', version)
+
+
+def release(copy, reader, version=None):
+    """Return a taken copy or cancel a reservation, the copy becomes available again."""
+    event = 'return' if copy.status == 't' else 'cancel'
+    return transition(copy, reader, ('r', 't'), {'status': 'a', 'reader': None, 'due_back': None, 'reminder_sent_at': None}, event, version)
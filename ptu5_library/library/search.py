@@ -0,0 +1,124 @@
+import html
+import re
+from django.db import connection
+from django.db.models import F, FloatField, Func, Q, Value
+from django.db.models.lookups import Lookup
+from django.utils.html import strip_tags
+from . models import BookSearchDocument
+
+# Full text index kept next to library_book: an FTS5 virtual table on SQLite,
+# a tsvector table with a GIN index on PostgreSQL. Rows are keyed by book id.
+FTS_TABLE = BookSearchDocument._meta.db_table
+SUPPORTED_VENDORS = ('sqlite', 'postgresql')
+TOKEN_RE = re.compile(r'\w+')
+
+
+def is_supported(db_connection=connection) -> bool:
+    return db_connection.vendor in SUPPORTED_VENDORS
+
+
+def plain_text(value) -> str:
+    return html.unescape(strip_tags(value or ''))
+
+
+def tokenize(search) -> list:
+    return TOKEN_RE.findall(search or '')
+
+
+def build_query(tokens, vendor) -> str:
+    # every token is matched as a prefix so the search box works while typing
+    if vendor == 'postgresql':
+        return ' & '.join(f"{token}:*" for token in tokens)
+    return ' '.join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+
+
+def create_index(schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(document, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            f"CREATE TABLE {FTS_TABLE} ("
+            "rowid bigint PRIMARY KEY REFERENCES library_book (id) ON DELETE CASCADE, "
+            "document tsvector NOT NULL)"
+        )
+        schema_editor.execute(f"CREATE INDEX {FTS_TABLE}_document ON {FTS_TABLE} USING GIN (document)")
+
+
+def drop_index(schema_editor):
+    if is_supported(schema_editor.connection):
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+def index_rows(rows, db_connection=connection):
+    """Write (book id, title, summary) rows to the full text index."""
+    if not is_supported(db_connection):
+        return
+    rows = [(book_id, title, plain_text(summary)) for book_id, title, summary in rows]
+    if not rows:
+        return
+    with db_connection.cursor() as cursor:
+        if db_connection.vendor == 'postgresql':
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, "
+                "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+                "ON CONFLICT (rowid) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+        else:
+            cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(row[0], ) for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE} (rowid, document) VALUES (%s, %s || ' ' || %s)",
+                rows,
+            )
+
+
+def index_books(books, db_connection=connection):
+    index_rows(((book.id, book.title, book.summary) for book in books), db_connection)
+
+
+def remove_books(book_ids, db_connection=connection):
+    if not is_supported(db_connection) or not book_ids:
+        return
+    with db_connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {FTS_TABLE} WHERE rowid = %s", [(book_id, ) for book_id in book_ids])
+
+
+@BookSearchDocument._meta.get_field('document').register_lookup
+class Match(Lookup):
+    lookup_name = 'match'
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        if connection.vendor == 'postgresql':
+            return f"{lhs} @@ to_tsquery('simple', {rhs})", (*lhs_params, *rhs_params)
+        return f"{lhs} MATCH {rhs}", (*lhs_params, *rhs_params)
+
+
+def search_rank(query, vendor):
+    """Relevance of the joined search document, higher is better."""
+    if vendor == 'postgresql':
+        return Func(
+            F('search_document__document'),
+            Func(Value('simple'), Value(query), function='to_tsquery'),
+            function='ts_rank',
+            output_field=FloatField(),
+        )
+    # fts5 rank is bm25, where more negative means more relevant
+    return -F('search_document__rank')
+
+
+def search_books(queryset, search):
+    """Filter a Book queryset by the search text, most relevant books first."""
+    if not is_supported():
+        return queryset.filter(Q(title__icontains=search) | Q(summary__icontains=search))
+    tokens = tokenize(search)
+    if not tokens:
+        return queryset.none()
+    query = build_query(tokens, connection.vendor)
+    return queryset.filter(search_document__document__match=query) \
+        .annotate(search_rank=search_rank(query, connection.vendor)) \
+        .order_by('-search_rank', 'id')
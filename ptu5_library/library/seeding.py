@@ -0,0 +1,106 @@
+import random
+from datetime import date, timedelta
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from user_profile.models import Profile
+from . models import Author, Book, BookInstance, BookReview, Genre
+from . import autocomplete, counters, facets, search, versions
+
+# Synthetic catalogs for benchmarks and load tests. Everything is written with
+# bulk_create, so the denormalized fields, the search index, the counters and
+# the version stamps are filled in here instead of by signals.
+
+SYLLABLES = 'ka ra lo mi tu se na vi do re gal tor men sil var'.split()
+GENRES = ('Fantasy', 'Horror', 'Science fiction', 'Romance', 'Crime', 'Poetry', 'History', 'Travel', 'Humor', 'Drama')
+# seeded readers can log in with this password
+PASSWORD = 'library'
+
+User = get_user_model()
+BookGenre = Book.genre.through
+
+
+def vocabulary(rng, size=5000) -> list:
+    words = {''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)}
+    return sorted(words)
+
+
+def random_text(rng, words, length) -> str:
+    # words early in the vocabulary are common, the tail is rare
+    return ' '.join(words[min(int(rng.paretovariate(1.2)) - 1, len(words) - 1)] for _ in range(length))
+
+
+def random_summary(rng, words, length=80) -> str:
+    return ''.join(f'<p><strong>{random_text(rng, words, 3)}</strong> {random_text(rng, words, length // 4)}</p>' for _ in range(4))
+
+
+def random_status(rng) -> str:
+    return rng.choices(('a', 't', 'r', 'm'), weights=(6, 2, 1, 1))[0]
+
+
+def seed(books=1000, copies_per_book=3, reviews=2000, users=100, seed=42, batch_size=1000) -> dict:
+    """Add a synthetic catalog on top of what the database already holds."""
+    rng = random.Random(seed)
+    words = vocabulary(rng)
+    today = date.today()
+    offset = Book.objects.count()
+    user_offset = User.objects.count()
+    password = make_password(PASSWORD)
+
+    readers = User.objects.bulk_create(
+        [User(username=f'reader_{user_offset + number}', email=f'reader_{user_offset + number}@example.com', password=password)
+            for number in range(users)],
+        batch_size=batch_size,
+    )
+    Profile.objects.bulk_create([Profile(user=reader) for reader in readers], batch_size=batch_size)
+    genres = list(Genre.objects.filter(name__in=GENRES))
+    existing = {genre.name for genre in genres}
+    genres += Genre.objects.bulk_create([Genre(name=name) for name in GENRES if name not in existing])
+    authors = Author.objects.bulk_create(
+        [Author(first_name=random_text(rng, words, 1).title(), last_name=random_text(rng, words, 1).title())
+            for _ in range(books // 10 + 1)],
+        batch_size=batch_size,
+    )
+
+    statuses = [[random_status(rng) for _ in range(copies_per_book)] for _ in range(books)]
+    review_books = [rng.randrange(books) for _ in range(reviews)] if books and users else []
+    review_counts = [0] * books
+    for number in review_books:
+        review_counts[number] += 1
+    new_books = Book.objects.bulk_create(
+        [Book(
+            title=random_text(rng, words, 3).title(),
+            summary=random_summary(rng, words),
+            isbn=f'979{offset + number:010}',
+            author=rng.choice(authors),
+            review_count=review_counts[number],
+            total_copies=copies_per_book,
+            available_copies=statuses[number].count('a'),
+        ) for number in range(books)],
+        batch_size=batch_size,
+    )
+    BookGenre.objects.bulk_create(
+        [BookGenre(book_id=book.id, genre_id=genre.id) for book in new_books for genre in rng.sample(genres, rng.randint(1, 3))],
+        batch_size=batch_size,
+    )
+    copies = []
+    for book, book_statuses in zip(new_books, statuses):
+        for status in book_statuses:
+            loaned = status in ('t', 'r') and readers
+            copies.append(BookInstance(
+                book=book,
+                status=status,
+                reader=rng.choice(readers) if loaned else None,
+                due_back=today + timedelta(days=rng.randint(-20, 30)) if loaned else None,
+            ))
+    BookInstance.objects.bulk_create(copies, batch_size=batch_size)
+    BookReview.objects.bulk_create(
+        [BookReview(book=new_books[number], reader=rng.choice(readers), content=random_text(rng, words, 30))
+            for number in review_books],
+        batch_size=batch_size,
+    )
+    search.index_rows((book.id, book.title, book.summary) for book in new_books)
+    counters.invalidate()
+    facets.invalidate()
+    versions.bump('authors', 'genres', autocomplete.VERSION, *(versions.table(model) for model in (Author, Book, BookInstance, Genre)))
+    return {'users': len(readers), 'authors': len(authors), 'books': len(new_books), 'copies': len(copies),
+        'reviews': len(review_books)}
@@ -0,0 +1,162 @@
+from django.core.signals import request_finished
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_save
+from django.dispatch import receiver
+from . models import Author, Book, BookInstance, BookReview, Genre
+from . import autocomplete, counters, facets, images, search, versions, visits
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    search.index_books([instance])
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    search.remove_books([instance.pk])
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_counters(sender, **kwargs):
+    counters.invalidate_for(sender)
+
+
+@receiver(post_save, sender=Book)
+def autocomplete_book(sender, instance, **kwargs):
+    autocomplete.changed('b', instance.pk, autocomplete.book_entries(instance.pk, instance.title))
+
+
+@receiver(post_save, sender=Author)
+def autocomplete_author(sender, instance, **kwargs):
+    autocomplete.changed('a', instance.pk, autocomplete.author_entries(instance.pk, instance.first_name, instance.last_name))
+
+
+@receiver(post_delete, sender=Book)
+@receiver(post_delete, sender=Author)
+def unautocomplete(sender, instance, **kwargs):
+    autocomplete.changed('b' if sender is Book else 'a', instance.pk, [])
+
+
+@receiver(pre_save, sender=Book)
+def check_cover(sender, instance, **kwargs):
+    instance._cover_changed = images.has_new_file(instance, 'cover')
+    if instance._cover_changed or not instance.cover:
+        instance.cover_hash = ''
+
+
+@receiver(post_save, sender=Book)
+def queue_cover(sender, instance, **kwargs):
+    if instance._cover_changed:
+        images.enqueue(instance, 'cover')
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+def bump_book_version(sender, instance, **kwargs):
+    versions.bump(f'book:{instance.pk}')
+
+
+@receiver(post_save, sender=BookReview)
+@receiver(post_delete, sender=BookReview)
+def bump_reviews_version(sender, instance, **kwargs):
+    versions.bump(f'reviews:{instance.book_id}')
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+def bump_authors_version(sender, **kwargs):
+    versions.bump('authors')
+
+
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def bump_genres_version(sender, **kwargs):
+    versions.bump('genres')
+
+
+@receiver(post_save, sender=Book)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=BookInstance)
+@receiver(post_delete, sender=BookInstance)
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def bump_table_version(sender, **kwargs):
+    versions.bump(versions.table(sender))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+def bump_book_genres_version(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # the books losing this genre are gone from the table by post_clear
+        instance._cleared_book_ids = list(instance.book_set.values_list('id', flat=True))
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        book_ids = [instance.pk]
+    elif action == 'post_clear':
+        book_ids = instance.__dict__.pop('_cleared_book_ids', [])
+    else:
+        book_ids = pk_set or ()
+    versions.bump(versions.table(Book), *(f'book:{book_id}' for book_id in book_ids))
+
+
+@receiver(m2m_changed, sender=Book.genre.through)
+@receiver(post_delete, sender=Book)
+@receiver(post_save, sender=Genre)
+@receiver(post_delete, sender=Genre)
+def invalidate_facets(sender, **kwargs):
+    # deleting a book or genre removes its genre links without m2m_changed
+    facets.invalidate()
+
+
+@receiver(post_save, sender=BookInstance)
+def count_copy(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    counted = None if created else getattr(instance, '_counted', None)
+    if not created and counted is None:
+        # saved without being loaded first, reconcile_availability catches up
+        return
+    current = (instance.book_id, int(instance.status == 'a'))
+    if counted == current:
+        return
+    if counted and counted[0] == current[0]:
+        Book.objects.filter(pk=current[0]).adjust_copies(available=current[1] - counted[1])
+    else:
+        if counted:
+            Book.objects.filter(pk=counted[0]).adjust_copies(total=-1, available=-counted[1])
+        Book.objects.filter(pk=current[0]).adjust_copies(total=1, available=current[1])
+    instance._counted = current
+
+
+@receiver(post_delete, sender=BookInstance)
+def uncount_copy(sender, instance, **kwargs):
+    book_id, available = getattr(instance, '_counted', (instance.book_id, int(instance.status == 'a')))
+    Book.objects.filter(pk=book_id).adjust_copies(total=-1, available=-available)
+
+
+@receiver(post_save, sender=BookReview)
+def count_review(sender, instance, created, **kwargs):
+    if created:
+        Book.objects.filter(pk=instance.book_id).update(review_count=F('review_count') + 1)
+        versions.bump(versions.table(Book))
+
+
+@receiver(post_delete, sender=BookReview)
+def uncount_review(sender, instance, **kwargs):
+    Book.objects.filter(pk=instance.book_id).update(review_count=F('review_count') - 1)
+    versions.bump(versions.table(Book))
+
+
+@receiver(request_finished)
+def flush_visits(sender, **kwargs):
+    visits.flush_if_due()
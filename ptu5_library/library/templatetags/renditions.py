@@ -0,0 +1,22 @@
+from django import template
+from django.utils.html import format_html
+from library import images
+
+register = template.Library()
+
+
+@register.simple_tag
+def picture(instance, field_name, rendition, css_class=''):
+    """<picture> of a processed image rendition, the original image until it is processed."""
+    field_file = getattr(instance, field_name, None)
+    if not field_file:
+        return ''
+    content_hash = getattr(instance, images.hash_field(field_name))
+    if not content_hash:
+        return format_html('<img src="{}" class="{}">', field_file.url, css_class)
+    return format_html(
+        '<picture><source srcset="{}" type="image/webp"><img src="{}" class="{}"></picture>',
+        images.rendition_url(content_hash, rendition, 'webp'),
+        images.rendition_url(content_hash, rendition, 'jpg'),
+        css_class,
+    )
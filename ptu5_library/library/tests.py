@@ -1,3 +1,1477 @@
-from django.test import TestCase
+import asyncio
+from datetime import date, datetime, timedelta
+from asgiref.sync import async_to_sync, sync_to_async
+import json
+from io import BytesIO, StringIO
+from pathlib import Path
+import tempfile
+from unittest import mock
+from wsgiref.util import FileWrapper
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core import mail
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.signals import request_finished, request_started
+from django.core.management import call_command
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection
+from django.http import QueryDict
+from django.template import Context, Template
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import get_script_prefix, reverse, set_script_prefix
+from django.utils import timezone
+from django.views.generic.detail import SingleObjectMixin
+from PIL import Image
+from . import assets, async_views, autocomplete, counters, facets, images, instrumentation, loans, ratelimit, recommendations, reservations, seeding, versions, views, visits
+from . models import Author, Book, BookInstance, BookRecommendation, BookReview, Genre, ImageJob, Loan, VisitStat
+from . paginators import CursorPaginator, InvalidCursor, encode_cursor
+from . search import search_books
+from . views import BookListView, UserBookListView
+from . management.commands.bench_asgi import site_urlconf
+from . management.commands.bench_urls import pages
 
-# Create your tests here.
+User = get_user_model()
+
+
+def create_catalog(book_count, genres=('Fantasy', 'Horror')):
+    genres = [Genre.objects.create(name=name) for name in genres]
+    books = []
+    for number in range(book_count):
+        author = Author.objects.create(first_name='Author', last_name=f'No{number}')
+        book = Book.objects.create(title=f'Book {number:05}', summary='<p>Summary</p>', author=author)
+        book.genre.set(genres)
+        books.append(book)
+    return books
+
+
+class CatalogQueryCountTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = create_catalog(12)
+
+    def setUp(self):
+        cache.clear()
+
+    def count_queries(self, url, page_size):
+        with mock.patch.object(BookListView, 'paginate_by', page_size):
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_book_list_query_count_does_not_depend_on_page_size(self):
+        url = reverse('books')
+        self.count_queries(url, 1)
+        self.assertEqual(self.count_queries(url, 1), self.count_queries(url, 10))
+
+    def test_author_page_query_count_does_not_depend_on_book_count(self):
+        author = self.books[0].author
+        with self.assertNumQueries(2):
+            self.client.get(reverse('author', args=[author.id]))
+        for number in range(5):
+            book = Book.objects.create(title=f'Extra {number}', summary='', author=author)
+            book.genre.set(Genre.objects.all())
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('author', args=[author.id]))
+        self.assertContains(response, 'Extra 4')
+
+    def test_genre_links_follow_the_script_prefix(self):
+        genre = Genre.objects.first()
+        prefix = get_script_prefix()
+        self.addCleanup(set_script_prefix, prefix)
+        self.assertIn(f'href="{prefix}books/?genre_id={genre.id}"', genre.link_filtered_books())
+        set_script_prefix('/library/')
+        self.assertIn(f'href="/library/books/?genre_id={genre.id}"', genre.link_filtered_books())
+
+    def test_book_detail_uses_catalog_queryset(self):
+        book = self.books[0]
+        response = self.client.get(reverse('book', args=[book.id]))
+        self.assertTrue(response.context['book']._state.fields_cache.get('author'))
+
+
+class BookSearchTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.dune = Book.objects.create(title='Dune', summary='<p>Desert planet <b>Arrakis</b></p>')
+        cls.arrakis = Book.objects.create(title='Arrakis Arrakis', summary='<p>Arrakis again &amp; again</p>')
+        cls.other = Book.objects.create(title='Emma', summary='<p>Strong&nbsp;women</p>')
+
+    def search(self, text):
+        return list(search_books(Book.objects.all(), text))
+
+    def test_ranks_matches_by_relevance(self):
+        self.assertEqual(self.search('arrakis'), [self.arrakis, self.dune])
+
+    def test_matches_prefixes_and_ignores_markup(self):
+        self.assertEqual(self.search('dese'), [self.dune])
+        self.assertEqual(self.search('strong women'), [self.other])
+        self.assertEqual(self.search('nbsp'), [])
+        self.assertEqual(self.search('"*'), [])
+
+    def test_index_follows_book_changes(self):
+        self.other.title = 'Persuasion'
+        self.other.save()
+        self.assertEqual(self.search('persuasion'), [self.other])
+        self.other.delete()
+        self.assertEqual(self.search('strong'), [])
+
+    def test_book_list_uses_search_parameter(self):
+        response = self.client.get(reverse('books'), {'search': 'desert'})
+        self.assertEqual(list(response.context['book_list']), [self.dune])
+
+
+class DashboardCountersTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_catalog(2)
+
+    def test_warm_counters_do_not_query_the_database(self):
+        expected = counters.get_counters()
+        with self.assertNumQueries(0):
+            self.assertEqual(counters.get_counters(), expected)
+
+    def test_saves_and_deletes_invalidate_counters(self):
+        book = Book.objects.first()
+        self.assertEqual(counters.get_counters()['book_instance_available_count'], 0)
+        copy = BookInstance.objects.create(book=book, status='a')
+        self.assertEqual(counters.get_counters()['book_instance_available_count'], 1)
+        copy.status = 't'
+        copy.save()
+        self.assertEqual(counters.get_counters()['book_instance_available_count'], 0)
+        book.delete()
+        self.assertEqual(counters.get_counters()['book_count'], 1)
+        self.assertEqual(counters.get_counters()['book_instance_count'], 0)
+
+    def test_counts_cached_before_the_commit_are_dropped_after_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Author.objects.create(first_name='New', last_name='Author')
+            # what another connection would still count before the commit
+            cache.set(counters.KEY_PREFIX + 'author_count', 2)
+        self.assertEqual(counters.get_counters()['author_count'], 3)
+
+    def test_rebuild_command_recounts_everything(self):
+        counters.get_counters()
+        Author.objects.filter(pk=Author.objects.first().pk).delete()
+        cache.set(counters.KEY_PREFIX + 'author_count', 100)
+        call_command('rebuild_counters', stdout=StringIO())
+        self.assertEqual(counters.get_counters()['author_count'], 1)
+
+    def test_index_uses_cached_counters(self):
+        self.client.get(reverse('index'))
+        with mock.patch.dict(counters.COUNTERS, {name: None for name in counters.COUNTERS}):
+            response = self.client.get(reverse('index'))
+        self.assertEqual(response.context['book_count'], 2)
+        self.assertEqual(response.context['genre_count'], 2)
+
+
+class CursorPaginatorTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for last_name in ('Adams', 'Brown', 'Brown', 'Brown', 'Clark', 'Davis', 'Evans'):
+            Author.objects.create(first_name='Ann', last_name=last_name)
+
+    def walk(self, paginator):
+        pages, page = [], paginator.page()
+        pages.append(list(page))
+        while page.has_next():
+            page = paginator.page(page.next_cursor)
+            pages.append(list(page))
+        backwards = [list(page)]
+        while page.has_previous():
+            page = paginator.page(page.previous_cursor)
+            backwards.insert(0, list(page))
+        self.assertEqual(backwards, pages)
+        return pages
+
+    def test_walks_every_row_once_in_both_directions(self):
+        ordering = ('last_name', 'first_name', 'id')
+        expected = list(Author.objects.order_by(*ordering))
+        for per_page in (1, 2, 3, 7, 10):
+            pages = self.walk(CursorPaginator(Author.objects.all(), per_page, ordering))
+            self.assertEqual(sum(pages, []), expected)
+
+    def test_descending_ordering(self):
+        ordering = ('-last_name', 'id')
+        pages = self.walk(CursorPaginator(Author.objects.all(), 2, ordering))
+        self.assertEqual(sum(pages, []), list(Author.objects.order_by(*ordering)))
+
+    def test_broken_cursor(self):
+        paginator = CursorPaginator(Author.objects.all(), 2, ('last_name', 'id'))
+        with self.assertRaises(InvalidCursor):
+            paginator.page('not-a-cursor')
+        self.assertEqual(list(paginator.get_page('not-a-cursor')), list(paginator.page()))
+        self.assertEqual(self.client.get(reverse('books'), {'cursor': 'broken'}).status_code, 404)
+
+    def test_forged_cursor_values(self):
+        paginator = CursorPaginator(Author.objects.all(), 2, ('last_name', 'id'))
+        for values in (['Brown', 'x'], ['Brown', None], ['Brown', [1]], [{'a': 1}, 1], ['Brown', 2 ** 80], ['Brown', float('nan')]):
+            with self.subTest(values=values), self.assertRaises(InvalidCursor):
+                paginator.page(encode_cursor(values, 'n'))
+        # values of the right type in the wrong form are converted
+        self.assertEqual(list(paginator.page(encode_cursor(['Brown', '3'], 'n'))), list(paginator.page(encode_cursor(['Brown', 3], 'n'))))
+        create_catalog(2)
+        for params in ({}, {'sort': 'availability'}, {'search': 'book'}):
+            for values in (['x', 'y'], [None, 1], ['x', 'y', 'z'][:len(views.book_ordering(params))]):
+                with self.subTest(params=params, values=values):
+                    response = self.client.get(reverse('books'), {**params, 'cursor': encode_cursor(values, 'n')})
+                    self.assertEqual(response.status_code, 404)
+        user = User.objects.create_user('reader', password='secret')
+        self.client.force_login(user)
+        response = self.client.get(reverse('user_books'), {'cursor': encode_cursor(['not a date', 1], 'n')})
+        self.assertEqual(response.status_code, 404)
+
+    def test_authors_view_pages_with_cursor(self):
+        response = self.client.get(reverse('authors'))
+        self.assertEqual(len(response.context['authors']), 5)
+        response = self.client.get(reverse('authors') + '?' + response.context['next_page_query'])
+        self.assertEqual([author.last_name for author in response.context['authors']], ['Davis', 'Evans'])
+
+    def test_book_list_counts_once_and_keeps_filters_in_links(self):
+        create_catalog(4)
+        self.client.get(reverse('books'))
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('books'))
+        self.assertFalse([query for query in context.captured_queries if 'COUNT(' in query['sql']])
+        self.assertEqual(response.context['books_count'], 4)
+        response = self.client.get(reverse('books'), {'search': 'book'})
+        self.assertEqual(response.context['books_count'], 4)
+        self.assertIn('search=book', response.context['next_page_query'])
+
+    def test_user_books_put_copies_without_due_date_last(self):
+        user = User.objects.create_user('reader', password='secret')
+        book = create_catalog(1)[0]
+        copies = [
+            BookInstance.objects.create(book=book, reader=user, status='t', due_back=due_back)
+            for due_back in (None, date(2030, 1, 2), date(2030, 1, 1), None)
+        ]
+        self.client.force_login(user)
+        with mock.patch.object(UserBookListView, 'paginate_by', 1):
+            page, seen = self.client.get(reverse('user_books')).context, []
+            while True:
+                seen.extend(page['bookinstance_list'])
+                if 'next_page_query' not in page:
+                    break
+                page = self.client.get(reverse('user_books') + '?' + page['next_page_query']).context
+        self.assertEqual(seen, [copies[2], copies[1], copies[0], copies[3]])
+
+
+class ImportCatalogTest(TestCase):
+    def import_feed(self, name, content, *args):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = Path(directory.name) / name
+        path.write_text(content, encoding='utf-8')
+        stderr = StringIO()
+        call_command('import_catalog', str(path), '--chunk-size', '2', *args, stdout=StringIO(), stderr=stderr)
+        return stderr.getvalue()
+
+    def test_imports_csv_and_upserts_by_isbn(self):
+        Author.objects.create(first_name='Frank', last_name='Herbert')
+        self.import_feed('feed.csv', (
+            'isbn,title,summary,author_first_name,author_last_name,genres,copies\n'
+            '1,Dune,<p>Desert</p>,Frank,Herbert,Sci-fi|Classic,2\n'
+            '2,Emma,<p>Village</p>,Jane,Austen,Classic,\n'
+            '3,Persuasion,,Jane,Austen,,1\n'
+            ',No ISBN,,,,,\n'
+        ), '--copies', '3')
+        self.assertEqual(Author.objects.count(), 2)
+        self.assertEqual(Genre.objects.count(), 2)
+        dune = Book.objects.get(isbn='1')
+        self.assertEqual(dune.author.last_name, 'Herbert')
+        self.assertEqual(sorted(dune.genre.values_list('name', flat=True)), ['Classic', 'Sci-fi'])
+        self.assertEqual(BookInstance.objects.filter(book__isbn='2', status='a').count(), 3)
+        self.assertEqual(BookInstance.objects.count(), 6)
+        self.assertEqual(list(search_books(Book.objects.all(), 'village')), [Book.objects.get(isbn='2')])
+
+        self.assertContains(self.client.get(reverse('book', args=[dune.pk])), 'Classic')
+        self.import_feed('update.jsonl', '{"isbn": "1", "title": "Dune Messiah", "genres": ["Sci-fi"], "copies": 5}\n')
+        # the cached detail fragment goes stale with the import
+        response = self.client.get(reverse('book', args=[dune.pk]))
+        self.assertContains(response, 'Dune Messiah')
+        self.assertNotContains(response, 'Classic')
+        dune.refresh_from_db()
+        self.assertEqual(dune.title, 'Dune Messiah')
+        self.assertEqual(list(dune.genre.values_list('name', flat=True)), ['Sci-fi'])
+        self.assertEqual(Book.objects.count(), 3)
+        self.assertEqual(BookInstance.objects.filter(book=dune).count(), 2)
+
+    def test_invalid_rows_are_skipped_and_reported(self):
+        errors = self.import_feed('feed.jsonl', '\n'.join([
+            '{"isbn": "1", "title": "Dune", "copies": "2"}',
+            '{"isbn": 9780441013593, "title": "Number"}',
+            '{"isbn": "97804410135930", "title": "Too long"}',
+            '{"isbn": "3", "title": "Many", "copies": "lots"}',
+            '{"isbn": "4", "title": "Genres", "genres": "Sci-fi"}',
+            'not json',
+            '["isbn"]',
+            '{"isbn": "5", "title": "Emma", "copies": -1}',
+            '{"isbn": "6", "title": "Persuasion"}',
+        ]))
+        self.assertEqual(sorted(Book.objects.values_list('isbn', flat=True)), ['1', '6'])
+        self.assertEqual(BookInstance.objects.count(), 2)
+        self.assertIn('7 invalid rows were not imported', errors)
+        self.assertIn('row 2: isbn is not text', errors)
+        self.assertIn('row 3: isbn is longer than 13 characters', errors)
+        self.assertIn('row 4: copies is not a whole number', errors)
+        self.assertIn('row 6: not a JSON object', errors)
+
+
+class ImagePipelineTest(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+        self.user = User.objects.create_user('reader', password='secret')
+
+    def upload(self, color='red'):
+        output = BytesIO()
+        Image.new('RGB', (800, 600), color).save(output, 'PNG')
+        return SimpleUploadedFile('photo.png', output.getvalue(), content_type='image/png')
+
+    def test_new_uploads_are_queued_and_rendered_off_request(self):
+        profile = self.user.profile
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.photo = self.upload()
+            profile.save()
+        self.assertEqual(ImageJob.objects.filter(processed_at__isnull=True).count(), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            profile.save()
+        self.assertEqual(ImageJob.objects.count(), 1)
+
+        call_command('process_images', stdout=StringIO())
+        profile.refresh_from_db()
+        self.assertEqual(len(profile.photo_hash), 64)
+        for rendition, size in images.RENDITIONS.items():
+            with Image.open(default_storage.open(images.rendition_name(profile.photo_hash, rendition, 'webp'))) as image:
+                self.assertLessEqual(image.width, size[0])
+        self.assertEqual(Image.open(profile.photo.path).size, (800, 600))
+
+    def test_same_content_is_not_rendered_again(self):
+        book = Book.objects.create(title='Dune', summary='')
+        with self.captureOnCommitCallbacks(execute=True):
+            book.cover = self.upload()
+            book.save()
+        self.assertEqual(book.cover_hash, '')
+        call_command('process_images', stdout=StringIO())
+        book.refresh_from_db()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.profile.photo = self.upload()
+            self.user.profile.save()
+        with mock.patch.object(images.Image, 'open') as image_open:
+            call_command('process_images', stdout=StringIO())
+        image_open.assert_not_called()
+        self.user.profile.refresh_from_db()
+        self.assertEqual(self.user.profile.photo_hash, book.cover_hash)
+
+    def test_picture_tag_falls_back_to_original_image(self):
+        book = Book.objects.create(title='Dune', summary='', cover=self.upload())
+        template = Template("{% load renditions %}{% picture book 'cover' 'list' %}")
+        self.assertIn(book.cover.url, template.render(Context({'book': book})))
+        book.cover_hash = 'ab' * 32
+        self.assertIn('renditions/ab/', template.render(Context({'book': book})))
+
+
+class BookDetailCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.book = create_catalog(1)[0]
+        self.url = reverse('book', args=[self.book.pk])
+        for number in range(3):
+            reader = User.objects.create_user(f'reader{number}', password='secret')
+            BookReview.objects.create(book=self.book, reader=reader, content=f'Review {number}')
+
+    def test_cached_page_only_fetches_the_book(self):
+        # book, genres, recommendations and reviews
+        with self.assertNumQueries(4):
+            self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, 'Review 2')
+        self.assertContains(response, self.book.genre.first().name)
+
+    def test_saves_invalidate_fragments(self):
+        self.client.get(self.url)
+        self.book.title = 'Renamed book'
+        self.book.save()
+        self.assertContains(self.client.get(self.url), 'Renamed book')
+        BookReview.objects.create(book=self.book, reader=User.objects.first(), content='Fresh review')
+        self.assertContains(self.client.get(self.url), 'Fresh review')
+        Genre.objects.update(name='Stale')
+        genre = Genre.objects.first()
+        genre.name = 'Space opera'
+        genre.save()
+        self.assertContains(self.client.get(self.url), 'Space opera')
+        reader = User.objects.first()
+        reader.username = 'renamed_reader'
+        reader.save()
+        self.assertContains(self.client.get(self.url), 'renamed_reader')
+
+    def test_only_reader_changes_shown_in_reviews_invalidate_them(self):
+        other = create_catalog(1)[0]
+        reviews_version = lambda book: versions.get_version(f'reviews:{book.pk}')
+        before = reviews_version(self.book), reviews_version(other)
+        User.objects.create_user('newcomer', password='secret')
+        reader = User.objects.get(username='reader0')
+        reader.first_name = 'Ann'
+        reader.save()
+        reader.profile.save()
+        self.assertEqual((reviews_version(self.book), reviews_version(other)), before)
+        reader.username = 'renamed_reader'
+        reader.save()
+        self.assertGreater(reviews_version(self.book), before[0])
+        self.assertEqual(reviews_version(other), before[1])
+        before = reviews_version(self.book)
+        reader.profile.photo = 'user_profile/photos/reader.png'
+        reader.profile.save()
+        self.assertGreater(reviews_version(self.book), before)
+
+    def test_genre_changes_invalidate_fragments(self):
+        poetry, drama = Genre.objects.create(name='Poetry'), Genre.objects.create(name='Drama')
+        self.client.get(self.url)
+        self.book.genre.add(poetry)
+        self.assertContains(self.client.get(self.url), 'Poetry')
+        drama.book_set.add(self.book)
+        self.assertContains(self.client.get(self.url), 'Drama')
+        drama.book_set.remove(self.book)
+        self.assertNotContains(self.client.get(self.url), 'Drama')
+        poetry.book_set.clear()
+        self.assertNotContains(self.client.get(self.url), 'Poetry')
+
+    def test_fragments_cached_before_the_commit_go_stale_after_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.book.title = 'Renamed book'
+            self.book.save()
+            # another connection renders the old title under the new stamp
+            Book.objects.filter(pk=self.book.pk).update(title='Old title')
+            self.client.get(self.url)
+            Book.objects.filter(pk=self.book.pk).update(title='Renamed book')
+        self.assertContains(self.client.get(self.url), 'Renamed book')
+
+    def test_post_loads_book_once(self):
+        user = User.objects.create_user('poster', password='secret')
+        self.client.force_login(user)
+        get_object = SingleObjectMixin.get_object
+        with mock.patch.object(SingleObjectMixin, 'get_object', autospec=True, side_effect=get_object) as mocked:
+            response = self.client.post(self.url, {'content': 'New', 'book': self.book.pk, 'reader': user.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(mocked.call_count, 1)
+
+
+class BookReviewsPageTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = create_catalog(1)[0]
+        readers = [User.objects.create_user(f'reader{number}', password='secret') for number in range(3)]
+        cls.reviews = [
+            BookReview.objects.create(book=cls.book, reader=readers[number % 3], content=f'Review {number}')
+            for number in range(25)
+        ]
+        # a few older reviews so the keyset crosses dates
+        BookReview.objects.filter(pk__in=[review.pk for review in cls.reviews[:5]]).update(created_at=date(2020, 1, 1))
+
+    def setUp(self):
+        cache.clear()
+
+    def test_review_count_is_denormalized(self):
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.review_count, 25)
+        self.reviews[0].delete()
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.review_count, 24)
+
+    def test_detail_page_shows_first_page(self):
+        response = self.client.get(reverse('book', args=[self.book.pk]))
+        self.assertEqual(len(response.context['reviews']), 10)
+        self.assertContains(response, 'Reviews (25)')
+        self.assertContains(response, 'id="more-reviews"')
+
+    def test_json_endpoint_walks_all_reviews(self):
+        url = reverse('book_reviews', args=[self.book.pk])
+        seen, cursor = [], None
+        while True:
+            page = self.client.get(url, {'cursor': cursor} if cursor else {}).json()
+            seen.extend(review['id'] for review in page['reviews'])
+            cursor = page['next_cursor']
+            if not cursor:
+                break
+        expected = BookReview.objects.filter(book=self.book).order_by('-created_at', '-id').values_list('id', flat=True)
+        self.assertEqual(seen, list(expected))
+        self.assertEqual(self.client.get(url, {'cursor': 'broken'}).status_code, 400)
+        for values in (['yesterday', 1], [None, 1], ['2020-01-01T00:00:00Z', 'x'], [[], {}]):
+            with self.subTest(values=values):
+                self.assertEqual(self.client.get(url, {'cursor': encode_cursor(values, 'n')}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('book_reviews', args=[self.book.pk + 1])).status_code, 404)
+
+
+class ReservationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = create_catalog(1)[0]
+        cls.copies = [BookInstance.objects.create(book=cls.book, status='a') for _ in range(2)]
+        cls.reader = User.objects.create_user('reader', password='secret')
+        cls.other = User.objects.create_user('other', password='secret')
+        cls.due_back = date(2030, 1, 1)
+
+    def test_reserve_hands_out_each_copy_once(self):
+        first = reservations.reserve(self.book, self.reader, self.due_back)
+        second = reservations.reserve(self.book, self.other, self.due_back)
+        self.assertNotEqual(first.pk, second.pk)
+        self.assertEqual((first.status, first.reader, first.version), ('r', self.reader, 1))
+        with self.assertRaises(reservations.ReservationError):
+            reservations.reserve(self.book, self.reader, self.due_back)
+
+    def test_lost_race_falls_through_to_next_copy(self):
+        claim = reservations.claim
+        calls = []
+
+        def steal_first(queryset, **changes):
+            # another reader takes the first candidate between the SELECT and the UPDATE
+            if not calls:
+                BookInstance.objects.filter(pk=self.copies[0].pk).update(status='r', reader=self.other)
+            calls.append(queryset)
+            return claim(queryset, **changes)
+
+        with mock.patch.object(connection.features, 'has_select_for_update_skip_locked', False), \
+                mock.patch.object(reservations, 'claim', side_effect=steal_first):
+            copy = reservations.reserve(self.book, self.reader, self.due_back)
+        self.assertEqual(copy.pk, self.copies[1].pk)
+        self.assertEqual(len(calls), 2)
+
+    def test_transitions_use_optimistic_version(self):
+        copy = reservations.reserve(self.book, self.reader, self.due_back)
+        stale = BookInstance.objects.get(pk=copy.pk)
+        reservations.take(copy, self.reader, self.due_back)
+        with self.assertRaises(reservations.ReservationError):
+            reservations.extend(stale, self.reader, date(2030, 2, 1))
+        with self.assertRaises(reservations.ReservationError):
+            reservations.release(copy, self.other)
+        reservations.extend(copy, self.reader, date(2030, 2, 1))
+        reservations.release(copy, self.reader)
+        copy.refresh_from_db()
+        self.assertEqual((copy.status, copy.reader, copy.due_back, copy.version), ('a', None, None, 4))
+
+    def test_views_go_through_reservations(self):
+        self.client.force_login(self.reader)
+        response = self.client.post(reverse('user_bookinstance_create'), {'book': self.book.pk, 'due_back': '2030-01-01'})
+        self.assertRedirects(response, reverse('user_books'))
+        copy = BookInstance.objects.get(reader=self.reader)
+        self.assertEqual(BookInstance.objects.count(), 2)
+        url = reverse('user_bookinstance_update', args=[copy.pk])
+        self.client.post(url, {'book': self.book.pk, 'due_back': '2030-02-01', 'version': copy.version})
+        copy.refresh_from_db()
+        self.assertEqual(copy.status, 't')
+        # a form rendered before the copy was taken is refused
+        self.client.post(url, {'book': self.book.pk, 'due_back': '2030-03-01', 'version': 1})
+        copy.refresh_from_db()
+        self.assertEqual(copy.due_back, date(2030, 2, 1))
+        self.client.post(reverse('user_bookinstance_delete', args=[copy.pk]))
+        copy.refresh_from_db()
+        self.assertEqual((copy.status, copy.reader), ('a', None))
+
+
+class RateLimitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_parse_rate(self):
+        self.assertEqual(ratelimit.parse_rate('5/h'), (5, 3600))
+        self.assertEqual(ratelimit.parse_rate('10/15m'), (10, 900))
+        with self.assertRaises(ValueError):
+            ratelimit.parse_rate('5 per hour')
+
+    def test_sliding_window(self):
+        start = 3600 * 1000
+        self.assertTrue(ratelimit.hit('test', 'client', '2/h', now=start))
+        self.assertTrue(ratelimit.hit('test', 'client', '2/h', now=start + 10))
+        self.assertFalse(ratelimit.hit('test', 'client', '2/h', now=start + 20))
+        # a quarter into the next window, 2 * 0.75 of the old hits still count
+        self.assertFalse(ratelimit.hit('test', 'client', '2/h', now=start + 4500))
+        # halfway the previous window weighs 1
+        self.assertTrue(ratelimit.hit('test', 'client', '2/h', now=start + 5400))
+        self.assertFalse(ratelimit.hit('test', 'client', '2/h', now=start + 5410))
+        self.assertTrue(ratelimit.hit('test', 'other', '2/h', now=start + 5410))
+
+    def test_review_posting_is_limited_without_review_queries(self):
+        book = create_catalog(1)[0]
+        user = User.objects.create_user('poster', password='secret')
+        self.client.force_login(user)
+        url = reverse('book', args=[book.pk])
+        self.client.post(url, {'content': 'First', 'book': book.pk, 'reader': user.pk})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(url, {'content': 'Second', 'book': book.pk, 'reader': user.pk})
+        self.assertRedirects(response, url, fetch_redirect_response=False)
+        self.assertFalse(any('library_bookreview' in query['sql'] for query in queries.captured_queries))
+        self.assertEqual(BookReview.objects.filter(reader=user).count(), 1)
+        self.assertContains(self.client.get(url), 'posting too much')
+
+    def test_invalid_review_does_not_use_up_the_limit(self):
+        book = create_catalog(1)[0]
+        user = User.objects.create_user('poster', password='secret')
+        self.client.force_login(user)
+        url = reverse('book', args=[book.pk])
+        self.assertEqual(self.client.post(url, {'content': '', 'book': book.pk, 'reader': user.pk}).status_code, 200)
+        self.client.post(url, {'content': 'Valid', 'book': book.pk, 'reader': user.pk})
+        self.assertEqual(BookReview.objects.filter(reader=user).count(), 1)
+
+    def test_registration_is_blocked(self):
+        url = reverse('register')
+        # mistakes are not counted
+        for _ in range(6):
+            self.assertEqual(self.client.post(url, {'username': ''}).status_code, 200)
+        for number in range(5):
+            response = self.client.post(url, {'username': f'new{number}', 'email': f'new{number}@example.com',
+                'password': 'secret', 'password2': 'secret'})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.client.post(url, {'username': ''}).status_code, 429)
+
+    def test_refund_takes_back_the_hit(self):
+        now = 3600 * 1000
+        self.assertTrue(ratelimit.hit('test', 'client', '1/h', now=now))
+        ratelimit.unhit('test', 'client', '1/h', now)
+        self.assertTrue(ratelimit.hit('test', 'client', '1/h', now=now + 10))
+
+
+class OverdueSweepTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = create_catalog(1)[0]
+        past, future = date.today() - timedelta(days=3), date.today() + timedelta(days=3)
+        cls.readers = [User.objects.create_user(f'reader{number}', f'reader{number}@example.com') for number in range(5)]
+        cls.overdue = [BookInstance.objects.create(book=cls.book, status='t', reader=reader, due_back=past)
+            for reader in cls.readers]
+        BookInstance.objects.create(book=cls.book, status='t', reader=cls.readers[0], due_back=future)
+        BookInstance.objects.create(book=cls.book, status='r', reader=cls.readers[0], due_back=past)
+
+    def test_overdue_annotation(self):
+        copies = BookInstance.objects.with_overdue()
+        self.assertEqual(set(copies.filter(overdue=True).values_list('pk', flat=True)), {c.pk for c in self.overdue})
+        self.assertEqual(copies.order_by('-overdue', 'id')[0].pk, self.overdue[0].pk)
+        copy = copies.get(pk=self.overdue[0].pk)
+        with mock.patch('library.models.timezone.localdate') as localdate:
+            self.assertTrue(copy.is_overdue)
+        localdate.assert_not_called()
+        self.assertEqual(BookInstance.objects.overdue().count(), 5)
+
+    def test_admin_filters_overdue(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('admin:library_bookinstance_changelist'), {'overdue': 'yes', 'o': '6'})
+        self.assertEqual(response.context['cl'].result_count, 5)
+
+    def test_sweep_resumes_after_interruption(self):
+        send_mass_mail = mail.send_mass_mail
+        calls = []
+
+        def fail_second_batch(messages, **kwargs):
+            calls.append(messages)
+            if len(calls) == 2:
+                raise ConnectionError('SMTP went away')
+            return send_mass_mail(messages, **kwargs)
+
+        with mock.patch('library.management.commands.sweep_overdue.send_mass_mail', side_effect=fail_second_batch):
+            with self.assertRaises(ConnectionError):
+                call_command('sweep_overdue', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(BookInstance.objects.filter(reminder_sent_at__isnull=False).count(), 2)
+        call_command('sweep_overdue', batch_size=2, stdout=StringIO())
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), [r.email for r in self.readers])
+        call_command('sweep_overdue', batch_size=2, stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 5)
+        # extending the loan clears the marker, the next sweep reminds again if it runs late
+        copy = BookInstance.objects.get(pk=self.overdue[0].pk)
+        reservations.extend(copy, self.readers[0], date.today() - timedelta(days=1))
+        call_command('sweep_overdue', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 6)
+
+
+class CatalogApiTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = create_catalog(5)
+        BookInstance.objects.create(book=cls.books[0], status='a')
+        BookInstance.objects.create(book=cls.books[0], status='t')
+
+    def setUp(self):
+        cache.clear()
+
+    def get_json(self, response):
+        content = b''.join(response.streaming_content) if response.streaming else response.content
+        return json.loads(content)
+
+    def test_books_stream(self):
+        with mock.patch('library.api.CHUNK_SIZE', 2):
+            response = self.client.get(reverse('api_books'))
+            books = self.get_json(response)['books']
+        self.assertTrue(response.streaming)
+        self.assertEqual([book['id'] for book in books], [book.pk for book in self.books])
+        self.assertEqual(len(books[0]['genres']), 2)
+        self.assertEqual(books[0]['author']['last_name'], self.books[0].author.last_name)
+        genre = Genre.objects.get(name='Fantasy')
+        filtered = self.get_json(self.client.get(reverse('api_books'), {'genre_id': genre.pk}))['books']
+        self.assertEqual(len(filtered), 5)
+
+    def asgi_get(self, path) -> tuple:
+        """Status and body of a GET through the ASGI handler, which sends the body from its event loop."""
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            messages.append(message)
+
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+            'headers': [(b'host', b'testserver')], 'client': ('127.0.0.1', 1000), 'server': ('testserver', 80),
+        }
+        # like the test client, keep the connection of the test transaction open
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+        try:
+            async_to_sync(ASGIHandler())(scope, receive, send)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+        body = b''.join(message.get('body', b'') for message in messages if message['type'] == 'http.response.body')
+        return messages[0]['status'], body
+
+    def test_lists_are_served_through_the_asgi_handler(self):
+        with mock.patch('library.api.CHUNK_SIZE', 2):
+            status, body = self.asgi_get(reverse('api_books'))
+        self.assertEqual(status, 200)
+        self.assertEqual([book['id'] for book in json.loads(body)['books']], [book.pk for book in self.books])
+        status, body = self.asgi_get(reverse('api_authors'))
+        self.assertEqual(status, 200)
+        self.assertEqual(len(json.loads(body)['authors']), Author.objects.count())
+
+    def test_book_detail_and_availability(self):
+        book = self.get_json(self.client.get(reverse('api_book', args=[self.books[0].pk])))
+        self.assertEqual(book['availability'], {'m': 0, 't': 1, 'a': 1, 'r': 0})
+        self.assertEqual(len(book['genres']), 2)
+        self.assertEqual(self.client.get(reverse('api_book', args=[0])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('api_books')).status_code, 405)
+
+    def test_unchanged_resources_are_not_modified(self):
+        url = reverse('api_book', args=[self.books[0].pk])
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        reader = User.objects.create_user('reader')
+        reservations.reserve(self.books[0], reader, date(2030, 1, 1))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get_json(response)['availability']['r'], 1)
+        # the available filter reads the copy counts the reservations change
+        available_url = reverse('api_books') + '?available=1'
+        BookInstance.objects.create(book=self.books[0], status='a')
+        available_etag = self.client.get(available_url)['ETag']
+        reservations.reserve(self.books[0], reader, date(2030, 1, 1))
+        self.assertEqual(self.client.get(available_url, HTTP_IF_NONE_MATCH=available_etag).status_code, 200)
+        # genres of a book are a many to many change of the book table
+        books_etag = self.client.get(reverse('api_books'))['ETag']
+        self.books[1].genre.clear()
+        self.assertEqual(self.client.get(reverse('api_books'), HTTP_IF_NONE_MATCH=books_etag).status_code, 200)
+
+
+class BookAvailabilityTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = create_catalog(3)
+        cls.reader = User.objects.create_user('reader')
+
+    def counts(self, book):
+        book.refresh_from_db()
+        return book.available_copies, book.total_copies
+
+    def test_signals_keep_counts(self):
+        book, other = self.books[:2]
+        copy = BookInstance.objects.create(book=book, status='a')
+        BookInstance.objects.create(book=book, status='m')
+        self.assertEqual(self.counts(book), (1, 2))
+        copy = BookInstance.objects.get(pk=copy.pk)
+        copy.status = 't'
+        copy.save()
+        self.assertEqual(self.counts(book), (0, 2))
+        copy.status = 'a'
+        copy.book = other
+        copy.save()
+        self.assertEqual(self.counts(book), (0, 1))
+        self.assertEqual(self.counts(other), (1, 1))
+        copy.save()
+        self.assertEqual(self.counts(other), (1, 1))
+        BookInstance.objects.get(pk=copy.pk).delete()
+        self.assertEqual(self.counts(other), (0, 0))
+
+    def test_reservations_keep_counts(self):
+        book = self.books[0]
+        BookInstance.objects.create(book=book, status='a')
+        copy = reservations.reserve(book, self.reader, date(2030, 1, 1))
+        self.assertEqual(self.counts(book), (0, 1))
+        reservations.take(copy, self.reader, date(2030, 1, 1))
+        self.assertEqual(self.counts(book), (0, 1))
+        reservations.release(copy, self.reader)
+        self.assertEqual(self.counts(book), (1, 1))
+        copy.save()
+        self.assertEqual(self.counts(book), (1, 1))
+
+    def test_reconcile_repairs_bulk_changes(self):
+        book = self.books[0]
+        BookInstance.objects.bulk_create([BookInstance(book=book, status='a') for _ in range(3)])
+        BookInstance.objects.filter(book=book).update(status='t')
+        Book.objects.filter(pk=self.books[1].pk).update(total_copies=5)
+        out = StringIO()
+        call_command('reconcile_availability', stdout=out)
+        self.assertIn('2 books', out.getvalue())
+        self.assertEqual(self.counts(book), (0, 3))
+        self.assertEqual(self.counts(self.books[1]), (0, 0))
+
+    def test_book_list_filters_and_sorts_by_availability(self):
+        for count, book in zip((1, 3), self.books[1:]):
+            for _ in range(count):
+                BookInstance.objects.create(book=book, status='a')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('books'), {'available': '1', 'sort': 'availability'})
+        self.assertEqual([book.pk for book in response.context['book_list']], [self.books[2].pk, self.books[1].pk])
+        self.assertContains(response, '3 of 3 copies available')
+        self.assertFalse(any('library_bookinstance' in query['sql'] for query in queries.captured_queries))
+
+
+class AsyncCatalogTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = create_catalog(4)
+        BookReview.objects.create(book=cls.books[0], reader=User.objects.create_user('reader'), content='Async review')
+
+    def setUp(self):
+        cache.clear()
+        # AsyncClient closes responses in another thread, which cannot write
+        # while the test transaction holds the SQLite lock
+        self.enterContext(mock.patch.object(visits, 'flush_if_due'))
+
+    def pages(self):
+        book, author = self.books[0], self.books[0].author
+        return ['/', '/authors/', f'/author/{author.pk}/', '/books/', '/books/?search=book&available=1',
+            f'/book/{book.pk}/']
+
+    async def test_async_views_match_sync_views(self):
+        client = AsyncClient()
+        for page in self.pages():
+            with override_settings(ROOT_URLCONF=site_urlconf(views)):
+                expected = await client.get(page)
+            await cache.aclear()
+            with override_settings(ROOT_URLCONF=site_urlconf(async_views)):
+                response = await client.get(page)
+            self.assertEqual(response.status_code, 200, page)
+            self.assertEqual(response.templates[0].name, expected.templates[0].name)
+            for key in ('books_count', 'book_count', 'author', 'object', 'book_list'):
+                if key in expected.context:
+                    self.assertEqual(str(response.context[key]), str(expected.context[key]), page)
+            await cache.aclear()
+        with override_settings(ROOT_URLCONF=site_urlconf(async_views)):
+            self.assertContains(response, 'Async review')
+            self.assertEqual((await client.get('/book/0/')).status_code, 404)
+
+    async def test_async_counters(self):
+        counts = await counters.aget_counters()
+        self.assertEqual(counts, await sync_to_async(counters.get_counters)())
+        self.assertEqual(counts['book_count'], 4)
+
+    def test_async_detail_posts_reviews_through_sync_view(self):
+        reader = User.objects.get(username='reader')
+        self.client.force_login(reader)
+        book = self.books[1]
+        with override_settings(ROOT_URLCONF=site_urlconf(async_views)):
+            response = self.client.post(f'/book/{book.pk}/', {'content': 'Posted', 'book': book.pk, 'reader': reader.pk})
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(BookReview.objects.filter(book=book, content='Posted').exists())
+
+
+class InstrumentationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = create_catalog(3)
+        cls.staff = User.objects.create_user('staff', is_staff=True)
+
+    def setUp(self):
+        cache.clear()
+        instrumentation.reset()
+
+    def test_histogram(self):
+        histogram = instrumentation.Histogram((1, 10, 100))
+        for value in (0.5, 5, 5, 50, 500):
+            histogram.observe(value)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['buckets'], {'1': 1, '10': 2, '100': 1, 'inf': 1})
+        self.assertEqual((snapshot['p50'], snapshot['p95'], snapshot['max']), (10, 500, 500))
+
+    @override_settings(SERVER_TIMING=True)
+    def test_metrics_per_url_name(self):
+        response = self.client.get(reverse('books'))
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="\d+ queries, 0 duplicates", render;dur=')
+        self.client.get(reverse('book', args=[self.books[0].pk]))
+        b''.join(self.client.get(reverse('api_books')).streaming_content)
+        stats = instrumentation.snapshot()
+        self.assertEqual(set(stats), {'books', 'book', 'api_books'})
+        self.assertGreater(stats['books']['queries']['max'], 0)
+        self.assertGreater(stats['books']['render_ms']['max'], 0)
+        self.assertEqual(stats['books']['bytes']['count'], 1)
+        self.assertGreater(stats['api_books']['queries']['max'], 0)
+
+    async def test_async_views_are_measured_without_a_thread(self):
+        async def get_response(request):
+            pass
+        self.assertTrue(asyncio.iscoroutinefunction(instrumentation.InstrumentationMiddleware(get_response)))
+        self.assertFalse(asyncio.iscoroutinefunction(instrumentation.InstrumentationMiddleware(lambda request: None)))
+        with override_settings(ROOT_URLCONF=site_urlconf(async_views)):
+            await AsyncClient().get(reverse('books'))
+        stats = await sync_to_async(instrumentation.snapshot)()
+        self.assertGreater(stats['books']['queries']['max'], 0)
+        self.assertGreater(stats['books']['render_ms']['max'], 0)
+
+    def test_duplicates_are_detected(self):
+        metrics = instrumentation.RequestMetrics()
+        with connection.execute_wrapper(metrics):
+            for _ in range(3):
+                list(Book.objects.filter(pk=self.books[0].pk))
+            list(Book.objects.filter(pk=self.books[1].pk))
+        self.assertEqual((metrics.queries, metrics.duplicates), (4, 2))
+        self.assertEqual(metrics.most_repeated()['count'], 3)
+
+    def test_stats_endpoint_is_staff_only(self):
+        self.client.get(reverse('authors'))
+        self.assertEqual(self.client.get(reverse('request_stats')).status_code, 302)
+        self.client.force_login(self.staff)
+        self.assertIn('authors', self.client.get(reverse('request_stats')).json())
+
+    @override_settings(QUERY_BUDGETS={'books': 1})
+    def test_budget_fails_in_tests(self):
+        with self.assertRaisesMessage(instrumentation.QueryBudgetExceeded, 'books ran'):
+            self.client.get(reverse('books'))
+        with override_settings(QUERY_BUDGETS_STRICT=False):
+            self.assertEqual(self.client.get(reverse('books')).status_code, 200)
+
+    def test_borrow_form_query_count_does_not_depend_on_book_count(self):
+        self.client.force_login(self.staff)
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(reverse('user_bookinstance_create'))
+        create_catalog(5, genres=('Poetry', ))
+        with CaptureQueriesContext(connection) as after:
+            self.client.get(reverse('user_bookinstance_create'))
+        self.assertEqual(len(before), len(after))
+
+
+class SeedingTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_seeded_catalog_is_consistent(self):
+        created = seeding.seed(books=30, copies_per_book=2, reviews=50, users=5, batch_size=7)
+        self.assertEqual(created, {'users': 5, 'authors': 4, 'books': 30, 'copies': 60, 'reviews': 50})
+        self.assertEqual(Book.objects.recount_copies(), 0)
+        self.assertEqual(sum(Book.objects.values_list('review_count', flat=True)), BookReview.objects.count())
+        self.assertEqual(counters.get_counters()['book_count'], 30)
+        book = Book.objects.first()
+        self.assertIn(book, search_books(Book.objects.all(), book.title))
+        self.assertFalse(BookInstance.objects.filter(status='a', reader__isnull=False).exists())
+
+    def test_seeding_again_adds_to_the_catalog(self):
+        seeding.seed(books=10, reviews=0, users=2)
+        seeding.seed(books=10, reviews=0, users=2)
+        self.assertEqual(Book.objects.values('isbn').distinct().count(), 20)
+        self.assertEqual(User.objects.count(), 4)
+        self.assertEqual(Genre.objects.count(), len(seeding.GENRES))
+
+    def test_bench_urls_visits_every_page(self):
+        out = StringIO()
+        call_command('bench_urls', sizes=[3, 6], repeat=2, users=2, stdout=out, stderr=StringIO())
+        results = json.loads(out.getvalue())['sizes']
+        self.assertEqual(list(results), ['3', '6'])
+        self.assertEqual(set(results['6']), {name for name, _ in pages()})
+        self.assertIn('/user_profile/profile/', [page['path'] for page in results['6'].values()])
+        self.assertEqual(results['6']['book']['queries'], results['3']['book']['queries'])
+        # the seeded catalog was rolled back
+        self.assertFalse(Book.objects.exists())
+
+
+class GenreFacetTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.fantasy, cls.horror, cls.poetry = [Genre.objects.create(name=name) for name in ('Fantasy', 'Horror', 'Poetry')]
+        cls.books = []
+        for title, genres in (('Dragon', 'fh'), ('Dragon poems', 'fp'), ('Ghost', 'h'), ('Elves', 'f')):
+            book = Book.objects.create(title=title, summary='')
+            book.genre.set([{'f': cls.fantasy, 'h': cls.horror, 'p': cls.poetry}[letter] for letter in genres])
+            cls.books.append(book)
+
+    def setUp(self):
+        cache.clear()
+
+    def titles(self, params):
+        response = self.client.get(reverse('books'), params)
+        return sorted(book.title for book in response.context['book_list']), response
+
+    def counts(self, response):
+        return {facet['name']: facet['count'] for facet in response.context['genre_facets']}
+
+    def test_unfiltered_counts_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(facets.catalog_facets(), [
+                (self.fantasy.pk, 'Fantasy', 3), (self.horror.pk, 'Horror', 2), (self.poetry.pk, 'Poetry', 1)])
+        with self.assertNumQueries(0):
+            facets.catalog_facets()
+
+    def test_genre_changes_invalidate_cached_counts(self):
+        facets.catalog_facets()
+        self.books[2].genre.add(self.poetry)
+        self.assertIn((self.poetry.pk, 'Poetry', 2), facets.catalog_facets())
+        self.books[1].delete()
+        self.assertIn((self.poetry.pk, 'Poetry', 1), facets.catalog_facets())
+
+    def test_genres_combine_with_and_or(self):
+        genre_ids = [self.fantasy.pk, self.horror.pk]
+        titles, response = self.titles({'genre_id': genre_ids})
+        self.assertEqual(titles, ['Dragon'])
+        self.assertEqual(self.counts(response), {'Fantasy': 1, 'Horror': 1, 'Poetry': 0})
+        self.assertEqual(response.context['books_count'], 1)
+        _, response = self.titles({'genre_id': genre_ids, 'genre_op': 'or'})
+        self.assertEqual(response.context['books_count'], 4)
+        # counted without the genre filter, what each genre adds to the selection
+        self.assertEqual(self.counts(response), {'Fantasy': 3, 'Horror': 2, 'Poetry': 1})
+
+    def test_facets_count_the_search_result_and_keep_it_in_links(self):
+        titles, response = self.titles({'search': 'dragon'})
+        self.assertEqual(titles, ['Dragon', 'Dragon poems'])
+        self.assertEqual(self.counts(response), {'Fantasy': 2, 'Horror': 1, 'Poetry': 1})
+        poetry = response.context['genre_facets'][2]
+        self.assertEqual(poetry['query'], f'search=dragon&genre_id={self.poetry.pk}')
+        self.assertEqual(self.titles(QueryDict(poetry['query']))[0], ['Dragon poems'])
+
+    def test_facet_links_toggle_genres(self):
+        response = self.client.get(reverse('books'), {'genre_id': self.fantasy.pk})
+        fantasy, horror = response.context['genre_facets'][:2]
+        self.assertTrue(fantasy['selected'])
+        self.assertEqual(fantasy['query'], '')
+        self.assertEqual(horror['query'], f'genre_id={self.fantasy.pk}&genre_id={self.horror.pk}')
+        self.assertEqual([genre['name'] for genre in response.context['selected_genres']], ['Fantasy'])
+
+    def test_counts_are_one_grouped_query(self):
+        with self.assertNumQueries(1):
+            counts = facets.count_genres(search_books(Book.objects.all(), 'dragon'))
+        self.assertEqual(counts, {self.fantasy.pk: 2, self.horror.pk: 1, self.poetry.pk: 1})
+
+
+class VisitTest(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def writes(self, queries):
+        return [query['sql'] for query in queries if not query['sql'].startswith(('SELECT', 'SAVEPOINT', 'RELEASE'))]
+
+    def test_anonymous_home_page_does_not_write(self):
+        # no flush is due during the test
+        cache.add(visits.FLUSH_DUE_KEY, True)
+        self.client.get(reverse('index'))
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'))
+        self.assertEqual(self.writes(queries), [])
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(response.context['visits_count'], 2)
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.signed_cookies')
+    def test_signed_cookie_sessions_keep_readers_out_of_the_database(self):
+        cache.add(visits.FLUSH_DUE_KEY, True)
+        self.client.force_login(User.objects.create_user('reader'))
+        for visits_count in (1, 2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(reverse('index'))
+            self.assertEqual(self.writes(queries), [])
+            self.assertEqual(response.context['visits_count'], visits_count)
+
+    def test_workers_flush_their_own_buffer(self):
+        self.client.get(reverse('index'))
+        self.client.get(reverse('index'))
+        # the first visit flushed, the second waits for the next flush
+        self.assertEqual(VisitStat.objects.get().visits, 1)
+        self.assertEqual(visits.pending(), {timezone.localdate(): 1})
+        cache.delete(visits.FLUSH_DUE_KEY)
+        response = self.client.get(reverse('index'))
+        self.assertEqual(VisitStat.objects.get().visits, 3)
+        self.assertEqual(response.context['visits_count'], 3)
+
+    def test_flush_writes_buffered_visits_in_batches(self):
+        today = timezone.localdate()
+        for _ in range(3):
+            visits.record()
+        visits.record(today - timedelta(days=1))
+        self.assertEqual(visits.total(), 4)
+        out = StringIO()
+        call_command('flush_visits', stdout=out)
+        self.assertIn('Flushed 4 visits', out.getvalue())
+        self.assertEqual(dict(VisitStat.objects.values_list('day', 'visits')), {today: 3, today - timedelta(days=1): 1})
+        visits.record()
+        self.assertEqual(visits.pending(), {today: 1})
+        self.assertEqual(visits.total(), 5)
+        visits.flush()
+        self.assertEqual(VisitStat.objects.get(day=today).visits, 4)
+        self.assertEqual(visits.pending(), {})
+
+    def test_failed_flush_keeps_visits_buffered(self):
+        visits.record()
+        with mock.patch.object(VisitStat.objects, 'get_or_create', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                visits.flush()
+        self.assertEqual(visits.pending(), {timezone.localdate(): 1})
+
+
+class AdminChangelistTest(TestCase):
+    CHANGELISTS = ('book', 'bookinstance', 'author', 'bookreview')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response
+
+    def test_changelists_stay_within_query_budget(self):
+        counts = []
+        for books in (5, 30):
+            seeding.seed(books=books, reviews=books, users=3)
+            sizes = {}
+            for name in self.CHANGELISTS:
+                view_name = f'admin:library_{name}_changelist'
+                sizes[name], _ = self.count_queries(reverse(view_name))
+                self.assertLessEqual(sizes[name], settings.QUERY_BUDGETS[view_name])
+            counts.append(sizes)
+        self.assertEqual(counts[0], counts[1])
+
+    def test_uuid_search_is_exact(self):
+        seeding.seed(books=5, reviews=0, users=2)
+        copy = BookInstance.objects.first()
+        url = reverse('admin:library_bookinstance_changelist')
+        _, response = self.count_queries(url, {'q': str(copy.unique_id).upper()})
+        self.assertEqual(list(response.context['cl'].result_list), [copy])
+        _, response = self.count_queries(url, {'q': copy.book.title})
+        self.assertIn(copy, response.context['cl'].result_list)
+
+    def test_loan_fields_are_not_rendered_as_selects_of_every_row(self):
+        seeding.seed(books=3, reviews=0, users=2)
+        _, response = self.count_queries(reverse('admin:library_bookinstance_changelist'))
+        self.assertNotContains(response, 'name="form-0-book"')
+        self.assertNotContains(response, 'name="form-0-reader"')
+        self.assertContains(response, 'name="form-0-status"')
+
+
+class LoanHistoryTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.book = create_catalog(1)[0]
+        cls.copy = BookInstance.objects.create(book=cls.book, status='a')
+        cls.reader = User.objects.create_user('reader', password='secret')
+
+    def events(self):
+        return list(Loan.objects.order_by('id').values_list('event', 'copy_id', 'reader_id', 'due_back'))
+
+    def test_reservations_log_every_event(self):
+        due_back, later = date(2030, 1, 1), date(2030, 2, 1)
+        copy = reservations.reserve(self.book, self.reader, due_back)
+        reservations.take(copy, self.reader, due_back)
+        reservations.extend(copy, self.reader, later)
+        with self.assertRaises(reservations.ReservationError):
+            reservations.take(copy, self.reader, later)
+        reservations.release(copy, self.reader)
+        copy = reservations.reserve(self.book, self.reader, due_back)
+        reservations.release(copy, self.reader)
+        pk, reader = self.copy.pk, self.reader.pk
+        self.assertEqual(self.events(), [
+            ('reserve', pk, reader, due_back), ('take', pk, reader, due_back), ('extend', pk, reader, later),
+            ('return', pk, reader, None), ('reserve', pk, reader, due_back), ('cancel', pk, reader, None),
+        ])
+        # the copy itself only holds the current state
+        self.assertEqual(BookInstance.objects.filter(book=self.book).count(), 1)
+
+    def test_history_outlives_the_copy(self):
+        reservations.reserve(self.book, self.reader, date(2030, 1, 1))
+        BookInstance.objects.filter(pk=self.copy.pk).delete()
+        self.assertEqual(Loan.objects.get().copy_id, self.copy.pk)
+
+    def create_loans(self, *months):
+        Loan.objects.bulk_create([
+            Loan(event='take', copy_id=self.copy.pk, book_id=self.book.pk, reader=self.reader,
+                created_at=timezone.make_aware(datetime(year, month, day)))
+            for year, month, days in months for day in days
+        ])
+
+    def test_archive_moves_old_months_to_files(self):
+        today = timezone.localdate()
+        recent = loans.add_months(today.replace(day=1), -1)
+        self.create_loans((2020, 1, (1, 31)), (2020, 3, (15, )), (recent.year, recent.month, (2, )))
+        with tempfile.TemporaryDirectory() as directory:
+            out = StringIO()
+            call_command('archive_loans', keep_months=2, dir=directory, dry_run=True, stdout=out)
+            self.assertIn('2020-01: 2 loans', out.getvalue())
+            self.assertEqual(Loan.objects.count(), 4)
+            call_command('archive_loans', keep_months=2, dir=directory, stdout=StringIO())
+            files = sorted(path.name for path in Path(directory).iterdir())
+            self.assertEqual(files, ['loans-2020-01.jsonl.gz', 'loans-2020-03.jsonl.gz'])
+            rows = list(loans.read_archive(Path(directory) / 'loans-2020-01.jsonl.gz'))
+            self.assertEqual([row['created_at'][:10] for row in rows], ['2020-01-01', '2020-01-31'])
+            self.assertEqual(rows[0]['reader_id'], self.reader.pk)
+            self.assertEqual(Loan.objects.get().created_at.month, recent.month)
+            # archiving again finds nothing to do and never overwrites a file
+            self.create_loans((2020, 1, (5, )))
+            call_command('archive_loans', keep_months=2, dir=directory, stdout=StringIO())
+            self.assertIn('loans-2020-01.1.jsonl.gz', [path.name for path in Path(directory).iterdir()])
+            self.assertEqual(Loan.objects.count(), 1)
+
+
+class RecommendationTest(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.books = create_catalog(5)
+        cls.readers = [User.objects.create_user(f'reader{number}') for number in range(4)]
+
+    def setUp(self):
+        cache.clear()
+
+    def borrow(self, reader, *books):
+        Loan.objects.bulk_create([Loan(event='take', copy_id=0, book_id=book.pk, reader=reader) for book in books])
+
+    def stored(self):
+        return {book_id: [other for other, _ in rows] for book_id, rows in self.rows().items()}
+
+    def rows(self):
+        rows = {}
+        for recommendation in BookRecommendation.objects.order_by('book', 'rank'):
+            rows.setdefault(recommendation.book_id, []).append((recommendation.recommended_id, recommendation.score))
+        return rows
+
+    def test_neighbours_are_ranked_by_cosine_similarity(self):
+        a, b, c, d, _ = self.books
+        self.borrow(self.readers[0], a, b, c)
+        self.borrow(self.readers[1], a, b)
+        BookReview.objects.create(book=d, reader=self.readers[2], content='')
+        BookReview.objects.create(book=a, reader=self.readers[2], content='')
+        recommendations.build()
+        rows = self.rows()
+        # a has 3 readers, b 2, c 1, d 1: b 2/sqrt(6), c 1/sqrt(3), d 1/sqrt(3)
+        self.assertEqual([other for other, _ in rows[a.pk]], [b.pk, c.pk, d.pk])
+        self.assertAlmostEqual(rows[a.pk][0][1], 2 / 6 ** 0.5)
+        self.assertEqual(self.stored()[d.pk], [a.pk])
+
+    def test_incremental_update_matches_full_build(self):
+        a, b, c, d, e = self.books
+        self.borrow(self.readers[0], a, b)
+        self.borrow(self.readers[1], c, d)
+        recommendations.build()
+        self.borrow(self.readers[1], a)
+        self.borrow(self.readers[2], e, d)
+        build = recommendations.update()
+        self.assertFalse(build.full)
+        incremental = self.rows()
+        recommendations.build()
+        self.assertEqual(incremental.keys(), self.rows().keys())
+        for book_id, rows in self.rows().items():
+            self.assertEqual([other for other, _ in incremental[book_id]], [other for other, _ in rows])
+            for (_, score), (_, expected) in zip(incremental[book_id], rows):
+                self.assertAlmostEqual(score, expected)
+        self.assertEqual(recommendations.update().books, 0)
+
+    def test_book_page_reads_recommendations_in_one_query(self):
+        a, b, c, *_ = self.books
+        self.borrow(self.readers[0], a, b, c)
+        call_command('build_recommendations', stdout=StringIO())
+        with self.assertNumQueries(1):
+            recommended = list(recommendations.for_book(a.pk))
+            self.assertEqual([row.recommended.author.last_name for row in recommended], ['No1', 'No2'])
+        response = self.client.get(reverse('book', args=[a.pk]))
+        self.assertContains(response, 'also borrowed')
+        self.assertContains(response, b.title)
+        # cached with the page until the next build
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('book', args=[a.pk]))
+        self.assertFalse(any('bookrecommendation' in query['sql'] for query in queries))
+
+
+class AutocompleteTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = Path(directory.name, 'autocomplete.idx')
+        self.enterContext(override_settings(AUTOCOMPLETE_SNAPSHOT=self.path))
+        self.addCleanup(autocomplete._indexes.pop, self.path, None)
+        saramago = Author.objects.create(first_name='José', last_name='Saramago')
+        herbert = Author.objects.create(first_name='Frank', last_name='Herbert')
+        self.dune = Book.objects.create(title='Dune', summary='', author=herbert)
+        self.messiah = Book.objects.create(title='Dune Messiah', summary='', author=herbert)
+        self.blindness = Book.objects.create(title='Blindness: A Novel', summary='', author=saramago)
+        self.authors = saramago, herbert
+        # written by build_autocomplete or a background thread of a worker
+        autocomplete.write_snapshot()
+
+    def labels(self, text):
+        return [result['label'] for result in autocomplete.search(text)]
+
+    def test_prefixes_match_titles_words_and_authors(self):
+        self.assertEqual(self.labels('dun'), ['Dune', 'Dune Messiah'])
+        self.assertEqual(self.labels('mess'), ['Dune Messiah'])
+        self.assertEqual(self.labels('NOVEL'), ['Blindness: A Novel'])
+        self.assertEqual(self.labels('blindness a'), ['Blindness: A Novel'])
+        self.assertEqual(self.labels('jose sar'), ['José Saramago'])
+        self.assertEqual(self.labels('saramago j'), ['José Saramago'])
+        self.assertEqual(self.labels('x'), [])
+        self.assertEqual(self.labels(' !'), [])
+
+    def test_saves_show_up_before_the_snapshot_is_rewritten(self):
+        self.assertEqual(self.labels('dun'), ['Dune', 'Dune Messiah'])
+        self.messiah.title = 'Children of Dune'
+        self.messiah.save()
+        Book.objects.create(title='Dune Road', summary='', author=self.authors[1])
+        self.dune.delete()
+        self.assertEqual(self.labels('dun'), ['Dune Road', 'Children of Dune'])
+        self.assertEqual(self.labels('dune m'), [])
+        self.authors[0].delete()
+        self.assertEqual(self.labels('jose'), [])
+
+    def test_workers_share_the_snapshot_file(self):
+        autocomplete.search('dune')
+        other = autocomplete.Index(self.path)
+        other.load()
+        # a save in this process, the other worker sees the stamp but not the delta
+        Book.objects.create(title='Dune Road', summary='', author=self.authors[1])
+        with mock.patch.object(autocomplete.Index, 'start_rewrite') as start_rewrite:
+            self.assertEqual([result['label'] for result in other.search('dune r')], [])
+            start_rewrite.assert_not_called()
+            with mock.patch.object(autocomplete, 'REFRESH_SECONDS', 0), self.assertNumQueries(0):
+                self.assertEqual([result['label'] for result in other.search('dune r')], [])
+            # the stale snapshot is served, the rewrite is left to a thread
+            start_rewrite.assert_called_once()
+        autocomplete.rewrite(self.path)
+        self.assertEqual([result['label'] for result in other.search('dune r')], ['Dune Road'])
+        index = autocomplete.get_index()
+        self.assertEqual(self.labels('dune r'), ['Dune Road'])
+        self.assertEqual(index.snapshot.version, other.snapshot.version)
+        # the snapshot has the new book, the delta is no longer needed
+        self.assertEqual(index.delta, [])
+
+    def test_missing_snapshot_is_written_in_the_background(self):
+        self.path.unlink()
+        index = autocomplete.Index(self.path)
+        with mock.patch('library.autocomplete.threading.Thread') as thread, self.assertNumQueries(0):
+            self.assertEqual(index.search('dune'), [])
+            index.search('dune')
+        # one thread, not one per search
+        thread.assert_called_once_with(target=index.rewrite, name='autocomplete-snapshot', daemon=True)
+        autocomplete.rewrite(self.path)
+        self.assertEqual(len(index.search('dune')), 2)
+
+    def test_endpoint_runs_no_queries_once_warm(self):
+        self.client.get(reverse('api_autocomplete'), {'q': 'du'})
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('api_autocomplete'), {'q': 'du', 'limit': '1'})
+        self.assertEqual(response.json(), {'results': [
+            {'type': 'book', 'id': self.dune.pk, 'label': 'Dune', 'url': reverse('book', args=[self.dune.pk])},
+        ]})
+        self.assertEqual(self.client.get(reverse('api_autocomplete')).json(), {'results': []})
+
+    def test_build_command_writes_the_snapshot(self):
+        out = StringIO()
+        call_command('build_autocomplete', stdout=out)
+        self.assertIn('10 entries', out.getvalue())
+        self.assertEqual(len(autocomplete.Snapshot(self.path)), 10)
+
+
+class AssetTest(TestCase):
+    def setUp(self):
+        static_root, media_root = tempfile.TemporaryDirectory(), tempfile.TemporaryDirectory()
+        self.addCleanup(static_root.cleanup)
+        self.addCleanup(media_root.cleanup)
+        self.enterContext(override_settings(STATIC_ROOT=static_root.name, MEDIA_ROOT=media_root.name))
+        self.media = Path(media_root.name)
+        self.media.joinpath('upload.bin').write_bytes(bytes(range(256)) * 4)
+
+    def test_collected_files_are_hashed_and_precompressed(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        url = Template("{% load static %}{% static 'library/css/base.css' %}").render(Context())
+        self.assertRegex(url, assets.HASHED)
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        compressed = b''.join(response.streaming_content)
+        response = self.client.get(url)
+        self.assertNotIn('Content-Encoding', response)
+        self.assertLess(len(compressed), len(b''.join(response.streaming_content)))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(self.client.get('/static/library/css/base.css')['Cache-Control'], assets.REVALIDATE)
+
+    def test_variants_follow_accept_encoding_weights(self):
+        call_command('collectstatic', interactive=False, verbosity=0)
+        url = Template("{% load static %}{% static 'library/css/base.css' %}").render(Context())
+        for header, encoding in (('gzip;q=0, deflate', None), ('xgzip', None), ('*;q=0', None),
+                ('gzip;q=0.5', 'gzip'), ('*', 'gzip'), ('br, *;q=0.1', 'gzip')):
+            with self.subTest(header=header):
+                response = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+                self.assertEqual(response.get('Content-Encoding'), encoding)
+                response.close()
+        weights = assets.encoding_weights('br;q=0.4, GZIP;q=0.9')
+        self.assertEqual(sorted(['br', 'gzip'], key=lambda coding: -assets.weight(weights, coding)), ['gzip', 'br'])
+
+    def test_media_answers_ranges_and_revalidations(self):
+        url = '/media/upload.bin'
+        response = self.client.get(url)
+        self.assertEqual(response['Cache-Control'], assets.MEDIA)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(len(b''.join(response.streaming_content)), 1024)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/1024')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(10, 20)))
+        response = self.client.get(url, HTTP_RANGE='bytes=-4')
+        self.assertEqual(b''.join(response.streaming_content), bytes(range(252, 256)))
+        self.assertEqual(self.client.get(url, HTTP_RANGE='bytes=2000-').status_code, 416)
+        # the file changed since the client got its first part
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/media/../settings.py').status_code, 404)
+        self.assertEqual(self.client.post(url).status_code, 405)
+
+    def test_renditions_are_cached_forever(self):
+        rendition = self.media.joinpath(images.rendition_name('ab' * 20, 'list', 'jpg'))
+        rendition.parent.mkdir(parents=True)
+        rendition.write_bytes(b'jpeg')
+        response = self.client.get('/media/' + images.rendition_name('ab' * 20, 'list', 'jpg'))
+        self.assertEqual(response['Cache-Control'], assets.IMMUTABLE)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    def test_files_reach_the_server_file_wrapper(self):
+        instrumentation.reset()
+        # the test client wraps streamed content itself, this runs the whole handler like a server
+        environ = {**RequestFactory().get('/media/upload.bin').environ, 'wsgi.file_wrapper': FileWrapper}
+        result = WSGIHandler()(environ, lambda status, headers: None)
+        result.close()
+        self.assertIsInstance(result, FileWrapper)
+        self.assertEqual(instrumentation.snapshot()['media']['bytes']['max'], 1024)
+
+    def test_bench_static_compares_before_and_after(self):
+        out = StringIO()
+        call_command('bench_static', repeat=2, media_kb=4, range_kb=1, stdout=out)
+        results = json.loads(out.getvalue())['results']
+        self.assertTrue(results['media']['after']['file_wrapper'])
+        self.assertEqual(results['media']['after_range']['bytes'], 1024)
+        self.assertEqual(results['static']['after_revalidated']['status'], 304)
+        self.assertLess(results['static']['after']['bytes'], results['static']['before']['bytes'])
@@ -1,14 +1,33 @@
+from django.conf import settings
 from django.urls import path
-from . import views
-
-urlpatterns = [
-    path('', views.index, name='index'),
-    path('authors/', views.authors, name='authors'),
-    path('author/<int:author_id>/', views.author, name='author'),
-    path('books/', views.BookListView.as_view(), name='books'),
-    path('book/<int:pk>/', views.BookDetailView.as_view(), name='book'),
+from . import api, async_views, views
+
+
+def catalog_urlpatterns(catalog) -> list:
+    """Catalog pages, served by library.views or library.async_views."""
+    return [
+        path('', catalog.index, name='index'),
+        path('authors/', catalog.authors, name='authors'),
+        path('author/<int:author_id>/', catalog.author, name='author'),
+        path('books/', catalog.BookListView.as_view(), name='books'),
+        path('book/<int:pk>/', catalog.BookDetailView.as_view(), name='book'),
+    ]
+
+
+library_urlpatterns = [
+    path('book/<int:pk>/reviews/', views.book_reviews, name='book_reviews'),
     path('my_books/', views.UserBookListView.as_view(), name='user_books'),
     path('borrow_new_book/', views.UserBookInstanceCreateView.as_view(), name='user_bookinstance_create'),
     path('take_reserved_book/<int:pk>/', views.UserBookInstanceUpdateView.as_view(), name='user_bookinstance_update'),
     path('return_book/<int:pk>/', views.UserBookInstanceDeleteView.as_view(), name='user_bookinstance_delete'),
-    ]
\ No newline at end of file
+    path('api/books/', api.books, name='api_books'),
+    path('api/books/<int:pk>/', api.book, name='api_book'),
+    path('api/books/<int:pk>/availability/', api.book_availability, name='api_book_availability'),
+    path('api/authors/', api.authors, name='api_authors'),
+    path('api/authors/<int:pk>/', api.author, name='api_author'),
+    path('api/genres/', api.genres, name='api_genres'),
+    path('api/autocomplete/', api.autocomplete, name='api_autocomplete'),
+    path('stats/requests/', views.request_stats, name='request_stats'),
+    ]
+
+urlpatterns = catalog_urlpatterns(async_views if settings.ASYNC_CATALOG else views) + library_urlpatterns
\ No newline at end of file
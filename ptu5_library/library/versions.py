@@ -0,0 +1,54 @@
+import time
+from django.core.cache import cache
+from django.db import transaction
+from . models import BookReview
+
+# Version stamps for cached content: a name like 'book:12' or 'genres' maps to
+# the time its data last changed. Cache keys that include the stamp go stale
+# the moment a save bumps it, so nothing has to be deleted explicitly.
+KEY_PREFIX = 'library:version:'
+
+
+def get_versions(*names) -> dict:
+    keys = {KEY_PREFIX + name: name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        # an unknown stamp starts now, which also covers evicted entries
+        cache.add(key, time.time_ns(), None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def get_version(name) -> int:
+    return get_versions(name)[name]
+
+
+def version_key(*names) -> str:
+    versions = get_versions(*names)
+    return '.'.join(str(versions[name]) for name in names)
+
+
+def table(model) -> str:
+    """Stamp name for everything stored in the table of model."""
+    return f'table:{model._meta.db_table}'
+
+
+def set_now(names):
+    now = time.time_ns()
+    cache.set_many({KEY_PREFIX + name: now for name in names}, None)
+
+
+def bump(*names):
+    set_now(names)
+    # a request between the save and its commit caches the old data under the
+    # stamp just set, a second stamp at commit time makes that entry stale
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: set_now(names))
+
+
+def bump_reader(reader_id):
+    """Reviews show their reader's name and avatar, stales the reviews of every book they reviewed."""
+    book_ids = BookReview.objects.filter(reader_id=reader_id).values_list('book_id', flat=True).distinct()
+    names = [f'reviews:{book_id}' for book_id in book_ids]
+    if names:
+        bump(*names)
@@ -1,112 +1,206 @@
+from datetime import date
 from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
 from django.contrib import messages
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.contrib.admin.views.decorators import staff_member_required
+from django.db.models.functions import Coalesce
+from django.http import Http404, HttpResponseRedirect, JsonResponse
 from django.shortcuts import render, get_object_or_404
+from django.utils.decorators import method_decorator
+from django.utils.functional import SimpleLazyObject
 from django.views.generic import ListView, DetailView, CreateView, UpdateView, DeleteView
 from django.views.generic.edit import FormMixin
 from django.urls import reverse, reverse_lazy
-from . models import Genre, Author, Book, BookInstance
+from . models import Author, Book, BookInstance, BookReview
+from . import counters, facets, images, instrumentation, recommendations, reservations, versions, visits
 from . forms import BookReviewForm, BookInstanceForm, BookInstanceUpdateForm
+from . ratelimit import ratelimit, refund
+from . paginators import CursorPaginationMixin, CursorPaginator, InvalidCursor, cursor_query
+from . search import search_books
 
 def index(request):
-    book_count = Book.objects.count()
-    book_instance_count = BookInstance.objects.count()
-    book_instance_available_count = BookInstance.objects.filter(status='a').count()
-    author_count = Author.objects.count()
-    visits_count = request.session.get('visits_count', 1)
-    request.session['visits_count'] = visits_count + 1
-
-    context = {
-        'book_count': book_count,
-        'book_instance_count' : book_instance_count,
-        'book_instance_available_count' : book_instance_available_count,
-        'author_count' :  author_count,
-        'genre_count' : Genre.objects.count(),
-        'visits_count' : visits_count,
-    }
+    context = counters.get_counters()
+    context['visits_count'] = visits.visit(request)
 
     return render(request, 'library/index.html', context)
 
 
 def authors(request):
-    paginator = Paginator(Author.objects.all(), 5)
-    page_number = request.GET.get('page')
-    paged_authors = paginator.get_page(page_number)
-    return render(request, 'library/authors.html', {'authors': paged_authors })
+    paginator = CursorPaginator(Author.objects.all(), 5, ('last_name', 'first_name', 'id'))
+    paged_authors = paginator.get_page(request.GET.get('cursor'))
+    context = {'authors': paged_authors}
+    if paged_authors.has_next():
+        context['next_page_query'] = cursor_query(request, paged_authors.next_cursor)
+    if paged_authors.has_previous():
+        context['previous_page_query'] = cursor_query(request, paged_authors.previous_cursor)
+    return render(request, 'library/authors.html', context)
 
 
 def author(request, author_id):
-    return render(request, 'library/author.html', {'author': get_object_or_404(Author, id=author_id)})
+    # the page lists titles only, each book gets its author from the prefetch
+    queryset = Author.objects.prefetch_related('books')
+    return render(request, 'library/author.html', {'author': get_object_or_404(queryset, id=author_id)})
 
 
-class BookListView(ListView):
+def filter_books(queryset, params, genres=True):
+    """Catalog filters shared by the book list and the API."""
+    search = params.get('search')
+    if search:
+        queryset = search_books(queryset, search)
+    if genres:
+        queryset = facets.filter_genres(queryset, facets.genre_ids(params), facets.genre_op(params))
+    if params.get('available'):
+        queryset = queryset.filter(available_copies__gt=0)
+    return queryset
+
+
+def is_filtered(params) -> bool:
+    return bool(params.get('search') or facets.genre_ids(params) or params.get('available'))
+
+
+def book_facets(request) -> list:
+    """Genre facets counted over the current result.
+
+    With 'or' the counts leave out the genre filter, so they tell how many
+    books each genre adds to the selection.
+    """
+    params = request.GET
+    with_genres = facets.genre_op(params) == 'and' and bool(facets.genre_ids(params))
+    if not (params.get('search') or params.get('available') or with_genres):
+        return facets.genre_facets(request)
+    return facets.genre_facets(request, filter_books(Book.objects.all(), params, genres=with_genres))
+
+
+def book_ordering(params) -> tuple:
+    if params.get('sort') == 'availability':
+        return ('-available_copies', 'title', 'id')
+    if params.get('search'):
+        return ('-search_rank', 'id')
+    return ('title', 'id')
+
+
+class BookListView(CursorPaginationMixin, ListView):
     model = Book
     paginate_by = 3
     template_name = 'library/book_list.html'
-    
+    estimate_count = True
+
+    def get_cursor_ordering(self):
+        return book_ordering(self.request.GET)
+
     def get_queryset(self):
-        queryset = super().get_queryset()
-        search = self.request.GET.get('search')
-        if search:
-            queryset = queryset.filter(Q(title__icontains=search) | Q(summary__icontains=search))
-        genre_id = self.request.GET.get('genre_id')
-        if genre_id:
-            queryset = queryset.filter(genre__id=genre_id)
-        return queryset
+        return filter_books(Book.objects.for_catalog(), self.request.GET)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        #context['books_count'] = Book.objects.count()
-        context['books_count'] = self.get_queryset().count()
-        genre_id = self.request.GET.get('genreid')
-        context['genres'] = Genre.objects.all()
-        if genre_id:
-            context['genre'] = get_object_or_404(Genre, id=genre_id)
+        if is_filtered(self.request.GET):
+            context['books_count'] = context['paginator'].count
+        else:
+            context['books_count'] = counters.get_counters()['book_count']
+        context['genre_facets'] = book_facets(self.request)
+        context['selected_genres'] = [facet for facet in context['genre_facets'] if facet['selected']]
         return context
 
 
+REVIEWS_PAGE_SIZE = 10
+REVIEWS_ORDERING = ('-created_at', '-id')
+
+
+@method_decorator(ratelimit('review', '1/h', block=False), name='post')
 class BookDetailView(FormMixin, DetailView):
-    model = Book
+    # genres and reviews are loaded inside the cached fragments of the template
+    queryset = Book.objects.select_related('author')
     template_name = 'library/book_detail.html'
     form_class = BookReviewForm
 
+    def get_object(self, queryset=None):
+        if getattr(self, 'object', None) is None:
+            self.object = super().get_object(queryset)
+        return self.object
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        pk = self.object.pk
+        context['book_version'] = versions.version_key(f'book:{pk}', 'authors', 'genres')
+        context['reviews_version'] = versions.version_key(f'reviews:{pk}')
+        context['recommendations_version'] = versions.version_key('recommendations', versions.table(Book))
+        # like the reviews, only queried when the fragment is not cached
+        context['recommendations'] = SimpleLazyObject(lambda: list(recommendations.for_book(pk)))
+        paginator = CursorPaginator(reviews_queryset(pk), REVIEWS_PAGE_SIZE, REVIEWS_ORDERING)
+        # only evaluated when the reviews fragment is not cached
+        context['reviews'] = SimpleLazyObject(paginator.page)
+        return context
+
     def get_success_url(self):
-        return reverse('book', kwargs={'pk': self.get_object().id})
+        return reverse('book', kwargs={'pk': self.object.id})
 
     def post(self, *args, **kwargs):
         self.object = self.get_object()
+        if self.request.limited:
+            messages.error(self.request, "You're posting too much!")
+            return HttpResponseRedirect(self.get_success_url())
         form = self.get_form()
         if form.is_valid():
             return self.form_valid(form)
         else:
-            messages.error(self.request, "You're posting too much!")
             return self.form_invalid(form)
 
     def form_valid(self, form):
-        form.instance.book = self.get_object()
+        form.instance.book = self.object
         form.instance.reader = self.request.user
         form.save()
         messages.success(self.request, 'Your Review have been posted ')
         return super().form_valid(form)
 
+    def form_invalid(self, form):
+        refund(self.request)
+        return super().form_invalid(form)
+
     def get_initial(self):
         return {
-            'book': self.get_object(),
+            'book': self.object,
             'reader': self.request.user,
         }
    
 
-class UserBookListView(LoginRequiredMixin, ListView):
+def reviews_queryset(book_id):
+    return BookReview.objects.filter(book_id=book_id).select_related('reader__profile')
+
+
+def book_reviews(request, pk):
+    paginator = CursorPaginator(reviews_queryset(pk), REVIEWS_PAGE_SIZE, REVIEWS_ORDERING)
+    try:
+        page = paginator.page(request.GET.get('cursor'))
+    except InvalidCursor as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    if not page and not Book.objects.filter(pk=pk).exists():
+        raise Http404('No book found')
+    return JsonResponse({
+        'reviews': [{
+            'id': review.id,
+            'reader': str(review.reader),
+            'photo': images.image_url(review.reader.profile, 'photo', 'thumbnail') if hasattr(review.reader, 'profile') else None,
+            'created_at': review.created_at,
+            'content': review.content,
+        } for review in page],
+        'next_cursor': page.next_cursor,
+    })
+
+
+class UserBookListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = BookInstance
     template_name= 'library/user_book_list.html'
+    paginate_by = 10
+    # copies without a due date go last
+    cursor_ordering = ('due_order', 'id')
     
     def get_queryset(self):
         queryset = super().get_queryset()
-        queryset = queryset.filter(reader=self.request.user).order_by('due_back')
+        queryset = queryset.filter(reader=self.request.user).select_related('book__author') \
+            .annotate(due_order=Coalesce('due_back', date.max)).with_overdue()
         return queryset
 
 
+@method_decorator(ratelimit('reserve', '20/h'), name='post')
 class UserBookInstanceCreateView(LoginRequiredMixin, CreateView):
     model = BookInstance
     #fields = ('book', 'due_back', )
@@ -115,10 +209,17 @@ class UserBookInstanceCreateView(LoginRequiredMixin, CreateView):
     success_url = reverse_lazy('user_books')
 
     def form_valid(self, form):
-        form.instance.reader = self.request.user
-        form.instance.status = 'r'
+        try:
+            self.object = reservations.reserve(form.cleaned_data['book'], self.request.user, form.cleaned_data['due_back'])
+        except reservations.ReservationError as e:
+            form.add_error('book', str(e))
+            return self.form_invalid(form)
         messages.success(self.request, 'Book reserved')
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
+
+    def form_invalid(self, form):
+        refund(self.request)
+        return super().form_invalid(form)
 
 
 class UserBookInstanceUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
@@ -128,19 +229,27 @@ class UserBookInstanceUpdateView(LoginRequiredMixin, UserPassesTestMixin, Update
     template_name = 'library/user_bookinstance_form.html'
     success_url = reverse_lazy('user_books')
 
+    def get_object(self, queryset=None):
+        if getattr(self, 'object', None) is None:
+            self.object = super().get_object(queryset)
+        return self.object
+
     def form_valid(self, form):
-        form.instance.reader = self.request.user
-        form.instance.status = 't'
+        action = reservations.extend if self.object.status == 't' else reservations.take
+        try:
+            action(self.object, self.request.user, form.cleaned_data['due_back'], form.cleaned_data['version'])
+        except reservations.ReservationError as e:
+            messages.error(self.request, str(e))
+            return HttpResponseRedirect(self.get_success_url())
         messages.success(self.request, 'Book taken or extended')
-        return super().form_valid(form)
+        return HttpResponseRedirect(self.get_success_url())
 
     def test_func(self):
-        book_instance = self.get_object()
-        return self.request.user == book_instance.reader
+        return self.get_object().reader_id == self.request.user.pk
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['book_instance'] = self.get_object()
+        context['book_instance'] = self.object
         if context['book_instance'].status == 't':
             context['action'] = 'Extend'
         else:
@@ -153,10 +262,26 @@ class UserBookInstanceDeleteView(LoginRequiredMixin, UserPassesTestMixin, Delete
     template_name = 'library/user_bookinstance_delete.html'
     success_url = reverse_lazy('user_books')
 
+    def get_object(self, queryset=None):
+        if getattr(self, 'object', None) is None:
+            self.object = super().get_object(queryset)
+        return self.object
+
     def test_func(self):
-        book_instance = self.get_object()
-        return self.request.user == book_instance.reader
+        return self.get_object().reader_id == self.request.user.pk
 
     def form_valid(self, form):
-        messages.success(self.request, 'book returned ')
-        return super().form_valid(form)
+        # the copy goes back on the shelf instead of being deleted
+        try:
+            reservations.release(self.object, self.request.user)
+        except reservations.ReservationError as e:
+            messages.error(self.request, str(e))
+        else:
+            messages.success(self.request, 'book returned ')
+        return HttpResponseRedirect(self.get_success_url())
+
+
+@staff_member_required
+def request_stats(request):
+    """Request metrics of this worker process per URL name, see library.instrumentation."""
+    return JsonResponse(instrumentation.snapshot())
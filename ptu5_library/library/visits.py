@@ -0,0 +1,97 @@
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+from . models import VisitStat
+
+# Home page visits are counted in the cache and written to VisitStat in
+# batches, so a visit never writes to the database by itself. Every web
+# worker flushes the buffer at most every FLUSH_SECONDS once a response is
+# sent, which
+# also works with a cache per process like locmem: a worker loses at most
+# that much on restart. With a cache shared by the workers, the flush_visits
+# command can flush from cron as well.
+
+KEY_PREFIX = 'library:visits:'
+FLUSHED_KEY = KEY_PREFIX + 'flushed'
+FLUSH_DUE_KEY = KEY_PREFIX + 'flush_due'
+FLUSH_SECONDS = 60
+# days that are still buffered when flush_visits runs at least daily
+FLUSH_DAYS = 2
+
+
+def get_cache():
+    return caches[getattr(settings, 'VISITS_CACHE', 'default')]
+
+
+def day_key(day) -> str:
+    return f'{KEY_PREFIX}{day.isoformat()}'
+
+
+def record(day=None):
+    cache = get_cache()
+    key = day_key(day or timezone.localdate())
+    if cache.add(key, 1, None):
+        return
+    try:
+        cache.incr(key)
+    except ValueError:
+        # evicted between add and incr
+        cache.add(key, 1, None)
+
+
+def pending(days=FLUSH_DAYS) -> dict:
+    """day: visits counted in the cache and not flushed yet."""
+    today = timezone.localdate()
+    keys = {day_key(today - timedelta(days=number)): today - timedelta(days=number) for number in range(days)}
+    return {keys[key]: count for key, count in get_cache().get_many(keys).items() if count}
+
+
+def total() -> int:
+    """All visits, flushed and buffered."""
+    cache = get_cache()
+    flushed = cache.get(FLUSHED_KEY)
+    if flushed is None:
+        flushed = VisitStat.objects.aggregate(total=Sum('visits'))['total'] or 0
+        # other workers flush too, their visits show up within FLUSH_SECONDS
+        cache.set(FLUSHED_KEY, flushed, FLUSH_SECONDS)
+    return flushed + sum(pending().values())
+
+
+def flush(days=FLUSH_DAYS) -> int:
+    """Move the buffered visits to VisitStat, one row per day."""
+    cache = get_cache()
+    flushed = 0
+    for day, count in sorted(pending(days).items()):
+        with transaction.atomic():
+            stat, created = VisitStat.objects.get_or_create(day=day, defaults={'visits': count})
+            if not created:
+                VisitStat.objects.filter(pk=stat.pk).update(visits=F('visits') + count)
+            # visits counted meanwhile stay buffered, a failed decr rolls the row back
+            cache.decr(day_key(day), count)
+        flushed += count
+    if flushed:
+        cache.delete(FLUSHED_KEY)
+    return flushed
+
+
+def flush_if_due() -> int:
+    """Flush at most every FLUSH_SECONDS, the web workers call it after their responses."""
+    if get_cache().add(FLUSH_DUE_KEY, True, FLUSH_SECONDS):
+        return flush()
+    return 0
+
+
+def visit(request) -> int:
+    """Count a home page visit and return the visit number of the reader.
+
+    Anonymous visitors get no session and see the visits of the whole site.
+    """
+    record()
+    if not request.user.is_authenticated:
+        return total()
+    visits_count = request.session.get('visits_count', 1)
+    request.session['visits_count'] = visits_count + 1
+    return visits_count
@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'library.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.locale.LocaleMiddleware',
@@ -55,11 +56,42 @@ MIDDLEWARE = [
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
+# library.instrumentation: Server-Timing headers and the most queries a view
+# may run, by URL name. Strict budgets raise instead of only being recorded,
+# the test runner turns them on. Streamed API lists query once per chunk and
+# have no budget.
+SERVER_TIMING = DEBUG
+QUERY_BUDGETS = {
+    'index': 10,
+    'authors': 3,
+    'author': 5,
+    'books': 10,
+    'book': 12,
+    'book_reviews': 2,
+    'user_books': 3,
+    'user_bookinstance_create': 12,
+    'user_bookinstance_update': 10,
+    'user_bookinstance_delete': 8,
+    'api_book': 3,
+    'api_book_availability': 2,
+    'api_author': 2,
+    'api_genres': 1,
+    'api_autocomplete': 0,
+    'request_stats': 2,
+    'admin:library_book_changelist': 5,
+    'admin:library_bookinstance_changelist': 4,
+    'admin:library_author_changelist': 5,
+    'admin:library_bookreview_changelist': 4,
+}
+QUERY_BUDGETS_STRICT = False
+TEST_RUNNER = 'library.testing.QueryBudgetRunner'
+
 ROOT_URLCONF = 'ptu5_library.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # the Django backend, also timing renders for the instrumentation middleware
+        'BACKEND': 'library.instrumentation.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -75,6 +107,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'ptu5_library.wsgi.application'
 
+# serve the catalog pages with library.async_views, only pays off under ASGI
+ASYNC_CATALOG = False
+
 
 # Database
 # https://docs.djangoproject.com/en/4.1/ref/settings/#databases
@@ -87,6 +122,28 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+# locmem is per process, use a shared backend (memcached, redis, database)
+# when running several workers so cached counters are invalidated everywhere
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+# home page visits are buffered here, the workers write them out every
+# visits.FLUSH_SECONDS; shared by the workers, flush_visits can run from cron too
+VISITS_CACHE = 'default'
+
+# Sessions
+# https://docs.djangoproject.com/en/4.1/topics/http/sessions/#configuring-the-session-engine
+# only logged in readers get a session. cached_db reads them from the cache,
+# 'django.contrib.sessions.backends.signed_cookies' keeps them out of the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -130,6 +187,14 @@ STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR.joinpath('static')
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR.joinpath('media')
+# hashed names and .gz/.br variants written by collectstatic, see library/assets.py
+STATICFILES_STORAGE = 'library.assets.CompressedManifestStaticFilesStorage'
+
+# manage.py archive_loans writes old loan history here
+LOAN_ARCHIVE_DIR = BASE_DIR.joinpath('archive', 'loans')
+
+# prefix index of titles and authors, shared by the workers through mmap
+AUTOCOMPLETE_SNAPSHOT = BASE_DIR.joinpath('autocomplete.idx')
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
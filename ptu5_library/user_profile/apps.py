@@ -6,4 +6,4 @@ class UserProfileConfig(AppConfig):
     name = 'user_profile'
 
     def ready(self):
-        from . signals import create_profile, save_profile
+        from . signals import create_profile, check_username, check_photo, bump_reader_reviews
@@ -1,10 +1,64 @@
 from django.contrib.auth import get_user_model
 from django import forms
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from django.db.models.functions import Lower
 from . models import Profile
 
 User = get_user_model()
 
 
+def taken(username='', email='', exclude=None) -> tuple:
+    """(username taken, email taken) from one query reading two columns.
+
+    Emails are compared in lower case, like the unique email index does.
+    """
+    email = email.lower()
+    lookups = Q(username=username) if username else Q()
+    if email:
+        lookups |= Q(email_lower=email) & ~Q(email='')
+    users = User.objects.annotate(email_lower=Lower('email')).filter(lookups)
+    if exclude is not None:
+        users = users.exclude(pk=exclude.pk)
+    rows = list(users.values_list('username', 'email_lower')[:2])
+    return bool(username) and any(row[0] == username for row in rows), bool(email) and any(row[1] == email for row in rows)
+
+
+class RegistrationForm(forms.Form):
+    username = forms.CharField(max_length=150)
+    email = forms.EmailField()
+    password = forms.CharField(widget=forms.PasswordInput)
+    password2 = forms.CharField(widget=forms.PasswordInput)
+
+    def clean(self):
+        cleaned_data = super().clean()
+        password = cleaned_data.get('password')
+        if password and password != cleaned_data.get('password2'):
+            self.add_error('password2', 'Passwords do not match.')
+        username, email = cleaned_data.get('username'), cleaned_data.get('email')
+        if username and email:
+            username_taken, email_taken = taken(username, email)
+            if username_taken:
+                self.add_error('username', 'User with this username already exists.')
+            if email_taken:
+                self.add_error('email', 'User with this email already exists.')
+        return cleaned_data
+
+    def save(self):
+        """Create the user and its profile in one transaction.
+
+        None when a concurrent registration took the username or email first.
+        """
+        data = self.cleaned_data
+        try:
+            with transaction.atomic():
+                # the create_profile signal adds the profile inside this transaction
+                return User.objects.create_user(username=data['username'], email=data['email'], password=data['password'])
+        except IntegrityError:
+            self.add_error(None, 'User with this username or email already exists.')
+            return None
+
+
 class UserUpdateForm(forms.ModelForm):
     email = forms.EmailField()
     
@@ -12,6 +66,12 @@ class UserUpdateForm(forms.ModelForm):
         model = User
         fields = ("first_name", "last_name", "email")
 
+    def clean_email(self):
+        email = self.cleaned_data['email']
+        if taken(email=email, exclude=self.instance)[1]:
+            raise forms.ValidationError('User with this email already exists.')
+        return email
+
 
 class ProfileUpdateForm(forms.ModelForm):
 
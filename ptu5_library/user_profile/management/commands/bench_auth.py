@@ -0,0 +1,58 @@
+import json
+from itertools import count
+from django.contrib.auth.hashers import get_hasher
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from library.bench import measure, rolled_back
+
+PASSWORD = 'bench-auth-password'
+
+
+class Command(BaseCommand):
+    help = '''Measure login and registration throughput through the test client.
+
+    Every registration comes from its own address, so the registration rate
+    limit is not what gets measured. Users are created inside a transaction
+    that is rolled back. Run it on two checkouts to compare them.'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat', type=int, default=20, help='logins and registrations to time')
+
+    def report(self, timings, queries) -> dict:
+        return {'queries': queries, 'per_second': round(1000 / timings['mean'], 1), **timings}
+
+    def register(self, client, number):
+        response = client.post(reverse('register'), {
+            'username': f'bench_auth_{number}',
+            'email': f'bench_auth_{number}@example.com',
+            'password': PASSWORD,
+            'password2': PASSWORD,
+        }, REMOTE_ADDR=f'10.{number // 65536 % 256}.{number // 256 % 256}.{number % 256}')
+        if response.status_code != 302:
+            raise CommandError(f'Registration {number} failed with {response.status_code}')
+
+    def login(self, client, username):
+        # logs out again, the timings and queries are of a login and a logout
+        response = client.post(reverse('login'), {'username': username, 'password': PASSWORD})
+        if response.status_code != 302:
+            raise CommandError(f'Login of {username} failed with {response.status_code}')
+        client.logout()
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        numbers = count()
+        results = {}
+        with override_settings(ALLOWED_HOSTS=['testserver']), rolled_back():
+            client = Client()
+            with CaptureQueriesContext(connection) as queries:
+                self.register(client, next(numbers))
+            results['register'] = self.report(measure(lambda: self.register(client, next(numbers)), repeat), len(queries))
+            with CaptureQueriesContext(connection) as queries:
+                self.login(client, 'bench_auth_0')
+            results['login'] = self.report(measure(lambda: self.login(client, 'bench_auth_0'), repeat), len(queries))
+        # hashing dominates both, the hasher and its work factor set the ceiling
+        results['hasher'] = get_hasher().algorithm
+        self.stdout.write(json.dumps(results, indent=2))
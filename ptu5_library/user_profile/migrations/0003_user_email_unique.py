@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+from django.db.models.functions import Lower
+
+
+def check_duplicate_emails(apps, schema_editor):
+    """Emails were unique with their case only, stop before the index fails on the ones that differ in case."""
+    User = apps.get_model('auth', 'User')
+    duplicates = list(
+        User.objects.using(schema_editor.connection.alias).exclude(email='')
+        .values(email_lower=Lower('email')).annotate(users=Count('id')).filter(users__gt=1)
+        .values_list('email_lower', flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            'Emails must be unique ignoring case before this migration, change or clear the email of all but '
+            'one user of each of: ' + ', '.join(duplicates)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('user_profile', '0002_profile_photo_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_duplicate_emails, migrations.RunPython.noop),
+        # auth.User cannot take constraints from here. Emails are unique
+        # ignoring case, users without an email are left out. The condition is
+        # written like the ORM writes ~Q(email=''), SQLite only uses a partial
+        # index for queries repeating its condition
+        migrations.RunSQL(
+            "CREATE UNIQUE INDEX user_email_lower_uniq ON auth_user (LOWER(email)) WHERE NOT (email = '')",
+            'DROP INDEX user_email_lower_uniq',
+        ),
+    ]
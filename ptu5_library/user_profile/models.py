@@ -1,6 +1,6 @@
 from django.contrib.auth import get_user_model
 from django.db import models
-from PIL import Image
+from library import images
 
 class Profile(models.Model):
     user = models.OneToOneField(
@@ -11,15 +11,16 @@ class Profile(models.Model):
     )
 
     photo = models.ImageField("photo", upload_to='user_profile/photos', null=True, blank=True)
+    photo_hash = models.CharField(max_length=64, blank=True, editable=False)
 
     def __str__(self) -> str:
         return f"{self.user} profile" 
 
     def save(self, *args, **kwargs):
+        # resizing happens in manage.py process_images, only queue new uploads here
+        photo_changed = images.has_new_file(self, 'photo')
+        if photo_changed or not self.photo:
+            self.photo_hash = ''
         super().save(*args, **kwargs)
-        if self.photo:
-            photo = Image.open(self.photo.path)
-            if photo.width > 500 or photo.height > 500:
-                output_size = (500, 500)
-                photo.thumbnail(output_size)
-                photo.save(self.photo.path)
\ No newline at end of file
+        if photo_changed:
+            images.enqueue(self, 'photo')
\ No newline at end of file
@@ -1,6 +1,7 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_save
 from django.contrib.auth import get_user_model
 from django.dispatch import receiver
+from library import images, versions
 from . models import Profile
 
 @receiver(post_save, sender=get_user_model())
@@ -8,6 +9,28 @@ def create_profile(sender, instance, created, **kwargs):
     if created:
         Profile.objects.create(user=instance)
 
+# Reviews show the username and avatar of their reader, only changes to
+# those stale the cached reviews, and only of the books the reader reviewed.
+
+@receiver(pre_save, sender=get_user_model())
+def check_username(sender, instance, update_fields=None, **kwargs):
+    # logins only save last_login
+    instance._username_changed = not instance._state.adding \
+        and (update_fields is None or 'username' in update_fields) \
+        and sender.objects.filter(pk=instance.pk).exclude(username=instance.username).exists()
+
+@receiver(pre_save, sender=Profile)
+def check_photo(sender, instance, update_fields=None, **kwargs):
+    if instance._state.adding or update_fields is not None and 'photo' not in update_fields:
+        instance._photo_changed = False
+        return
+    old_photo = sender.objects.filter(pk=instance.pk).values_list('photo', flat=True).first()
+    instance._photo_changed = images.has_new_file(instance, 'photo') or (old_photo or '') != (instance.photo.name or '')
+
 @receiver(post_save, sender=get_user_model())
-def save_profile(sender, instance, **kwargs):
-    instance.profile.save()
\ No newline at end of file
+@receiver(post_save, sender=Profile)
+def bump_reader_reviews(sender, instance, **kwargs):
+    if instance.__dict__.pop('_username_changed', False):
+        versions.bump_reader(instance.pk)
+    if instance.__dict__.pop('_photo_changed', False):
+        versions.bump_reader(instance.user_id)
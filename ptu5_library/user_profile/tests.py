@@ -1,3 +1,89 @@
+from io import StringIO
+import json
+from unittest import mock
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from . forms import RegistrationForm, taken
+from . models import Profile
 
-# Create your tests here.
+User = get_user_model()
+
+
+class RegistrationTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('taken', 'Taken@example.com', 'secret')
+
+    def form(self, **data):
+        data = {'username': 'new', 'email': 'new@example.com', 'password': 'secret', 'password2': 'secret', **data}
+        return RegistrationForm(data)
+
+    def test_uniqueness_is_checked_in_one_query(self):
+        form = self.form(username='taken', email='TAKEN@example.com')
+        with self.assertNumQueries(1):
+            self.assertFalse(form.is_valid())
+        self.assertIn('username', form.errors)
+        self.assertIn('email', form.errors)
+        self.assertEqual(taken('new', 'taken@EXAMPLE.com'), (False, True))
+
+    def test_invalid_forms_never_hash_the_password(self):
+        with mock.patch('django.contrib.auth.base_user.make_password') as make_password:
+            response = self.client.post(reverse('register'), {'username': 'new', 'email': 'new@example.com',
+                'password': 'secret', 'password2': 'other'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('password2', response.context['form'].errors)
+        make_password.assert_not_called()
+        self.assertFalse(User.objects.filter(username='new').exists())
+
+    def test_registration_creates_user_and_profile(self):
+        response = self.client.post(reverse('register'), {'username': 'new', 'email': 'new@example.com',
+            'password': 'secret', 'password2': 'secret'})
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+        user = User.objects.get(username='new')
+        self.assertTrue(user.check_password('secret'))
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+
+    def test_email_is_unique_ignoring_case(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user('other', 'taken@EXAMPLE.com')
+        # users without an email are not affected
+        User.objects.create_user('no_email_1')
+        User.objects.create_user('no_email_2')
+
+    def test_concurrent_registration_is_a_form_error(self):
+        form = self.form()
+        self.assertTrue(form.is_valid())
+        User.objects.create_user('racer', 'NEW@example.com')
+        self.assertIsNone(form.save())
+        self.assertTrue(form.non_field_errors())
+        self.assertFalse(User.objects.filter(username='new').exists())
+
+    def test_profile_update_rejects_email_of_another_user(self):
+        user = User.objects.create_user('reader', 'reader@example.com', 'secret')
+        self.client.force_login(user)
+        response = self.client.post(reverse('update_profile'), {'email': 'taken@example.com'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('email', response.context['user_form'].errors)
+
+
+class ProfileSignalTest(TestCase):
+    def test_logins_do_not_save_the_profile(self):
+        User.objects.create_user('reader', 'reader@example.com', 'secret')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.client.login(username='reader', password='secret'))
+        self.assertFalse(any('user_profile_profile' in query['sql'] for query in queries))
+
+
+class BenchAuthTest(TestCase):
+    def test_reports_login_and_registration(self):
+        out = StringIO()
+        call_command('bench_auth', repeat=2, stdout=out)
+        results = json.loads(out.getvalue())
+        self.assertEqual(set(results), {'register', 'login', 'hasher'})
+        self.assertGreater(results['login']['per_second'], 0)
+        self.assertFalse(User.objects.filter(username__startswith='bench_auth_').exists())
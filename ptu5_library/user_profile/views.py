@@ -1,40 +1,22 @@
 from django.shortcuts import render, redirect
-from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
 from django.views.decorators.csrf import csrf_protect
 from django.contrib import messages
-from django.core.validators import validate_email
-from . forms import UserUpdateForm, ProfileUpdateForm
+from library.ratelimit import ip, ratelimit, refund
+from . forms import RegistrationForm, UserUpdateForm, ProfileUpdateForm
 
-User = get_user_model()
 
 @csrf_protect
+@ratelimit('register', '5/h', key=ip)
 def register(request):
-    if request.method == "POST":
-        username = request.POST.get('username')
-        email = request.POST.get('email')
-        password = request.POST.get('password')
-        password2 = request.POST.get('password2')
-        error = False
-        if not username or User.objects.filter(username=username).first():
-            messages.error(request, 'Username not entered or username already exists.')
-            error = True
-        if not email or User.objects.filter(email=email).first():
-            messages.error(request, 'Email not entered or user with this email already exists')
-            error = True
-        else:
-            try:
-                validate_email(email)
-            except:
-                messages.error(request, 'Invalid email.')
-                error = True
-        if not password or not password2 or password != password2:
-            messages.error(request, 'Passwords not entered or do not match.')
-        if not error:
-            User.objects.create_user(username=username, email=email, password=password)
-            messages.success(request, f'User {username} registration succesful, You can log in now.')
-            return redirect('login')
-    return render(request, 'user_profile/register.html')
+    form = RegistrationForm(request.POST or None)
+    # the password is only hashed once the form is valid
+    if request.method == "POST" and form.is_valid() and form.save():
+        messages.success(request, f'User {form.cleaned_data["username"]} registration succesful, You can log in now.')
+        return redirect('login')
+    refund(request)
+    return render(request, 'user_profile/register.html', {'form': form})
+
 
 @login_required
 def profile(request):